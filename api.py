@@ -1,28 +1,43 @@
+import atexit
 import copy
 import datetime
 import logging
 import os
+import time
 import uuid
 from threading import Thread
 
+import openai
 import requests
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify, Response, abort
 from flask_cors import CORS
 from flask_socketio import SocketIO
+from google.api_core.exceptions import GoogleAPIError
 from twilio.rest import Client
 
 from data.message_converter import MessageConverter, get_dialogflow_message_example, get_user_message_example
+from firebaseFolder.firebase_bulk import summarizeBulkResults
 from firebaseFolder.firebase_connection import FirebaseConnection
 from firebaseFolder.firebase_conversation import FirebaseConversation, getDummyConversationDicts
+from firebaseFolder.firebase_listener import listenersEnabled, startMirrors
+from firebaseFolder.firebase_membership import membershipFilterEnabled
+from firebaseFolder.firebase_phone_index import extractPhoneNumber
 from firebaseFolder.firebase_user import FirebaseUser
+from firebaseFolder.firebase_write_queue import FirebaseWriteBehindQueue, writeBehindEnabled
+from orderProcessing.order_cart import OrderCart
 from orderProcessing.order_handler import structureDrink, buildFullOrder, parsePizzaOrder, \
     __convertPizzaOrderToText, convertMultiplePizzaOrderToText
-from dialogflow_session import DialogFlowSession
+from dialogflow_session import DialogFlowSession, extractSessionId, getSessionId
 from gpt.pizza_gpt import getResponseDefaultGPT
 from intentManipulation.intent_manager import IntentManager
+from intentManipulation.local_intent_classifier import LocalIntentClassifier, localIntentClassifierEnabled
+from intentManipulation.session_store import SessionSweeper
 from socketEmissions.socket_emissor import pulseEmit
-from utils import extractDictFromBytesRequest, sendWebhookCallback, _sendTwilioResponse
+from utils.general_utils import extractDictFromBytesRequest, sendWebhookCallback, _sendTwilioResponse
+from utils.circuit_breaker import CircuitOpenError, circuitBreakerReports
+from utils.dialogflow_gateway import DialogflowTimeoutError
+from utils.metrics import metrics
 import json
 
 load_dotenv()
@@ -43,12 +58,24 @@ fc = FirebaseConnection()
 fu = FirebaseUser(fc)
 fcm = FirebaseConversation(fc)
 mc = MessageConverter()
-
-
-def __getAllUsersMappedByPhone() -> dict:
-    """Retrieve all users from the Firebase and map them by phone number."""
-    users = fu.getAllUsers()
-    return {user["phoneNumber"]: user for user in users.values()} if users is not None else {}
+if listenersEnabled():
+    startMirrors(fu, fcm)
+if membershipFilterEnabled():
+    if not listenersEnabled():
+        logging.warning("Membership filter without listeners: signups made by other workers go unseen")
+    fu.loadRegisteredNumbers(falsePositiveRate=float(os.getenv("FIREBASE_MEMBERSHIP_FALSE_POSITIVE_RATE", "0.01")),
+                             exact=os.getenv("FIREBASE_MEMBERSHIP_EXACT", "true").lower() == "true")
+writeQueue = FirebaseWriteBehindQueue.fromEnvironment(fcm).start() if writeBehindEnabled() else None
+if writeQueue is not None:
+    atexit.register(writeQueue.shutdown)
+sessionSweeper = SessionSweeper.fromEnvironment({"signup": IntentManager().sessions,
+                                                 "carts": dialogFlowInstance.carts}).start()
+atexit.register(sessionSweeper.stop)
+localClassifier = LocalIntentClassifier(dialogFlowInstance.speisekarte,
+                                        minConfidence=float(os.getenv("LOCAL_INTENT_MIN_CONFIDENCE", "0.8"))) \
+    if localIntentClassifierEnabled() else None
+# Only asked when Dialogflow or OpenAI failed: it answers every intent, with less certainty than localClassifier
+fallbackClassifier = LocalIntentClassifier(dialogFlowInstance.speisekarte, minConfidence=0.5, intents=None)
 
 
 def __getUserByWhatsappNumber(whatsappNumber: str) -> dict or None:
@@ -57,8 +84,7 @@ def __getUserByWhatsappNumber(whatsappNumber: str) -> dict or None:
         'cpf': '14587544589',
         'name': 'João',
         'phoneNumber': '+5585997548654'}"""
-    users = __getAllUsersMappedByPhone()
-    return users.get(whatsappNumber)
+    return fu.getUserByPhoneNumber(whatsappNumber)
 
 
 def __detectIncomingMessage(userMessage: dict) -> dict:
@@ -101,8 +127,7 @@ def __processTwilioSandboxIncomingMessage(data: dict):
     output = {"body": None, "formattedBody": None}
     if needsToSignUp:
         logging.info("Needs to sign up!")
-        im.extractedParameters["phoneNumber"] = phoneNumber
-        botAnswer = im.twilioSingleStep(receivedMessage)
+        botAnswer = im.twilioSingleStep(receivedMessage, phoneNumber)
         dialogflowResponseJSON = MessageConverter.convert_dialogflow_message(botAnswer, phoneNumber)
         pulseEmit(socketInstance, dialogflowResponseJSON)
         # socketInstance.emit('message', dialogflowResponseJSON)
@@ -111,7 +136,19 @@ def __processTwilioSandboxIncomingMessage(data: dict):
         # __addBotMessageToFirebase(phoneNumber, userMessageJSON)
         return output
     logging.info("Already signup!")
-    dialogflowResponse = dialogFlowInstance.getDialogFlowResponse(receivedMessage)
+    localAnswer = __answerLocally(receivedMessage, phoneNumber, localClassifier) if localClassifier is not None \
+        else None
+    if localAnswer is not None:
+        return MessageConverter.convert_dialogflow_message(localAnswer, phoneNumber)
+    start = time.perf_counter()
+    try:
+        dialogflowResponse = dialogFlowInstance.getDialogFlowResponse(receivedMessage, user_number=phoneNumber)
+    except (CircuitOpenError, DialogflowTimeoutError, GoogleAPIError) as error:
+        logging.warning(f"Dialogflow unavailable ({error}), answering locally")
+        return MessageConverter.convert_dialogflow_message(__answerWithoutNlu(receivedMessage, phoneNumber),
+                                                           phoneNumber)
+    if localClassifier is not None:
+        localClassifier.recordDialogflowLatency(time.perf_counter() - start)
     dialogflowResponseJSON = MessageConverter.convert_dialogflow_message(
         dialogflowResponse.query_result.fulfillment_text, phoneNumber)
     # socketInstance.emit('message', dialogflowResponseJSON)
@@ -122,10 +159,47 @@ def __processTwilioSandboxIncomingMessage(data: dict):
     return dialogflowResponseJSON
 
 
+def __answerLocally(receivedMessage: str, phoneNumber: str, classifier: LocalIntentClassifier) -> str or None:
+    """The answer for messages the local intent classifier is confident about, or None to ask Dialogflow."""
+    start = time.perf_counter()
+    sessionId = getSessionId(phoneNumber)
+
+    def awaitingDrink() -> bool:
+        with dialogFlowInstance.cart(sessionId) as cart:
+            return bool(cart.pizzas) and not cart.drinks
+
+    match = classifier.classify(receivedMessage, awaitingDrink=awaitingDrink)
+    if match is None:
+        return None
+    answer = __fulfillIntent(sessionId, match.intent, receivedMessage, match.parameters)
+    classifier.recordLocalAnswer(match.intent, time.perf_counter() - start)
+    return answer
+
+
+DEGRADED_MESSAGE = "Nosso atendimento está em modo simplificado no momento. Me diga o sabor da pizza, " \
+                   "por exemplo \"uma calabresa\".\n"
+
+
+def __answerWithoutNlu(receivedMessage: str, phoneNumber: str) -> str:
+    """Used while Dialogflow or OpenAI are failing: the webhook handlers answer whatever the fallback classifier
+    recognizes, and anything else gets the menu, so orders keep coming in."""
+    metrics.increment("nlu.local_fallbacks")
+    answer = __answerLocally(receivedMessage, phoneNumber, fallbackClassifier)
+    return answer if answer is not None else DEGRADED_MESSAGE + dialogFlowInstance.getPizzasString()
+
+
 def __addBotMessageToFirebase(phoneNumber, userMessageJSON):
     msgDict = copy.deepcopy(userMessageJSON)
     msgDict["sender"] = "ChatBot"
-    fcm.appendMessageToWhatsappNumber(msgDict, phoneNumber)
+    __persistMessage(msgDict, phoneNumber, countAsUnread=False)
+
+
+def __persistMessage(messageData: dict, whatsappNumber: str, countAsUnread: bool = True):
+    """Goes through the write-behind queue when FIREBASE_WRITE_BEHIND_ENABLED is set, so the request doesn't wait
+    on the database."""
+    if writeQueue is not None:
+        return writeQueue.enqueueMessage(messageData, whatsappNumber, countAsUnread=countAsUnread)
+    return fcm.appendMessageToWhatsappNumber(messageData, whatsappNumber, countAsUnread=countAsUnread)
 
 
 @app.route("/ChatTest", methods=['GET'])
@@ -148,56 +222,83 @@ def send():
     """This is a dialogflow callback endpoint. Everytime a message is sent to the bot, a POST request is sent to this
     endpoint.
     This is under DialogflowEssentials -> Fulfillment"""
-    logging.info("FULLFILLMENT ENDPOINT")
-    dialogFlowInstance.params["secret"] = "Mensagem secreta"
+    start = time.perf_counter()
     requestContent = request.get_json()
-    contexts = [item['name'].split("/")[-1] for item in requestContent['queryResult']['outputContexts']]
-    queryText = requestContent['queryResult']['queryText']
+    queryResult = requestContent['queryResult']
+    sessionId = extractSessionId(requestContent.get("session"))
+    queryText = queryResult['queryText']
     userMessage = [item["name"] for item in queryText] if isinstance(queryText, list) else queryText
-    socketMessage = mc.dynamicConversion(userMessage)
-    # socketInstance.emit('message', socketMessage)
-    pulseEmit(socketInstance, socketMessage)
-    currentIntent = requestContent['queryResult']['intent']['displayName']
-    logging.info(f"current Intent: {currentIntent}")
-    params = requestContent['queryResult']['parameters']
-    if currentIntent == "Order.drink":
-        return __handleOrderDrinkIntent(params, userMessage)
-    elif currentIntent == "Order.pizza - drink no":
-        params = dialogFlowInstance.params
-        fullOrder = buildFullOrder(params)
-        totalPriceDict = dialogFlowInstance.analyzeTotalPrice(fullOrder)
-        finalMessage = totalPriceDict["finalMessage"]
-        return sendWebhookCallback(finalMessage)
-    elif currentIntent == "Order.pizza - drink yes":
-        drinkString = dialogFlowInstance.getDrinksString()
-        return sendWebhookCallback(drinkString)
-    elif currentIntent == "Order.pizza":
-        return __handleOrderPizzaIntent(queryText, requestContent)
-    elif currentIntent == "Welcome":
-        pizzaMenu = dialogFlowInstance.getPizzasString()
-        welcomeString = f"Olá! Bem-vindo à Pizza do Bill! Funcionamos das 17h às 22h.\n {pizzaMenu}." \
-                        f" \nQual pizza você vai querer?"
-        return sendWebhookCallback(welcomeString)
-    return sendWebhookCallback(botMessage="a")
-
-
-def __handleOrderPizzaIntent(queryText: str, requestContent: dict) -> Response:
-    parameters = requestContent['queryResult']['parameters']
-    fullPizza = parsePizzaOrder(userMessage=queryText, parameters=parameters)
+    pulseEmit(socketInstance, mc.dynamicConversion(userMessage))
+    currentIntent = queryResult['intent']['displayName']
+    response = sendWebhookCallback(botMessage=__fulfillIntent(sessionId, currentIntent, userMessage,
+                                                              queryResult['parameters']))
+    metricName = currentIntent if currentIntent in WEBHOOK_HANDLERS else "unhandled"
+    metrics.observe(f"webhook.fulfillment_seconds.{metricName}", time.perf_counter() - start)
+    return response
+
+
+CART_FULL_MESSAGE = "Seu pedido já está no limite de itens. Vamos fechar este pedido antes de adicionar mais."
+WEBHOOK_HANDLERS = {}
+
+
+def webhookHandler(intentName: str):
+    """Registers the decorated function as the answer to the Dialogflow intent with that display name. Handlers
+    take (sessionId, userMessage, params) and return the bot's message."""
+    def register(handler):
+        WEBHOOK_HANDLERS[intentName] = handler
+        return handler
+    return register
+
+
+def __fulfillIntent(sessionId: str, currentIntent: str, userMessage: str, params: dict) -> str:
+    """The bot's answer to a matched intent. Shared by the Dialogflow webhook and the local intent classifier."""
+    handler = WEBHOOK_HANDLERS.get(currentIntent)
+    return handler(sessionId, userMessage, params) if handler is not None else "a"
+
+
+@webhookHandler("Welcome")
+def __handleWelcomeIntent(sessionId: str, userMessage: str, params: dict) -> str:
+    pizzaMenu = dialogFlowInstance.getPizzasString()
+    return f"Olá! Bem-vindo à Pizza do Bill! Funcionamos das 17h às 22h.\n {pizzaMenu}." \
+           f" \nQual pizza você vai querer?"
+
+
+@webhookHandler("Order.pizza")
+def __handleOrderPizzaIntent(sessionId: str, userMessage: str, params: dict) -> str:
+    fullPizza = parsePizzaOrder(userMessage=userMessage, parameters=params)
     fullPizzaText = convertMultiplePizzaOrderToText(fullPizza)
-    dialogFlowInstance.params["pizzas"].append(fullPizza)
-    return sendWebhookCallback(botMessage=f"Maravilha! {fullPizzaText.capitalize()} então. "
-                                          f"Você vai querer alguma bebida?")
+    with dialogFlowInstance.cart(sessionId) as cart:
+        if not cart.addPizza(fullPizza):
+            return CART_FULL_MESSAGE
+    return f"Maravilha! {fullPizzaText.capitalize()} então. Você vai querer alguma bebida?"
+
+
+@webhookHandler("Order.pizza - drink yes")
+def __handleDrinkYesIntent(sessionId: str, userMessage: str, params: dict) -> str:
+    return dialogFlowInstance.getDrinksString()
+
+
+@webhookHandler("Order.pizza - drink no")
+def __handleDrinkNoIntent(sessionId: str, userMessage: str, params: dict) -> str:
+    with dialogFlowInstance.cart(sessionId) as cart:
+        return __closeOrder(cart)
 
 
-def __handleOrderDrinkIntent(params: dict, userMessage: str) -> Response:
+@webhookHandler("Order.drink")
+def __handleOrderDrinkIntent(sessionId: str, userMessage: str, params: dict) -> str:
     drink = structureDrink(params, userMessage)
-    dialogFlowInstance.params["drinks"].append(drink)
-    parameters = dialogFlowInstance.params
-    fullOrder = buildFullOrder(parameters)
+    with dialogFlowInstance.cart(sessionId) as cart:
+        if not cart.addDrink(drink):
+            return CART_FULL_MESSAGE
+        return __closeOrder(cart)
+
+
+def __closeOrder(cart: OrderCart) -> str:
+    """Prices the cart and empties it, so the customer's next order starts from scratch."""
+    fullOrder = buildFullOrder(cart.asParameters())
     totalPriceDict = dialogFlowInstance.analyzeTotalPrice(fullOrder)
-    finalMessage = totalPriceDict["finalMessage"]
-    return sendWebhookCallback(finalMessage)
+    cart.clear()
+    return totalPriceDict["finalMessage"]
 
 
 @app.route("/get_all_users", methods=['GET'])
@@ -222,9 +323,50 @@ def delete_user_by_whatsapp(whatsapp_number: str):
     return jsonify({"Success": f"User with whatsapp {whatsapp_number} deleted"}), 200
 
 
+@app.route("/users/bulk", methods=['POST', 'PUT', 'DELETE'])
+def bulk_users():
+    """JSON list body. POST creates the users, PUT overwrites them (matched by phoneNumber), DELETE removes them
+    (phone numbers or user objects). Answers with one result per row plus a count per status."""
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        return jsonify({"Error": "Expected a JSON list"}), 400
+    if request.method == 'POST':
+        results = fu.createUsers(rows)
+    elif request.method == 'PUT':
+        results = fu.updateUsers(rows)
+    else:
+        results = fu.deleteUsers(__bulkPhoneNumbers(rows))
+    return jsonify({"results": results, "summary": summarizeBulkResults(results)}), 200
+
+
+@app.route("/conversations/bulk", methods=['POST', 'PUT', 'DELETE'])
+def bulk_conversations():
+    """Same contract as /users/bulk, for conversations."""
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        return jsonify({"Error": "Expected a JSON list"}), 400
+    if request.method == 'POST':
+        results = fcm.createConversations(rows)
+    elif request.method == 'PUT':
+        results = fcm.updateConversations(rows)
+    else:
+        results = fcm.deleteConversations(__bulkPhoneNumbers(rows))
+    return jsonify({"results": results, "summary": summarizeBulkResults(results)}), 200
+
+
+def __bulkPhoneNumbers(rows: list) -> list:
+    """DELETE bodies list phone numbers or whole user/conversation objects."""
+    return [extractPhoneNumber(row) if isinstance(row, dict) else row for row in rows]
+
+
 @app.route("/get_user_conversations/<whatsapp_number>", methods=['GET'])
 def get_user_conversations_by_whatsapp(whatsapp_number: str):
-    response = fcm.retrieveAllMessagesByWhatsappNumber(whatsapp_number)
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"Error": "limit must be a positive integer"}), 400
+    response = fcm.retrieveAllMessagesByWhatsappNumber(whatsapp_number, limit=limit,
+                                                       before=request.args.get("before"),
+                                                       after=request.args.get("after"))
     # if response is None:
     #     response = fcm.createFirstDummyConversationByWhatsappNumber(whatsapp_number)
     return ((jsonify(response), 200)
@@ -238,9 +380,7 @@ def add_message():
     data = json.loads(request.data)
     whatsapp_number = data['phoneNumber']
 
-    response = fcm.appendMessageToWhatsappNumber(
-        messageData=data, whatsappNumber=whatsapp_number
-    )
+    response = __persistMessage(messageData=data, whatsappNumber=whatsapp_number)
     return jsonify(response), 200
 
 
@@ -255,7 +395,7 @@ def push_new_message_by_whatsapp_number():
     # if not conversations:
     #     return jsonify({"Error": f"Could not find conversations for the user with whatsapp {whatsapp_number}"}), 404
     message = {"content": data.get("message")}
-    fcm.appendMessageToWhatsappNumber(messageData=message, whatsappNumber=whatsapp_number)
+    __persistMessage(messageData=message, whatsappNumber=whatsapp_number)
     return jsonify({"Success": f"New message pushed for user with whatsapp {whatsapp_number}"}), 200
 
 
@@ -272,8 +412,7 @@ def create_conversation():
 def create_dummy_conversation():
     data = json.loads(request.data.decode("utf-8"))
     dummyMessagePot, dummyPot = getDummyConversationDicts().values()
-    for message in dummyPot:
-        fcm.createConversation(message)
+    fcm.createConversations(dummyPot)
     return jsonify({"Success": "Dummy conversation created"}), 200
 
 
@@ -286,9 +425,30 @@ def update_conversation():
 
 @app.route("/get_all_conversations", methods=['GET'])
 def get_all_conversations():
-    data = fcm.getAllConversations()
-    trimmedData = list(data.values()) if data else None
-    return jsonify(trimmedData), 200
+    """Sidebar listing: reads only conversation summaries, newest first. Accepts limit, since and before
+    (updatedAt epoch milliseconds) for paging and incremental refresh."""
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"Error": "limit must be a positive integer"}), 400
+    summaries = fcm.getConversationSummaries(limit=limit,
+                                             since=request.args.get("since", type=int),
+                                             before=request.args.get("before", type=int))
+    return jsonify(summaries or None), 200
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot["signupSessions"] = IntentManager().getSessionMemoryReport()
+    if fu.registeredNumbers is not None:
+        snapshot["registeredNumbers"] = fu.registeredNumbers.report()
+    if localClassifier is not None:
+        snapshot["localIntents"] = localClassifier.report()
+    if dialogFlowInstance.responseCache is not None:
+        snapshot["detectIntentCache"] = dialogFlowInstance.responseCache.report()
+    snapshot["circuitBreakers"] = circuitBreakerReports()
+    snapshot["fallbackIntents"] = fallbackClassifier.report()
+    return jsonify(snapshot), 200
 
 
 @app.route("/staticReply", methods=['POST'])
@@ -323,7 +483,11 @@ def handle_whatsapp():
 def handle_response():
     data = extractDictFromBytesRequest()
     receivedMessage = data.get("Body")[0]
-    mainResponse = getResponseDefaultGPT(receivedMessage)
+    try:
+        mainResponse = getResponseDefaultGPT(receivedMessage)
+    except (CircuitOpenError, openai.error.OpenAIError) as error:
+        logging.warning(f"OpenAI unavailable ({error}), answering locally")
+        mainResponse = __answerWithoutNlu(receivedMessage, data.get("From", [None])[0])
     image_url = "https://shorturl.at/lEFT0"
     return _sendTwilioResponse(body=mainResponse)
 
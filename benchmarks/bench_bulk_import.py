@@ -0,0 +1,87 @@
+import time
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_storage import MemoryStorageBackend, StorageBackend
+from firebaseFolder.firebase_user import FirebaseUser
+
+# Modelled Realtime Database round trip per request; local work is measured, network time is added per request.
+ROUND_TRIP_SECONDS = 0.080
+
+
+class _CountingQuery:
+    def __init__(self, query, storage):
+        self.query = query
+        self.storage = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self.query, name)
+        if name == "get":
+            def get():
+                self.storage.requests += 1
+                return attr()
+            return get
+        return lambda *args: _CountingQuery(attr(*args), self.storage)
+
+
+class _CountingReference:
+    def __init__(self, reference, storage):
+        self.reference = reference
+        self.storage = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self.reference, name)
+        if name in ("get", "set", "push", "update", "delete", "transaction"):
+            self.storage.requests += 1
+            return attr
+        if name.startswith("order_by"):
+            return lambda *args: _CountingQuery(attr(*args), self.storage)
+        if name == "child":
+            return lambda path: _CountingReference(attr(path), self.storage)
+        return attr
+
+
+class _CountingStorage(StorageBackend):
+    def __init__(self):
+        self.backend = MemoryStorageBackend()
+        self.requests = 0
+
+    def reference(self, path: str = "/"):
+        return _CountingReference(self.backend.reference(path), self)
+
+
+def __importCustomers(customerCount: int, bulk: bool) -> dict:
+    storage = _CountingStorage()
+    firebaseUser = FirebaseUser.__wrapped__(FirebaseConnection.__wrapped__(storage))
+    customers = [{"phoneNumber": f"+5585{index:09d}", "name": f"Cliente {index}"} for index in range(customerCount)]
+    start = time.perf_counter()
+    if bulk:
+        firebaseUser.createUsers(customers)
+    else:
+        for customer in customers:
+            firebaseUser.createUser(customer)
+    local = time.perf_counter() - start
+    return {"requests": storage.requests, "modelled": local + storage.requests * ROUND_TRIP_SECONDS}
+
+
+def benchmarkBulkImport(customerCounts=(100, 1_000, 10_000), maxLoopCustomers: int = 1_000) -> list:
+    """The per-row loop rescans the in-memory collection on every lookup, so it only runs up to maxLoopCustomers;
+    above that its two requests per customer are extrapolated, which is what dominates against a real database."""
+    rows = []
+    for customerCount in customerCounts:
+        loop = (__importCustomers(customerCount, bulk=False) if customerCount <= maxLoopCustomers
+                else {"requests": 2 * customerCount, "modelled": 2 * customerCount * ROUND_TRIP_SECONDS})
+        rows.append({"customers": customerCount, "loop": loop, "bulk": __importCustomers(customerCount, bulk=True)})
+    return rows
+
+
+def __main():
+    print(f"{'customers':>9} | {'loop requests':>13} {'loop modelled':>14} | "
+          f"{'bulk requests':>13} {'bulk modelled':>14}")
+    for row in benchmarkBulkImport():
+        loop, bulk = row["loop"], row["bulk"]
+        print(f"{row['customers']:>9} | {loop['requests']:>13} {loop['modelled']:>13.1f}s | "
+              f"{bulk['requests']:>13} {bulk['modelled']:>13.2f}s")
+
+
+if __name__ == '__main__':
+    __main()
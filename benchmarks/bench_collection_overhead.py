@@ -0,0 +1,79 @@
+import time
+
+import firebase_admin
+import google.auth.credentials
+from firebase_admin import credentials, db
+
+from firebaseFolder.firebase_connection import FirebaseCollection
+
+
+class _AnonymousCredential(credentials.Base):
+    def get_credential(self):
+        return google.auth.credentials.AnonymousCredentials()
+
+
+class _OfflineConnection:
+    """Builds real db.Reference objects (no request is ever sent) so construction cost is measured honestly."""
+
+    def __init__(self):
+        self.app = firebase_admin.initialize_app(_AnonymousCredential(),
+                                                 {"databaseURL": "https://pizza-bench.firebaseio.com"},
+                                                 name="collection-overhead-benchmark")
+        self.cache = None
+        self.connection = self.getReference()
+
+    def getReference(self, path: str = None):
+        return db.reference(f'/{path}' if path else '/', app=self.app)
+
+    def changeDatabaseConnection(self, path: str):
+        self.connection = self.getReference(path)
+
+
+class _LegacyRepointingWrapper:
+    """Replica of the removed FirebaseWrapper: a closure per attribute access plus a repoint per call."""
+
+    def __init__(self, connection: _OfflineConnection):
+        self.connection = connection
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if callable(attr) and not name.startswith("__"):
+            def wrapper(*args, **kwargs):
+                object.__getattribute__(self, "connection").changeDatabaseConnection("users")
+                return attr(*args, **kwargs)
+            return wrapper
+        return attr
+
+    def resolveReference(self, path: str):
+        return self.connection.connection.child(path)
+
+
+class _BoundUsers:
+    def __init__(self, connection: _OfflineConnection):
+        self.collection = FirebaseCollection(connection, "users")
+
+    def resolveReference(self, path: str):
+        return self.collection.connection.child(path)
+
+
+def __timeCalls(instance, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        instance.resolveReference("-user")
+    return (time.perf_counter() - start) / calls
+
+
+def benchmarkCallOverhead(calls: int = 20_000) -> dict:
+    connection = _OfflineConnection()
+    return {"legacy": __timeCalls(_LegacyRepointingWrapper(connection), calls),
+            "bound": __timeCalls(_BoundUsers(connection), calls)}
+
+
+def __main():
+    result = benchmarkCallOverhead()
+    print(f"repointing wrapper: {result['legacy'] * 1e6:8.2f} us/call")
+    print(f"bound collection:   {result['bound'] * 1e6:8.2f} us/call")
+
+
+if __name__ == '__main__':
+    __main()
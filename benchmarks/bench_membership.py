@@ -0,0 +1,38 @@
+import time
+
+from firebaseFolder.firebase_membership import RegisteredNumbers
+
+
+def benchmarkStartup(phoneNumbers: list, exact: bool) -> tuple:
+    start = time.perf_counter()
+    registeredNumbers = RegisteredNumbers.fromPhoneNumbers(phoneNumbers, exact=exact)
+    return registeredNumbers, time.perf_counter() - start
+
+
+def benchmarkLookups(registeredNumbers: RegisteredNumbers, lookups: int) -> float:
+    """Microseconds per lookup of a number that isn't registered, the question every new customer's first message
+    asks."""
+    start = time.perf_counter()
+    for index in range(lookups):
+        registeredNumbers.isRegistered(f"+5586{index:09d}")
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def __main():
+    users = 1_000_000
+    phoneNumbers = [f"+5585{index:09d}" for index in range(users)]
+    for exact in (True, False):
+        registeredNumbers, seconds = benchmarkStartup(phoneNumbers, exact)
+        perLookup = benchmarkLookups(registeredNumbers, 100_000)
+        report = registeredNumbers.report()
+        label = "filter + set" if exact else "filter only"
+        observed = report["observedFalsePositiveRate"]
+        observedText = f"{observed:.4%}" if observed is not None else "n/a (left to storage)"
+        print(f"{label:>12}: built for {users:,} users in {seconds:5.2f} s, {perLookup:4.1f} µs per lookup, "
+              f"filter {report['filterBytes'] / 2 ** 20:5.1f} MiB, set {report['exactSetBytes'] / 2 ** 20:5.1f} MiB, "
+              f"expected false positives {report['expectedFalsePositiveRate']:.4%}, "
+              f"observed {observedText}")
+
+
+if __name__ == '__main__':
+    __main()
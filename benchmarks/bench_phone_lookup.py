@@ -0,0 +1,58 @@
+import time
+
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_user import FirebaseUser
+
+# Rough Realtime Database link model used to turn transferred bytes into wall-clock time.
+ROUND_TRIP_SECONDS = 0.080
+BYTES_PER_SECOND = 2_000_000
+
+
+def __buildDatabase(userCount: int) -> InMemoryDatabase:
+    users = {f"-user{index:07d}": {"phoneNumber": f"+5585{index:09d}", "name": f"Cliente {index}",
+                                   "address": "Rua das Flores 4984", "cpf": "14587544589"}
+             for index in range(userCount)}
+    return InMemoryDatabase({"users": users})
+
+
+def __legacyScan(firebaseUser: FirebaseUser, phoneNumber: str) -> str or None:
+    for uniqueId, userData in (firebaseUser.getAllUsers() or {}).items():
+        if userData["phoneNumber"] == phoneNumber:
+            return uniqueId
+    return None
+
+
+def __measure(database: InMemoryDatabase, lookup, repetitions: int) -> dict:
+    database.bytesRead = 0
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        lookup()
+    elapsed = (time.perf_counter() - start) / repetitions
+    payload = database.bytesRead / repetitions
+    return {"local": elapsed, "payload": payload, "modelled": ROUND_TRIP_SECONDS + payload / BYTES_PER_SECOND}
+
+
+def benchmarkPhoneLookup(userCounts=(100, 1_000, 10_000, 100_000), repetitions: int = 5) -> list:
+    rows = []
+    for userCount in userCounts:
+        database = __buildDatabase(userCount)
+        with inMemoryFirebaseConnection(database) as connection:
+            firebaseUser = FirebaseUser.__wrapped__(connection)
+            target = f"+5585{userCount - 1:09d}"
+            scan = __measure(database, lambda: __legacyScan(firebaseUser, target), repetitions)
+            query = __measure(database, lambda: firebaseUser.getUniqueIdByPhoneNumber(target), repetitions)
+        rows.append({"users": userCount, "scan": scan, "query": query})
+    return rows
+
+
+def __main():
+    print(f"{'users':>8} | {'scan bytes':>12} {'scan modelled':>14} | {'query bytes':>12} {'query modelled':>15}")
+    for row in benchmarkPhoneLookup():
+        scan, query = row["scan"], row["query"]
+        print(f"{row['users']:>8} | {scan['payload']:>12.0f} {scan['modelled'] * 1000:>12.1f}ms | "
+              f"{query['payload']:>12.0f} {query['modelled'] * 1000:>13.1f}ms")
+
+
+if __name__ == '__main__':
+    __main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+
+from intentManipulation.intent_table import INTENT_TABLE
+from intentManipulation.session_state import InProcessStateStore, SqliteStateStore, encodeState, decodeState
+from intentManipulation.session_store import ConversationState, SessionStore
+from orderProcessing.order_cart import OrderCart
+
+
+def __midSignupState(phoneNumber: str) -> ConversationState:
+    """A customer three messages into the signup flow, the largest state the flow holds before it finishes."""
+    state = ConversationState(phoneNumber, INTENT_TABLE.lookup("SIGNUP_CPF").index)
+    state.welcomedMask = INTENT_TABLE.maskOf(["SIGNUP_NAME", "SIGNUP_EMAIL", "SIGNUP_ADDRESS", "SIGNUP_CPF"])
+    state.extractedParameters.update(phoneNumber=phoneNumber, name="Ana Beatriz", address="Rua das Flores 4874")
+    state.userHistory.extend(["Oii", "Ana Beatriz", "Rua das Flores 4874"])
+    state.botHistory.extend(["Olá! Qual o seu nome?", "Qual o seu endereço?", "Qual o seu CPF?"])
+    state.intentHistory.extend([("SIGNUP_NAME", "Qual o seu endereço?"), ("SIGNUP_ADDRESS", "Qual o seu CPF?")])
+    state.count = 3
+    return state
+
+
+def __fullCart(sessionId: str) -> OrderCart:
+    cart = OrderCart(sessionId, maxItems=20)
+    for _ in range(3):
+        cart.addPizza([{"calabresa": 1.0}, {"pepperoni": 0.5, "portuguesa": 0.5}])
+    cart.addDrink({"coca-cola": 2})
+    return cart
+
+
+def benchmarkCodec(state, repetitions: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        blob = encodeState(state)
+    encoded = time.perf_counter()
+    for _ in range(repetitions):
+        decodeState(blob, type(state))
+    decoded = time.perf_counter()
+    return len(blob), (encoded - start) / repetitions, (decoded - encoded) / repetitions
+
+
+def benchmarkMessages(store: SessionStore, customers: int, messages: int) -> float:
+    """Seconds each message spends getting its customer's state and handing it back."""
+    for index in range(customers):
+        with store.session(f"+5585{index:09d}"):
+            pass
+    start = time.perf_counter()
+    for index in range(messages):
+        with store.session(f"+5585{index % customers:09d}") as state:
+            state.count += 1
+    return (time.perf_counter() - start) / messages
+
+
+def __main():
+    for name, state in [("signup state", __midSignupState("+5585999171902")), ("order cart", __fullCart("5585"))]:
+        size, encodeSeconds, decodeSeconds = benchmarkCodec(state, 20_000)
+        print(f"{name:>14}: {size:4d} bytes, encode {encodeSeconds * 1e6:5.1f} µs, decode {decodeSeconds * 1e6:5.1f} µs")
+    customers, messages = 1_000, 20_000
+    with tempfile.TemporaryDirectory() as directory:
+        stateStores = {"local": None, "memory": InProcessStateStore(),
+                       "sqlite": SqliteStateStore(os.path.join(directory, "state.sqlite3"))}
+        for name, stateStore in stateStores.items():
+            store = SessionStore(__midSignupState, stateStore=stateStore)
+            perMessage = benchmarkMessages(store, customers, messages)
+            print(f"{name:>14}: {perMessage * 1e6:7.1f} µs of session state overhead per message")
+            if stateStore is not None:
+                stateStore.close()
+
+
+if __name__ == '__main__':
+    __main()
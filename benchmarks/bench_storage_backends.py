@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_conversation import FirebaseConversation
+from firebaseFolder.firebase_storage import MemoryStorageBackend, SqliteStorageBackend
+from firebaseFolder.firebase_user import FirebaseUser
+
+
+def __simulateInbound(firebaseUser: FirebaseUser, firebaseConversation: FirebaseConversation, index: int):
+    """The storage work api.send() does for one inbound WhatsApp message from a new customer."""
+    phoneNumber = f"+5585{index:09d}"
+    if not firebaseUser.existingUser({"phoneNumber": phoneNumber}):
+        firebaseUser.createUser({"phoneNumber": phoneNumber, "name": f"Cliente {index}"})
+    conversationData = {"phoneNumber": phoneNumber, "name": f"Cliente {index}", "status": "active"}
+    if not firebaseConversation.existingConversation(conversationData):
+        firebaseConversation.createConversation(conversationData)
+    message = {"body": "Quero uma pizza", "from": phoneNumber, "time": "12:00"}
+    firebaseConversation.appendMessageToWhatsappNumber(message, phoneNumber)
+
+
+def benchmarkBackend(storage, messages: int) -> float:
+    connection = FirebaseConnection.__wrapped__(storage)
+    firebaseUser = FirebaseUser.__wrapped__(connection)
+    firebaseConversation = FirebaseConversation.__wrapped__(connection, keyByPhoneNumber=False)
+    start = time.perf_counter()
+    for index in range(messages):
+        __simulateInbound(firebaseUser, firebaseConversation, index % 200)
+    return messages / (time.perf_counter() - start)
+
+
+def __main():
+    messages = 2_000
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {"memory": MemoryStorageBackend(),
+                    "sqlite": SqliteStorageBackend(os.path.join(directory, "bench.sqlite3"))}
+        for name, storage in backends.items():
+            print(f"{name:>8}: {benchmarkBackend(storage, messages):8.0f} inbound messages/s")
+            storage.close()
+
+
+if __name__ == '__main__':
+    __main()
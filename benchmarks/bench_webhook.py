@@ -0,0 +1,69 @@
+"""Time /webhookForIntent spends on each intent, without the network: the request goes through Flask's routing and
+response building, the handler runs against the in-memory backends, and the answer is serialized.
+
+    python -m benchmarks.bench_webhook --repetitions 2000
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from benchmarks.replay_conversations import buildWebhookRequest, loadLocalApi
+
+CONVERSATION = [("Oi", "Welcome", {}),
+                ("Vou querer uma pizza de calabresa", "Order.pizza", {"flavor": ["calabresa"]}),
+                ("Sim", "Order.pizza - drink yes", {}),
+                ("uma coca-cola", "Order.drink", {"Drinks": ["coca-cola"]}),
+                ("Vou querer meia calabresa e meia pepperoni", "Order.pizza", {"flavor": ["calabresa", "pepperoni"]}),
+                ("Não", "Order.pizza - drink no", {})]
+
+
+def benchmarkWebhook(api, repetitions: int) -> dict:
+    """Mean seconds per webhook call, by intent."""
+    app = api.app
+    sessionPath = api.dialogFlowInstance.getSessionPath("+5585999171902")
+    payloads = [(intent, buildWebhookRequest(sessionPath, text, intent, parameters))
+                for text, intent, parameters in CONVERSATION]
+    totals = dict.fromkeys((intent for intent, _ in payloads), 0.0)
+    counts = dict.fromkeys(totals, 0)
+    for _ in range(repetitions):
+        for intent, payload in payloads:
+            with app.test_request_context("/webhookForIntent", method="POST", json=payload):
+                start = time.perf_counter()
+                app.full_dispatch_request()
+                totals[intent] += time.perf_counter() - start
+            counts[intent] += 1
+    return {intent: totals[intent] / counts[intent] for intent in totals}
+
+
+def benchmarkSerialization(repetitions: int) -> tuple:
+    """The answer's serialization before (indented and printed) and after (compact, silent)."""
+    answer = {"source": "dialogFlow", "fulfillmentText": "Vai ser 1 x Pizza de calabresa (R$17.50), totalizando "
+                                                         "R$17.50. Qual vai ser a forma de pagamento? (pix/cartão)"}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            print(json.dumps(answer, indent=4))
+        indented = time.perf_counter()
+        for _ in range(repetitions):
+            json.dumps(answer, ensure_ascii=False, separators=(",", ":"))
+        compact = time.perf_counter()
+    return (indented - start) / repetitions, (compact - indented) / repetitions
+
+
+def __main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the fulfillment webhook.")
+    parser.add_argument("--repetitions", type=int, default=2000)
+    arguments = parser.parse_args()
+    api = loadLocalApi()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        perIntent = benchmarkWebhook(api, arguments.repetitions)
+    for intent, seconds in perIntent.items():
+        print(f"{intent:>24}: {seconds * 1e6:7.1f} µs per call")
+    indented, compact = benchmarkSerialization(arguments.repetitions * 10)
+    print(f"{'serialization':>24}: {indented * 1e6:7.1f} µs indented and printed, {compact * 1e6:5.1f} µs compact")
+
+
+if __name__ == '__main__':
+    __main()
@@ -0,0 +1,64 @@
+import time
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_conversation import FirebaseConversation, getDummyConversationDicts
+from firebaseFolder.firebase_storage import MemoryStorageBackend
+from firebaseFolder.firebase_write_queue import FirebaseWriteBehindQueue
+from utils.metrics import MetricsRegistry
+
+# Modelled Realtime Database round trip for one update() call.
+ROUND_TRIP_SECONDS = 0.080
+
+
+class _SlowReference:
+    def __init__(self, reference):
+        self.reference = reference
+        self.calls = 0
+
+    def update(self, value: dict):
+        self.calls += 1
+        time.sleep(ROUND_TRIP_SECONDS)
+        self.reference.update(value)
+
+
+def __buildConversations(conversationCount: int):
+    connection = FirebaseConnection.__wrapped__(MemoryStorageBackend())
+    firebaseConversation = FirebaseConversation.__wrapped__(connection, keyByPhoneNumber=False)
+    phoneNumbers = [f"+5585{index:09d}" for index in range(conversationCount)]
+    for phoneNumber in phoneNumbers:
+        firebaseConversation.createConversation(getDummyConversationDicts(phoneNumber=phoneNumber)["dummyPot"][0])
+    firebaseConversation.rootReference = _SlowReference(firebaseConversation.rootReference)
+    return firebaseConversation, phoneNumbers
+
+
+def benchmarkWriteBehind(messages: int = 200, conversationCount: int = 20) -> dict:
+    inline, phoneNumbers = __buildConversations(conversationCount)
+    start = time.perf_counter()
+    for index in range(messages):
+        inline.appendMessageToWhatsappNumber({"body": f"msg {index}"}, phoneNumbers[index % conversationCount])
+    inlineRequest = (time.perf_counter() - start) / messages
+
+    queued, phoneNumbers = __buildConversations(conversationCount)
+    registry = MetricsRegistry()
+    writeQueue = FirebaseWriteBehindQueue(queued, workers=4, metrics=registry).start()
+    start = time.perf_counter()
+    for index in range(messages):
+        writeQueue.enqueueMessage({"body": f"msg {index}"}, phoneNumbers[index % conversationCount])
+        time.sleep(0.002)
+    queuedRequest = (time.perf_counter() - start) / messages - 0.002
+    writeQueue.shutdown()
+    return {"inlineRequest": inlineRequest, "inlineUpdates": inline.rootReference.calls,
+            "queuedRequest": queuedRequest, "queuedUpdates": queued.rootReference.calls,
+            "metrics": registry.snapshot()}
+
+
+def __main():
+    result = benchmarkWriteBehind()
+    lag = result["metrics"]["histograms"]["firebase_write_queue.queue_lag_seconds"]
+    print(f"inline: {result['inlineRequest'] * 1000:7.2f} ms per request, {result['inlineUpdates']} updates")
+    print(f"queued: {result['queuedRequest'] * 1000:7.2f} ms per request, {result['queuedUpdates']} updates, "
+          f"persisted within p95 {lag['p95'] * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    __main()
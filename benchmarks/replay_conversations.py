@@ -0,0 +1,174 @@
+"""Replays recorded conversations through the bot in-process, against an in-memory database and a stand-in for
+Dialogflow, and reports latency percentiles and throughput.
+
+The corpus is JSONL, one transcript per line: {"phoneNumber": "+5585...", "messages": [...]}. A message that is
+a plain string is a signup step and goes through IntentManager.twilioSingleStep; one shaped like
+{"text": ..., "intent": ..., "parameters": {...}} is what Dialogflow matched, and is posted to /webhookForIntent
+the way Dialogflow's fulfillment would post it.
+
+    python -m benchmarks.replay_conversations corpus.jsonl --concurrency 8
+    python -m benchmarks.replay_conversations --generate 500 --concurrency 8
+"""
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+LOCAL_ENVIRONMENT = {"TWILIO_ACCOUNT_SID": "AC00000000000000000000000000000000", "TWILIO_AUTH_TOKEN": "replay",
+                     "TWILIO_PHONE_NUMBER": "+10000000000", "DIALOGFLOW_PROJECT_ID": "replay"}
+
+
+class LocalDialogflowClient:
+    """Stands in for dialogflow.SessionsClient: builds session paths and answers detect_intent with an empty
+    fulfillment, since replayed transcripts already carry the intent Dialogflow matched."""
+
+    def __init__(self, *args, **kwargs):
+        self.detectIntentCalls = 0
+
+    @staticmethod
+    def session_path(project: str, session: str) -> str:
+        return f"projects/{project}/agent/sessions/{session}"
+
+    def detect_intent(self, request=None, **kwargs):
+        self.detectIntentCalls += 1
+        queryResult = SimpleNamespace(fulfillment_text="", fulfillment_messages=[], intent=None, parameters={},
+                                      output_contexts=[])
+        return SimpleNamespace(query_result=queryResult)
+
+
+def loadLocalApi():
+    """Imports api.py wired to the in-memory storage backend and LocalDialogflowClient. The storage backend is
+    forced, so a .env pointing at the real database is never used by a replay."""
+    os.environ["FIREBASE_STORAGE_BACKEND"] = "memory"
+    for name, value in LOCAL_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    import dialogflow_session
+    with patch.object(dialogflow_session.dialogflow, "SessionsClient", LocalDialogflowClient):
+        import api
+    return api
+
+
+def buildWebhookRequest(sessionPath: str, text: str, intent: str, parameters: dict = None) -> dict:
+    """The parts of a Dialogflow ES fulfillment request that send() reads."""
+    return {"session": sessionPath,
+            "queryResult": {"queryText": text, "parameters": parameters or {}, "intent": {"displayName": intent},
+                            "outputContexts": []}}
+
+
+def loadCorpus(filePath: str) -> list:
+    with open(filePath, encoding="utf-8") as corpusFile:
+        return [json.loads(line) for line in corpusFile if line.strip()]
+
+
+def generateCorpus(customers: int) -> list:
+    """Half the customers sign up, the other half order a pizza and a drink."""
+    transcripts = []
+    for index in range(customers):
+        phoneNumber = f"+5585{index:09d}"
+        if index % 2 == 0:
+            name = "Cliente " + "".join(chr(ord("a") + int(digit)) for digit in str(index))
+            messages = ["Oi", name, f"Rua das Flores {index}", f"{index:011d}"]
+        else:
+            messages = [{"text": "Oi", "intent": "Welcome"},
+                        {"text": "Vou querer uma pizza de calabresa", "intent": "Order.pizza",
+                         "parameters": {"flavor": ["calabresa"]}},
+                        {"text": "Sim", "intent": "Order.pizza - drink yes"},
+                        {"text": "Uma Coca-cola", "intent": "Order.drink", "parameters": {"Drinks": ["Coca-cola"]}}]
+        transcripts.append({"phoneNumber": phoneNumber, "messages": messages})
+    return transcripts
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ReplayHarness:
+    """Replays transcripts `concurrency` at a time; the messages of one transcript are always sent in order."""
+
+    def __init__(self, api, concurrency: int = 8):
+        self.api = api
+        self.concurrency = concurrency
+        self.intentManager = api.IntentManager()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def __postWebhook(self, payload: dict):
+        """Dispatches through Flask's routing, error handling and response building, without a socket."""
+        app = self.api.app
+        with app.test_request_context("/webhookForIntent", method="POST", json=payload):
+            return app.full_dispatch_request()
+
+    def __sendStep(self, transcript: dict, message) -> str:
+        phoneNumber = transcript["phoneNumber"]
+        if isinstance(message, str):
+            self.intentManager.twilioSingleStep(message, phoneNumber)
+            return "signup"
+        sessionPath = self.api.dialogFlowInstance.getSessionPath(phoneNumber)
+        payload = buildWebhookRequest(sessionPath, message["text"], message["intent"], message.get("parameters"))
+        response = self.__postWebhook(payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"/webhookForIntent answered {response.status_code}")
+        return f"webhook {message['intent']}"
+
+    def __replayTranscript(self, transcript: dict):
+        for message in transcript["messages"]:
+            start = time.perf_counter()
+            try:
+                label = self.__sendStep(transcript, message)
+            except Exception as exception:
+                with self.lock:
+                    self.errors[type(exception).__name__] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies[label].append(elapsed)
+
+    def replay(self, transcripts: list) -> dict:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self.__replayTranscript, transcripts))
+            elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        steps = {}
+        for label, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            steps[label] = {"count": len(ordered), "p50": _percentile(ordered, 0.50),
+                            "p95": _percentile(ordered, 0.95), "p99": _percentile(ordered, 0.99),
+                            "max": ordered[-1]}
+        completed = sum(step["count"] for step in steps.values())
+        return {"steps": steps, "completed": completed, "errors": dict(self.errors), "seconds": elapsed,
+                "stepsPerSecond": completed / elapsed if elapsed else None}
+
+
+def printReport(report: dict):
+    print(f"{'step':<34}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for label, step in report["steps"].items():
+        print(f"{label:<34}{step['count']:>7}{step['p50'] * 1e3:>9.2f}{step['p95'] * 1e3:>9.2f}"
+              f"{step['p99'] * 1e3:>9.2f}{step['max'] * 1e3:>9.2f}")
+    print(f"{report['completed']} steps in {report['seconds']:.2f} s ({report['stepsPerSecond']:.0f} steps/s), "
+          f"errors: {report['errors'] or 'none'}")
+
+
+def __main():
+    parser = argparse.ArgumentParser(description="Replay conversation transcripts through the bot in-process.")
+    parser.add_argument("corpus", nargs="?", help="JSONL file of transcripts")
+    parser.add_argument("--generate", type=int, default=200, help="synthetic customers when no corpus is given")
+    parser.add_argument("--concurrency", type=int, default=8)
+    arguments = parser.parse_args()
+    transcripts = loadCorpus(arguments.corpus) if arguments.corpus else generateCorpus(arguments.generate)
+    harness = ReplayHarness(loadLocalApi(), concurrency=arguments.concurrency)
+    printReport(harness.replay(transcripts))
+
+
+if __name__ == '__main__':
+    __main()
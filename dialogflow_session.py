@@ -1,10 +1,15 @@
 import os
+import re
 import google.cloud.dialogflow_v2 as dialogflow
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 
 from data.speisekarte_extraction import loadSpeisekarte, createMenuString, analyzeTotalPrice
+from intentManipulation.local_intent_classifier import normalizeText
 from references.path_reference import getDialogflowJsonPath
+from utils.circuit_breaker import getCircuitBreaker
+from utils.dialogflow_cache import DetectIntentCache, detectIntentCacheEnabled, menuVersion
+from utils.dialogflow_gateway import DialogflowGateway, asyncDialogflowEnabled
 
 
 def singleton(cls):
@@ -15,43 +20,103 @@ def singleton(cls):
             instances[cls] = cls(*args, **kwargs)
         return instances[cls]
 
+    get_instance.__wrapped__ = cls
     return get_instance
 
 
-def update_connection_decorator(func):
-    def wrapper(self, *args, **kwargs):
-        self.updateConnection()
-        return func(self, *args, **kwargs)
+ANONYMOUS_SESSION_ID = "anonymous"
 
-    return wrapper
+
+def getSessionId(phoneNumber: str = None) -> str:
+    """Dialogflow session id of a customer: the digits of their phone number."""
+    digits = re.sub(r"\D", "", str(phoneNumber or "").split(":")[-1])
+    return digits or ANONYMOUS_SESSION_ID
+
+
+def extractSessionId(sessionPath: str) -> str:
+    """'projects/p/agent/sessions/5585999171902' (optionally under environments/users) -> '5585999171902'."""
+    _, _, rest = str(sessionPath or "").partition("/sessions/")
+    return rest.split("/")[0] or ANONYMOUS_SESSION_ID
 
 
 @singleton
 class DialogFlowSession:
     def __init__(self):
+        # Imported here: session_store pulls in firebaseFolder, which imports singleton from this module
+        from intentManipulation.session_state import createStateStore
+        from intentManipulation.session_store import SessionStore
+        from orderProcessing.order_cart import OrderCart
+
         self.speisekarte = loadSpeisekarte()
-        self.params = {"pizzas": [], "drinks": []}
+        self.carts = SessionStore(OrderCart, maxSessions=int(os.getenv("ORDER_CART_MAX_SESSIONS", "10000")),
+                                  idleTtl=float(os.getenv("ORDER_CART_IDLE_SECONDS", "3600")), keyFunction=str,
+                                  stateStore=createStateStore("carts"))
         dialogflowJsonFilePath = getDialogflowJsonPath()
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = dialogflowJsonFilePath
         self.sessionClient = dialogflow.SessionsClient()
-        self.session = self.sessionClient.session_path(os.environ["DIALOGFLOW_PROJECT_ID"], "abc")
+        self.timeout = float(os.getenv("DIALOGFLOW_TIMEOUT_SECONDS", "5"))
+        self.gateway = DialogflowGateway.fromEnvironment() if asyncDialogflowEnabled() else None
+        self.breaker = getCircuitBreaker("dialogflow")
+        self.responseCache = DetectIntentCache.fromEnvironment(normalizeText) if detectIntentCacheEnabled() else None
+        self.agentVersion = os.getenv("DIALOGFLOW_AGENT_VERSION", "")
+        self.__updateCacheVersion()
+        self.projectId = os.environ["DIALOGFLOW_PROJECT_ID"]
+        self.session = self.getSessionPath()
         self.agentName = self.session.split('/')[1]
         self.twiml = MessagingResponse()
 
+    def getSessionPath(self, user_number: str = None) -> str:
+        return self.sessionClient.session_path(self.projectId, getSessionId(user_number))
+
+    def cart(self, sessionId: str):
+        """`with dialogFlowInstance.cart(sessionId) as cart:` gives exclusive access to that customer's cart."""
+        return self.carts.session(sessionId)
+
     def getDialogFlowResponse(self, message: str, intent_name: str = None, user_number: str = None):
-        session = self.session
+        session = self.getSessionPath(user_number)
 
         session_params = dialogflow.types.QueryParameters(payload={"phone-number": user_number})
 
         if intent_name:
-            session = f"{self.session}/contexts/{intent_name}"
+            session = f"{session}/contexts/{intent_name}"
         textInput = dialogflow.types.TextInput(text=message, language_code='pt-BR')
         queryInput = dialogflow.types.QueryInput(text=textInput)
 
         requests = dialogflow.types.DetectIntentRequest(
             session=session, query_input=queryInput, query_params=session_params
         )
-        return self.sessionClient.detect_intent(request=requests)
+        if self.responseCache is None or intent_name:
+            return self.__detectIntent(requests)
+        sessionId = getSessionId(user_number)
+        with self.cart(sessionId) as cart:
+            contexts = cart.dialogflowContexts
+        cacheKey, cachedResponse = self.responseCache.lookup(message, textInput.language_code, contexts)
+        if cachedResponse is not None:
+            return cachedResponse
+        response = self.__detectIntent(requests)
+        contexts = self.responseCache.store(cacheKey, response)
+        with self.cart(sessionId) as cart:
+            cart.dialogflowContexts = contexts
+        return response
+
+    def __detectIntent(self, requests):
+        """Raises CircuitOpenError without calling Dialogflow while its breaker is open."""
+        if self.gateway is not None:
+            return self.breaker.call(self.gateway.detectIntent, requests)
+        return self.breaker.call(self.sessionClient.detect_intent, request=requests, timeout=self.timeout)
+
+    def __updateCacheVersion(self):
+        """Cached responses embed the agent's replies and the menu, so they're dropped when either changes."""
+        if self.responseCache is not None:
+            self.responseCache.setVersion((self.agentVersion, menuVersion(self.speisekarte)))
+
+    def reloadSpeisekarte(self):
+        self.speisekarte = loadSpeisekarte()
+        self.__updateCacheVersion()
+
+    def setAgentVersion(self, agentVersion: str):
+        self.agentVersion = agentVersion
+        self.__updateCacheVersion()
 
     @staticmethod
     def extractTextFromDialogflowResponse(dialogflowResponse: dialogflow.types.DetectIntentResponse):
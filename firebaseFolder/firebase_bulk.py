@@ -0,0 +1,39 @@
+import logging
+from collections import Counter
+
+BULK_ROWS_PER_BATCH = 500
+
+
+def writeInBatches(reference, rowUpdates: list, rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> list:
+    """Sends rowUpdates (one multi-path dict per row) with one update() per `rowsPerBatch` rows, so a row is never
+    split across requests. Returns one entry per row: None when written, otherwise the exception its batch raised."""
+    outcomes = []
+    for start in range(0, len(rowUpdates), rowsPerBatch):
+        chunk = rowUpdates[start:start + rowsPerBatch]
+        merged = {}
+        for rowUpdate in chunk:
+            merged.update(rowUpdate)
+        error = None
+        try:
+            if merged:
+                reference.update(merged)
+        except Exception as exception:
+            logging.warning(f"Bulk write of {len(chunk)} rows failed: {exception}")
+            error = exception
+        outcomes.extend([error] * len(chunk))
+    return outcomes
+
+
+def bulkRowResult(index: int, phoneNumber: str or None, status: str, key: str = None) -> dict:
+    return {"index": index, "phoneNumber": phoneNumber, "status": status, "key": key}
+
+
+def applyBatchOutcomes(writtenResults: list, outcomes: list):
+    """Marks the rows whose batch failed; `writtenResults` and `outcomes` are aligned row by row."""
+    for result, error in zip(writtenResults, outcomes):
+        if error is not None:
+            result.update(status="failed", error=str(error))
+
+
+def summarizeBulkResults(results: list) -> dict:
+    return dict(Counter(result["status"] for result in results))
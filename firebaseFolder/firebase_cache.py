@@ -0,0 +1,209 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def _splitPath(path: str) -> tuple:
+    return tuple(segment for segment in str(path).split("/") if segment)
+
+
+def _isRelated(firstPath: tuple, secondPath: tuple) -> bool:
+    """True when one path is an ancestor of (or equal to) the other."""
+    shortest = min(len(firstPath), len(secondPath))
+    return firstPath[:shortest] == secondPath[:shortest]
+
+
+def parseCacheTtls(rawConfig: str) -> dict:
+    """'users:30,conversationIndex:300' -> {('users',): 30.0, ('conversationIndex',): 300.0}"""
+    ttls = {}
+    for entry in (rawConfig or "").split(","):
+        if ":" not in entry:
+            continue
+        path, ttl = entry.strip().rsplit(":", 1)
+        ttls[_splitPath(path)] = float(ttl)
+    return ttls
+
+
+class FirebaseReadCache:
+    """Size-bounded LRU of Realtime Database reads with a TTL per configured path prefix. Paths that match no
+    configured prefix are never cached, so caching is opt-in per collection."""
+
+    def __init__(self, pathTtls: dict, maxEntries: int = 1024, clock=time.monotonic):
+        self.pathTtls = pathTtls
+        self.maxEntries = maxEntries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0
+
+    @classmethod
+    def fromEnvironment(cls):
+        pathTtls = parseCacheTtls(os.getenv("FIREBASE_CACHE_TTLS"))
+        maxEntries = int(os.getenv("FIREBASE_CACHE_MAX_ENTRIES", "1024"))
+        return cls(pathTtls, maxEntries) if pathTtls else None
+
+    def getTtl(self, path: str) -> float or None:
+        segments = _splitPath(path)
+        for length in range(len(segments), -1, -1):
+            if segments[:length] in self.pathTtls:
+                return self.pathTtls[segments[:length]]
+        return None
+
+    def get(self, path: str, variant: str = ""):
+        """Returns (found, value)."""
+        key = (_splitPath(path), variant)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, path: str, value, variant: str = "", generation: int = None):
+        """`generation` is the value read before fetching; if any invalidation happened since, the fetched value
+        may predate a write and is dropped instead of cached."""
+        ttl = self.getTtl(path)
+        if ttl is None:
+            return
+        key = (_splitPath(path), variant)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (self.clock() + ttl, copy.deepcopy(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        segments = _splitPath(path)
+        with self.lock:
+            staleKeys = [key for key in self.entries if _isRelated(key[0], segments)]
+            for key in staleKeys:
+                del self.entries[key]
+            self.invalidations += len(staleKeys)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "invalidations": self.invalidations, "entries": len(self.entries),
+                    "hitRate": self.hits / lookups if lookups else 0.0}
+
+
+class CachedQuery:
+    def __init__(self, query, reference, cache: FirebaseReadCache, description: str):
+        self.query = query
+        self.reference = reference
+        self.cache = cache
+        self.description = description
+
+    def __chain(self, methodName: str, *args):
+        chainedQuery = getattr(self.query, methodName)(*args)
+        return CachedQuery(chainedQuery, self.reference, self.cache, f"{self.description}|{methodName}{args!r}")
+
+    def start_at(self, start):
+        return self.__chain("start_at", start)
+
+    def end_at(self, end):
+        return self.__chain("end_at", end)
+
+    def equal_to(self, value):
+        return self.__chain("equal_to", value)
+
+    def limit_to_first(self, limit: int):
+        return self.__chain("limit_to_first", limit)
+
+    def limit_to_last(self, limit: int):
+        return self.__chain("limit_to_last", limit)
+
+    def get(self):
+        generation = self.cache.generation
+        found, value = self.cache.get(self.reference.path, self.description)
+        if found:
+            return value
+        value = self.query.get()
+        self.cache.put(self.reference.path, value, self.description, generation)
+        return value
+
+
+class CachedReference:
+    """Read-through proxy around a db.Reference. Every write made through it (or through any reference derived
+    from it with child()) invalidates the cached reads of the written path, its ancestors and its descendants."""
+
+    def __init__(self, reference, cache: FirebaseReadCache):
+        self.reference = reference
+        self.cache = cache
+
+    @property
+    def key(self):
+        return self.reference.key
+
+    @property
+    def path(self):
+        return self.reference.path
+
+    def child(self, path: str):
+        return CachedReference(self.reference.child(path), self.cache)
+
+    def get(self, etag=False, shallow=False):
+        if etag or shallow:
+            return self.reference.get(etag=etag, shallow=shallow)
+        generation = self.cache.generation
+        found, value = self.cache.get(self.path)
+        if found:
+            return value
+        value = self.reference.get()
+        self.cache.put(self.path, value, generation=generation)
+        return value
+
+    def set(self, value):
+        self.reference.set(value)
+        self.cache.invalidate(self.path)
+
+    def push(self, value=''):
+        pushedReference = self.reference.push(value)
+        self.cache.invalidate(self.path)
+        return CachedReference(pushedReference, self.cache)
+
+    def update(self, value: dict):
+        self.reference.update(value)
+        for childPath in value:
+            self.cache.invalidate(f"{self.path}/{childPath}")
+
+    def delete(self):
+        self.reference.delete()
+        self.cache.invalidate(self.path)
+
+    def transaction(self, transaction_update):
+        try:
+            return self.reference.transaction(transaction_update)
+        finally:
+            self.cache.invalidate(self.path)
+
+    def listen(self, callback):
+        return self.reference.listen(callback)
+
+    def order_by_child(self, path: str):
+        return CachedQuery(self.reference.order_by_child(path), self, self.cache, f"child:{path}")
+
+    def order_by_key(self):
+        return CachedQuery(self.reference.order_by_key(), self, self.cache, "key")
+
+    def order_by_value(self):
+        return CachedQuery(self.reference.order_by_value(), self, self.cache, "value")
@@ -5,6 +5,10 @@ from dotenv import load_dotenv
 from firebase_admin import credentials, db
 
 from dialogflow_session import singleton
+from firebaseFolder.firebase_bulk import BULK_ROWS_PER_BATCH, writeInBatches
+from firebaseFolder.firebase_cache import FirebaseReadCache, CachedReference
+from firebaseFolder.firebase_storage import MemoryStorageBackend, RealtimeDatabaseBackend, SqliteStorageBackend, \
+    StorageBackend, generatePushKey, serverIncrement, serverTimestamp
 from references.path_reference import getFirebaseSDKPath
 
 
@@ -29,21 +33,52 @@ def getFirebaseCredentials():
     return credentials.Certificate(firebase_credentials)
 
 
-@singleton
-class FirebaseConnection:
-    def __init__(self):
-        load_dotenv()
+def createStorageBackend() -> StorageBackend:
+    """FIREBASE_STORAGE_BACKEND picks where data lives: "firebase" (default, the Realtime Database at
+    FIREBASE_DATABASE_URL), "memory" or "sqlite" (file at FIREBASE_SQLITE_PATH). The local ones need no
+    credentials and are meant for load tests and offline development."""
+    load_dotenv()
+    backendName = os.getenv("FIREBASE_STORAGE_BACKEND", "firebase").lower()
+    if backendName == "memory":
+        return MemoryStorageBackend()
+    if backendName == "sqlite":
+        return SqliteStorageBackend(os.getenv("FIREBASE_SQLITE_PATH", "firebase_local.sqlite3"))
+    if backendName == "firebase":
         cred = getFirebaseCredentials()
-        self.app = firebase_admin.initialize_app(cred, {"databaseURL": os.getenv("FIREBASE_DATABASE_URL")})
-        self.connection = db.reference('/', app=self.app)
+        app = firebase_admin.initialize_app(cred, {"databaseURL": os.getenv("FIREBASE_DATABASE_URL")})
+        return RealtimeDatabaseBackend(app)
+    raise ValueError(f"Unknown FIREBASE_STORAGE_BACKEND: {backendName}")
 
-    def changeDatabaseConnection(self, path: str) -> db.reference:
-        self.connection = db.reference(f'/{path}', app=self.app)
+
+class FirebaseReferenceOperations:
+    """Data operations on `self.connection`; paths are relative to it."""
+    connection = None
 
     def readData(self, path: str = None) -> db.reference:
         ref = self.connection.child(path) if path is not None else self.connection
         return ref.get()
 
+    def readDataByChild(self, childKey: str, value, path: str = None) -> dict:
+        """Server-side equality query. Needs an ".indexOn" rule for childKey (see database.rules.json)."""
+        ref = self.connection.child(path) if path is not None else self.connection
+        return ref.order_by_child(childKey).equal_to(value).get() or {}
+
+    def queryData(self, path: str = None, orderByChild: str = None, startAt=None, endAt=None,
+                  limitToFirst: int = None, limitToLast: int = None) -> dict:
+        """Ordered range query (by key unless orderByChild is given); only the selected children are transferred."""
+        ref = self.connection.child(path) if path is not None else self.connection
+        query = ref.order_by_child(orderByChild) if orderByChild is not None else ref.order_by_key()
+        if startAt is not None:
+            query = query.start_at(startAt)
+        if endAt is not None:
+            query = query.end_at(endAt)
+        if limitToFirst is not None:
+            query = query.limit_to_first(limitToFirst)
+        if limitToLast is not None:
+            query = query.limit_to_last(limitToLast)
+        result = query.get() or {}
+        return dict(enumerate(result)) if isinstance(result, list) else result
+
     def writeData(self, path: str = None, data=None) -> bool:
         if data is None:
             data = {"dummyData": 5}
@@ -58,25 +93,91 @@ class FirebaseConnection:
         ref.set(data)
         return True
 
+    def updateData(self, path: str = None, data: dict = None) -> bool:
+        """Multi-path update: keys may be nested paths ("messagePot/<key>") and are written atomically."""
+        ref = self.connection.child(path) if path is not None else self.connection
+        ref.update(data)
+        return True
+
+    def updateDataInBatches(self, rowUpdates: list, path: str = None,
+                            rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> list:
+        """Chunked multi-path update, see writeInBatches."""
+        ref = self.connection.child(path) if path is not None else self.connection
+        return writeInBatches(ref, rowUpdates, rowsPerBatch)
+
+    def incrementData(self, path: str = None, delta: int = 1) -> int:
+        """Transactional counter update on a single leaf; returns the committed value."""
+        ref = self.connection.child(path) if path is not None else self.connection
+        return ref.transaction(lambda currentValue: (currentValue or 0) + delta)
+
     def deleteData(self, path: str = None, data=None) -> bool:
-        user_id = self.getUniqueIdByData(path, data)
-        if user_id is None:
-            raise ValueError("User ID cannot be None")
+        uniqueId = self.getUniqueIdByData(path, data)
+        if uniqueId is None:
+            raise ValueError("No stored node matches data")
+        return self.deleteDataByKey(uniqueId, path)
+
+    def deleteDataByKey(self, key: str, path: str = None) -> bool:
+        """Removes `<path>/<key>` with a single delete."""
+        if not key:
+            raise ValueError("Key cannot be empty")
         ref = self.connection.child(path) if path is not None else self.connection
-        user_ref = ref.child(user_id)
-        user_ref.delete()
+        ref.child(key).delete()
         return True
 
+    def deleteDataByKeys(self, keys, path: str = None) -> int:
+        """Removes many children of `path` in one multi-path update; returns how many keys were sent."""
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if keys:
+            ref = self.connection.child(path) if path is not None else self.connection
+            ref.update({key: None for key in keys})
+        return len(keys)
+
     def deleteAllData(self) -> bool:
         ref = self.connection
         ref.delete()
         return True
 
-    def getUniqueIdByData(self, path: str = None, data=None):
+    def getUniqueIdByData(self, path: str = None, data=None) -> str or None:
+        """Key of the first child of `path` whose value equals data. Reads every child, so callers that know an
+        indexed field (users and conversations know the phone number) should resolve the key through it instead."""
         if data is None:
             raise ValueError("Data cannot be None")
         ref = self.connection.child(path) if path is not None else self.connection
-        return ref.push(data).key
+        children = ref.get() or {}
+        if isinstance(children, list):
+            children = dict(enumerate(children))
+        return next((str(key) for key, value in children.items() if value == data), None)
+
+
+@singleton
+class FirebaseConnection(FirebaseReferenceOperations):
+    def __init__(self, storage: StorageBackend = None):
+        load_dotenv()
+        self.storage = storage if storage is not None else createStorageBackend()
+        self.cache = FirebaseReadCache.fromEnvironment()
+        self.connection = self.getReference()
+
+    def changeDatabaseConnection(self, path: str) -> db.reference:
+        self.connection = self.getReference(path)
+
+    def getReference(self, path: str = None) -> db.reference:
+        """Absolute reference that ignores the current changeDatabaseConnection target. Goes through the read
+        cache when FIREBASE_CACHE_TTLS enables it."""
+        reference = self.storage.reference(f'/{path}' if path else '/')
+        return CachedReference(reference, self.cache) if self.cache is not None else reference
+
+    def bindCollection(self, path: str):
+        return FirebaseCollection(self, path)
+
+
+class FirebaseCollection(FirebaseReferenceOperations):
+    """Same operations as FirebaseConnection, bound once to `/<path>`. The reference never changes, so several
+    collections can be used from different threads without repointing a shared connection."""
+
+    def __init__(self, firebaseConnection: FirebaseConnection, path: str):
+        self.firebaseConnection = firebaseConnection
+        self.path = path
+        self.connection = firebaseConnection.getReference(path)
 
 
 def __main():
@@ -1,56 +1,136 @@
 import datetime
+import os
 import random
 import uuid
 from typing import List
 
-from dialogflow_session import singleton, update_connection_decorator
-from firebaseFolder.firebase_connection import FirebaseConnection
-from firebaseFolder.firebase_core_wrapper import FirebaseWrapper
+from dialogflow_session import singleton
+from firebaseFolder.firebase_bulk import BULK_ROWS_PER_BATCH, applyBatchOutcomes, bulkRowResult, writeInBatches
+from firebaseFolder.firebase_connection import FirebaseConnection, generatePushKey, serverIncrement, \
+    serverTimestamp
+from firebaseFolder.firebase_conversation_summary import FirebaseConversationSummaries, buildConversationSummary, \
+    SUMMARY_FIELDS
+from firebaseFolder.firebase_phone_index import FirebasePhoneIndex, normalizePhoneNumber, extractPhoneNumber
+
+
+CONVERSATIONS_PATH = "conversations"
 
 
 @singleton
-class FirebaseConversation(FirebaseWrapper):
-    def __init__(self, inputFirebaseConnection: FirebaseConnection):
-        super().__init__()
+class FirebaseConversation:
+    def __init__(self, inputFirebaseConnection: FirebaseConnection, keyByPhoneNumber: bool = None):
         self.firebaseConnection = inputFirebaseConnection
-
-    def updateConnection(self):
-        self.firebaseConnection.changeDatabaseConnection("conversations")
+        self.collection = inputFirebaseConnection.bindCollection(CONVERSATIONS_PATH)
+        self.rootReference = inputFirebaseConnection.getReference()
+        self.phoneIndex = FirebasePhoneIndex(inputFirebaseConnection, "conversationIndex")
+        self.summaries = FirebaseConversationSummaries(inputFirebaseConnection, "conversationSummaries")
+        self.indexMirror = None
+        if keyByPhoneNumber is None:
+            keyByPhoneNumber = os.getenv("CONVERSATIONS_KEYED_BY_PHONE", "false").lower() == "true"
+        self.keyByPhoneNumber = keyByPhoneNumber
 
     def getAllConversations(self):
-        return self.firebaseConnection.readData()
+        return self.collection.readData()
 
     def getUniqueIdByWhatsappNumber(self, whatsappNumber: str) -> str or None:
-        # sourcery skip: use-next
-        allConversations = self.getAllConversations()
-        if allConversations is None:
+        if self.indexMirror is not None and self.indexMirror.ready:
+            return self.indexMirror.getKey(whatsappNumber)
+        return self.phoneIndex.getKey(whatsappNumber)
+
+    def getConversationSummaries(self, limit: int = None, since: int = None, before: int = None) -> List[dict]:
+        return self.summaries.listSummaries(limit=limit, since=since, before=before)
+
+    def rebuildPhoneIndex(self) -> int:
+        """Migration helper: indexes every stored conversation. Reads the whole collection once."""
+        return self.phoneIndex.rebuild(self.getAllConversations())
+
+    def rebuildSummaries(self) -> int:
+        """Migration helper: recomputes every conversation summary. Reads the whole collection once."""
+        return self.summaries.rebuild(self.getAllConversations())
+
+    def __getKeysByNormalizedPhone(self) -> dict:
+        """The whole phone index in one read (or from the mirror), so bulk operations don't resolve row by row."""
+        if self.indexMirror is not None and self.indexMirror.ready:
+            return self.indexMirror.snapshot()
+        return self.phoneIndex.getAllKeys()
+
+    def __buildNewConversationUpdate(self, conversationData: dict) -> tuple:
+        """With keyByPhoneNumber the conversation lives at conversations/<normalized phone>. The conversation, its
+        summary and its index entry go in one root multi-path update. Returns (uniqueId, rootUpdate)."""
+        normalizedPhone = normalizePhoneNumber(extractPhoneNumber(conversationData))
+        uniqueId = normalizedPhone if self.keyByPhoneNumber else generatePushKey()
+        summary = buildConversationSummary(conversationData)
+        return uniqueId, {f"{CONVERSATIONS_PATH}/{uniqueId}": conversationData,
+                          f"{self.summaries.summaryPath}/{uniqueId}": summary,
+                          f"{self.phoneIndex.indexPath}/{normalizedPhone}": uniqueId}
+
+    @staticmethod
+    def __normalizedPhoneOf(conversationData: dict) -> str:
+        phoneNumber = extractPhoneNumber(conversationData) if isinstance(conversationData, dict) else None
+        return normalizePhoneNumber(phoneNumber) if phoneNumber else ""
+
+    def __storeNewConversation(self, conversationData: dict) -> str or None:
+        """None, writing nothing, when the phone number is missing: an empty index key would overwrite the whole
+        index (and, keyed by phone, every conversation)."""
+        if not self.__normalizedPhoneOf(conversationData):
             return None
-        for uniqueId, conversationData in allConversations.items():
-            phoneNumber = conversationData.get("phoneNumber", None)
-            if phoneNumber == whatsappNumber:
-                return uniqueId
-        return None
+        uniqueId, rootUpdate = self.__buildNewConversationUpdate(conversationData)
+        self.rootReference.update(rootUpdate)
+        return uniqueId
 
-    def appendMessageToWhatsappNumber(self, messageData: dict, whatsappNumber: str):
+    def appendMessageToWhatsappNumber(self, messageData: dict, whatsappNumber: str, countAsUnread: bool = True):
+        """Pushes the message as its own messagePot child. lastMessage, the unread counter and the conversation
+        summary are written in the same multi-path update, so the cost doesn't grow with the history and
+        concurrent appends can't collide."""
         uniqueId = self.getUniqueIdByWhatsappNumber(whatsappNumber)
         if not uniqueId:
             return False
-        conversationData = self.firebaseConnection.readData(path=uniqueId)
-        if "messagePot" not in conversationData:
-            conversationData["messagePot"] = []
-        messageData["id"] = str(uuid.uuid4())
-        conversationData["messagePot"].append(messageData)
-        self.firebaseConnection.overWriteData(path=uniqueId, data=conversationData)
+        messageData["id"] = generatePushKey()
+        self.rootReference.update(self.buildMessageUpdate(uniqueId, messageData, countAsUnread))
         return messageData
 
-    def retrieveAllMessagesByWhatsappNumber(self, whatsappNumber: str) -> List[dict] or None:
+    def buildMessageUpdate(self, uniqueId: str, messageData: dict, countAsUnread: bool = True) -> dict:
+        """Root multi-path update that stores messageData (keyed by its "id") in the conversation `uniqueId`."""
+        messageKey = messageData["id"]
+        conversationPath = f"{CONVERSATIONS_PATH}/{uniqueId}"
+        summaryPath = f"{self.summaries.summaryPath}/{uniqueId}"
+        rootUpdate = {f"{conversationPath}/messagePot/{messageKey}": messageData,
+                      f"{conversationPath}/lastMessage": messageData,
+                      f"{summaryPath}/lastMessage": messageData,
+                      f"{summaryPath}/updatedAt": serverTimestamp()}
+        if countAsUnread:
+            rootUpdate[f"{conversationPath}/unreadMessages"] = serverIncrement(1)
+            rootUpdate[f"{summaryPath}/unreadMessages"] = serverIncrement(1)
+        return rootUpdate
+
+    def buildConversationUpdate(self, uniqueId: str, fields: dict) -> dict:
+        """Root multi-path update setting top-level conversation fields; summary fields are kept in sync."""
+        rootUpdate = {f"{CONVERSATIONS_PATH}/{uniqueId}/{field}": value for field, value in fields.items()}
+        summaryFields = [field for field in SUMMARY_FIELDS if field in fields]
+        for field in summaryFields:
+            rootUpdate[f"{self.summaries.summaryPath}/{uniqueId}/{field}"] = fields[field]
+        if summaryFields:
+            rootUpdate[f"{self.summaries.summaryPath}/{uniqueId}/updatedAt"] = serverTimestamp()
+        return rootUpdate
+
+    def retrieveAllMessagesByWhatsappNumber(self, whatsappNumber: str, limit: int = None, before: str = None,
+                                            after: str = None) -> List[dict] or None:
+        """Messages in chronological order, each tagged with its storage "key". `before`/`after` are keys from a
+        previous page (exclusive); with `limit` only that many messages are read, the newest ones unless `after`
+        is given."""
         uniqueId = self.getUniqueIdByWhatsappNumber(whatsappNumber)
         if not uniqueId:
             return None
-        conversationData = self.firebaseConnection.readData(path=uniqueId)
-        if "messagePot" not in conversationData:
-            return None
-        return conversationData["messagePot"]
+        forward = after is not None and before is None
+        pageSize = None if limit is None else limit + (before is not None) + (after is not None)
+        messagePot = self.collection.queryData(path=f"{uniqueId}/messagePot", startAt=after, endAt=before,
+                                                       limitToFirst=pageSize if forward else None,
+                                                       limitToLast=None if forward else pageSize)
+        messages = [dict(message, key=str(key)) for key, message in messagePot.items()
+                    if message is not None and str(key) not in (before, after)]
+        if limit is not None:
+            messages = messages[:limit] if forward else messages[len(messages) - limit:]
+        return messages or None
 
     def createFirstDummyConversationByWhatsappNumber(self, msgDict: dict):
         whatsappNumber = msgDict.get("phoneNumber", None)
@@ -62,50 +142,138 @@ class FirebaseConversation(FirebaseWrapper):
                             "status": "active", "unreadMessages": 1,
                             "msgPot": [{"body": body, "id": str(uuid.uuid4()), "phoneNumber": "+5585999171902",
                                         "sender": "User", "time": currentTime}]}
-        self.firebaseConnection.writeData(data=conversationData)
+        if self.__storeNewConversation(conversationData) is None:
+            return "Could not create a dummy conversation without a phone number."
         return "Dummy conversation created successfully."
 
     def existingConversation(self, inputConversationData: dict) -> bool:
-        uniqueId = self.getUniqueIdByWhatsappNumber(inputConversationData["phoneNumber"])
+        uniqueId = self.getUniqueIdByWhatsappNumber(extractPhoneNumber(inputConversationData))
         return uniqueId is not None
 
     def createConversation(self, conversationData: dict) -> bool:
-        existingConversation = self.existingConversation(conversationData)
-        return (
-            False if existingConversation
-            else self.firebaseConnection.writeData(data=conversationData)
-        )
+        if not self.__normalizedPhoneOf(conversationData) or self.existingConversation(conversationData):
+            return False
+        return self.__storeNewConversation(conversationData) is not None
 
     def updateConversation(self, conversationData: dict) -> bool:
+        """Overwrites the stored conversation and its summary in one root multi-path update."""
         uniqueId = self.getUniqueIdByWhatsappNumber(conversationData["phoneNumber"])
-        return (
-            self.firebaseConnection.overWriteData(path=uniqueId, data=conversationData)
-            if uniqueId is not None
-            else False
-        )
-
-    def updateConversationAddingUnreadMessages(self, messageData: dict) -> bool:
-        uniqueId = self.getUniqueIdByWhatsappNumber(messageData["phoneNumber"])
+        if uniqueId is None:
+            return False
+        self.rootReference.update({f"{CONVERSATIONS_PATH}/{uniqueId}": conversationData,
+                                   f"{self.summaries.summaryPath}/{uniqueId}": buildConversationSummary(
+                                       conversationData)})
+        return True
+
+    def createConversations(self, conversations: List[dict], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Bulk createConversation: dedupes against one read of the phone index (and within `conversations`),
+        then writes conversation, summary and index entry of each row in chunked root multi-path updates. Returns
+        one result per input row with status created, duplicate, invalid or failed."""
+        knownKeys = self.__getKeysByNormalizedPhone()
+        results, writtenResults, rowUpdates = [], [], []
+        for index, conversationData in enumerate(conversations):
+            phoneNumber = extractPhoneNumber(conversationData) if isinstance(conversationData, dict) else None
+            normalizedPhone = self.__normalizedPhoneOf(conversationData)
+            if not normalizedPhone:
+                results.append(bulkRowResult(index, phoneNumber, "invalid"))
+            elif normalizedPhone in knownKeys:
+                results.append(bulkRowResult(index, phoneNumber, "duplicate", knownKeys[normalizedPhone]))
+            else:
+                uniqueId, rootUpdate = self.__buildNewConversationUpdate(conversationData)
+                knownKeys[normalizedPhone] = uniqueId
+                rowUpdates.append(rootUpdate)
+                results.append(bulkRowResult(index, phoneNumber, "created", uniqueId))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, writeInBatches(self.rootReference, rowUpdates, rowsPerBatch))
+        return results
+
+    def updateConversations(self, conversations: List[dict], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Bulk overwrite of stored conversations (matched by phone number), refreshing their summaries too.
+        Status updated, missing, invalid or failed."""
+        knownKeys = self.__getKeysByNormalizedPhone()
+        results, writtenResults, rowUpdates = [], [], []
+        for index, conversationData in enumerate(conversations):
+            phoneNumber = extractPhoneNumber(conversationData) if isinstance(conversationData, dict) else None
+            uniqueId = knownKeys.get(normalizePhoneNumber(phoneNumber)) if phoneNumber else None
+            if not phoneNumber:
+                results.append(bulkRowResult(index, phoneNumber, "invalid"))
+            elif uniqueId is None:
+                results.append(bulkRowResult(index, phoneNumber, "missing"))
+            else:
+                rowUpdates.append({f"{CONVERSATIONS_PATH}/{uniqueId}": conversationData,
+                                   f"{self.summaries.summaryPath}/{uniqueId}": buildConversationSummary(
+                                       conversationData)})
+                results.append(bulkRowResult(index, phoneNumber, "updated", uniqueId))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, writeInBatches(self.rootReference, rowUpdates, rowsPerBatch))
+        return results
+
+    def incrementUnreadMessages(self, whatsappNumber: str, delta: int = 1) -> int or None:
+        uniqueId = self.getUniqueIdByWhatsappNumber(whatsappNumber)
         if not uniqueId:
             return None
-        conversationData = self.firebaseConnection.readData(path=uniqueId)
+        unreadMessages = self.collection.incrementData(path=f"{uniqueId}/unreadMessages", delta=delta)
+        self.summaries.reference.child(uniqueId).update({"unreadMessages": serverIncrement(delta),
+                                                         "updatedAt": serverTimestamp()})
+        return unreadMessages
+
+    def resetUnreadMessages(self, whatsappNumber: str) -> bool:
+        uniqueId = self.getUniqueIdByWhatsappNumber(whatsappNumber)
+        if not uniqueId:
+            return False
+        self.rootReference.update({f"{CONVERSATIONS_PATH}/{uniqueId}/unreadMessages": 0,
+                                   f"{self.summaries.summaryPath}/{uniqueId}/unreadMessages": 0})
+        return True
+
+    def updateConversationAddingUnreadMessages(self, messageData: dict) -> dict or None:
+        """Bumps the unread counter, or resets it when messageData carries an 'unreadMessages' key."""
+        whatsappNumber = messageData["phoneNumber"]
         if 'unreadMessages' not in messageData:
-            conversationData["unreadMessages"] = conversationData["unreadMessages"] + 1
+            unreadMessages = self.incrementUnreadMessages(whatsappNumber)
         else:
-            conversationData["unreadMessages"] = 0
-        self.firebaseConnection.overWriteData(path=uniqueId, data=conversationData)
-        return conversationData
+            unreadMessages = 0 if self.resetUnreadMessages(whatsappNumber) else None
+        if unreadMessages is None:
+            return None
+        return {"phoneNumber": whatsappNumber, "unreadMessages": unreadMessages}
 
     def deleteConversation(self, conversationData: dict) -> bool:
-        uniqueId = self.getUniqueIdByWhatsappNumber(conversationData["phoneNumber"])
-        return (
-            self.firebaseConnection.deleteData(path=uniqueId)
-            if uniqueId is not None
-            else False
-        )
+        """False when there is no such conversation or its delete failed."""
+        return self.deleteConversations([extractPhoneNumber(conversationData)])[0]["status"] == "deleted"
+
+    def deleteConversations(self, whatsappNumbers: List[str], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Removes each conversation together with its summary and index entry, in chunked root multi-path
+        updates. A single number resolves through one index leaf, several through one read of the whole index.
+        Returns one result per input number with status deleted, missing, duplicate, invalid or failed."""
+        if len(whatsappNumbers) == 1:
+            knownKeys = {normalizePhoneNumber(whatsappNumber): self.getUniqueIdByWhatsappNumber(whatsappNumber)
+                         for whatsappNumber in whatsappNumbers if whatsappNumber}
+        else:
+            knownKeys = self.__getKeysByNormalizedPhone()
+        results, writtenResults, rowUpdates = [], [], []
+        deletedKeys = set()
+        for index, whatsappNumber in enumerate(whatsappNumbers):
+            normalizedPhone = normalizePhoneNumber(whatsappNumber) if whatsappNumber else None
+            uniqueId = knownKeys.get(normalizedPhone) if normalizedPhone else None
+            if not normalizedPhone:
+                results.append(bulkRowResult(index, whatsappNumber, "invalid"))
+            elif uniqueId is None:
+                results.append(bulkRowResult(index, whatsappNumber, "missing"))
+            elif uniqueId in deletedKeys:
+                results.append(bulkRowResult(index, whatsappNumber, "duplicate", uniqueId))
+            else:
+                deletedKeys.add(uniqueId)
+                rowUpdates.append({f"{CONVERSATIONS_PATH}/{uniqueId}": None,
+                                   f"{self.summaries.summaryPath}/{uniqueId}": None,
+                                   f"{self.phoneIndex.indexPath}/{normalizedPhone}": None})
+                results.append(bulkRowResult(index, whatsappNumber, "deleted", uniqueId))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, writeInBatches(self.rootReference, rowUpdates, rowsPerBatch))
+        return results
 
     def deleteAllConversations(self):
-        return self.firebaseConnection.deleteAllData()
+        self.phoneIndex.clear()
+        self.summaries.clear()
+        return self.collection.deleteAllData()
 
 
 def getDummyConversationDicts(username: str = "John", phoneNumber: str = "+558599171902", _from: str = "whatsapp"):
@@ -133,9 +301,7 @@ def __createDummyConversations():
     for username, phoneNumber, _from in zip(dictParameters[::3], dictParameters[1::3], dictParameters[2::3]):
         dicts = getDummyConversationDicts(username=username, phoneNumber=phoneNumber, _from=_from)
         dictPot.append(dicts)
-    for _dict in dictPot:
-        for conversation in _dict["dummyPot"]:
-            fcm.createConversation(conversation)
+    fcm.createConversations([conversation for _dict in dictPot for conversation in _dict["dummyPot"]])
 
 
 def checkNewUser(whatsappNumber: str, numberPot: List[str],
@@ -0,0 +1,44 @@
+from typing import List
+
+from firebaseFolder.firebase_connection import FirebaseConnection, serverTimestamp
+from firebaseFolder.firebase_phone_index import extractPhoneNumber
+
+SUMMARY_FIELDS = ("from", "name", "status", "lastMessage", "unreadMessages")
+
+
+def buildConversationSummary(conversationData: dict) -> dict:
+    summary = {field: conversationData[field] for field in SUMMARY_FIELDS if conversationData.get(field) is not None}
+    summary["phoneNumber"] = extractPhoneNumber(conversationData)
+    summary["updatedAt"] = serverTimestamp()
+    return summary
+
+
+class FirebaseConversationSummaries:
+    """Denormalized `<summaryPath>/<conversation key>` projection (name, last message, unread badge, updatedAt)
+    that the dashboard sidebar reads instead of whole conversations."""
+
+    def __init__(self, firebaseConnection: FirebaseConnection, summaryPath: str):
+        self.summaryPath = summaryPath
+        self.reference = firebaseConnection.getReference(summaryPath)
+
+    def listSummaries(self, limit: int = None, since: int = None, before: int = None) -> List[dict]:
+        """Most recently updated first. `since`/`before` are updatedAt epoch milliseconds (inclusive/exclusive)."""
+        query = self.reference.order_by_child("updatedAt")
+        if since is not None:
+            query = query.start_at(since)
+        if before is not None:
+            query = query.end_at(before - 1)
+        if limit is not None:
+            query = query.limit_to_last(limit)
+        summaries = query.get() or {}
+        return [dict(summary, key=key) for key, summary in reversed(list(summaries.items()))]
+
+    def clear(self):
+        self.reference.delete()
+
+    def rebuild(self, conversations: dict) -> int:
+        summaries = {uniqueId: buildConversationSummary(conversationData)
+                     for uniqueId, conversationData in (conversations or {}).items()
+                     if isinstance(conversationData, dict)}
+        self.reference.set(summaries)
+        return len(summaries)
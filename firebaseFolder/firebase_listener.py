@@ -0,0 +1,230 @@
+import copy
+import logging
+import os
+import threading
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_phone_index import normalizePhoneNumber
+from firebaseFolder.firebase_storage import LocalDbRef
+
+
+def _splitPath(path: str) -> list:
+    return [segment for segment in str(path).split("/") if segment]
+
+
+class _FirebaseListener:
+    """Adapts a firebase_admin listener, whose ListenerRegistration gives no public way to notice a dead stream.
+    firebase_admin calls the callback from the stream's own thread, so that thread is remembered on the first
+    event: the stream is dead once it ended (its connection could not be reopened) or once the callback raised.
+    Dropped connections that firebase_admin reopens by itself are not deaths: the server answers the new
+    connection with a fresh root snapshot, which resyncs the mirror in place."""
+
+    def __init__(self, reference, callback):
+        self.callback = callback
+        self.failed = False
+        self.streamThread = None
+        self.registration = reference.listen(self.__onEvent)
+
+    def __onEvent(self, event):
+        self.streamThread = threading.current_thread()
+        try:
+            self.callback(event)
+        except Exception as exception:
+            logging.warning(f"Listener callback failed: {exception}")
+            self.failed = True
+            raise
+
+    def isAlive(self) -> bool:
+        return not self.failed and (self.streamThread is None or self.streamThread.is_alive())
+
+    def close(self):
+        self.registration.close()
+
+
+class FirebaseMirror:
+    """In-process copy of one Realtime Database node, kept current by a `listen()` stream.
+
+    `listenFactory(callback)` must return an object with `isAlive()` and `close()`; by default it opens a
+    firebase_admin listener on `path`. A supervisor thread reopens the stream with exponential backoff whenever
+    it dies. While disconnected the mirror reports not ready and callers fall back to reading storage."""
+
+    def __init__(self, firebaseConnection: FirebaseConnection, path: str, listenFactory=None,
+                 initialBackoff: float = 0.5, maxBackoff: float = 30.0, pollInterval: float = 0.5):
+        self.firebaseConnection = firebaseConnection
+        self.path = path
+        self.listenFactory = listenFactory or self.__listenToFirebase
+        self.initialBackoff = initialBackoff
+        self.maxBackoff = maxBackoff
+        self.pollInterval = pollInterval
+        self.data = {}
+        self.lock = threading.RLock()
+        self.readyEvent = threading.Event()
+        self.stopEvent = threading.Event()
+        self.supervisor = None
+        self.reconnects = 0
+        self.eventCount = 0
+
+    def __listenToFirebase(self, callback):
+        reference = self.firebaseConnection.getReference(self.path)
+        if isinstance(reference, LocalDbRef):
+            return reference.listen(callback)  # Local storage listeners report their own liveness
+        return _FirebaseListener(reference, callback)
+
+    @property
+    def ready(self) -> bool:
+        return self.readyEvent.is_set()
+
+    def start(self):
+        self.stopEvent.clear()
+        self.supervisor = threading.Thread(target=self.__supervise, name=f"mirror-{self.path}", daemon=True)
+        self.supervisor.start()
+        return self
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.supervisor is not None:
+            self.supervisor.join()
+
+    def waitUntilReady(self, timeout: float = None) -> bool:
+        return self.readyEvent.wait(timeout)
+
+    def __supervise(self):
+        backoff = self.initialBackoff
+        while not self.stopEvent.is_set():
+            listener = None
+            try:
+                listener = self.listenFactory(self.onEvent)
+                while listener.isAlive() and not self.stopEvent.wait(self.pollInterval):
+                    if self.ready:
+                        backoff = self.initialBackoff
+            except Exception as exception:
+                logging.warning(f"Listener on /{self.path} failed: {exception}")
+            finally:
+                self.readyEvent.clear()
+                if listener is not None:
+                    self.__closeQuietly(listener)
+            if self.stopEvent.wait(backoff):
+                break
+            self.reconnects += 1
+            backoff = min(backoff * 2, self.maxBackoff)
+
+    @staticmethod
+    def __closeQuietly(listener):
+        try:
+            listener.close()
+        except Exception as exception:
+            logging.warning(f"Could not close listener: {exception}")
+
+    def onEvent(self, event):
+        """Applies a `put`/`patch` event; the first root `put` is the full snapshot and marks the mirror ready."""
+        segments = _splitPath(event.path)
+        with self.lock:
+            if event.event_type == "put":
+                self.__setNode(segments, event.data)
+                if not segments:
+                    self.readyEvent.set()
+            elif event.event_type == "patch":
+                for childPath, value in (event.data or {}).items():
+                    self.__setNode(segments + _splitPath(childPath), value)
+            else:
+                return
+            self.eventCount += 1
+            self.onChange(segments, event)
+        if self.firebaseConnection.cache is not None:
+            self.firebaseConnection.cache.invalidate("/".join([self.path] + segments))
+
+    def __setNode(self, segments: list, value):
+        if not segments:
+            self.data = copy.deepcopy(value) if isinstance(value, dict) else {}
+            return
+        node = self.data
+        for segment in segments[:-1]:
+            if not isinstance(node.get(segment), dict):
+                node[segment] = {}
+            node = node[segment]
+        if value is None:
+            node.pop(segments[-1], None)
+        else:
+            node[segments[-1]] = copy.deepcopy(value)
+
+    def onChange(self, segments: list, event):
+        """Hook for subclasses that keep derived lookups; called under the mirror lock."""
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            return copy.deepcopy(self.data.get(key, default))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+
+class FirebaseUserMirror(FirebaseMirror):
+    """Mirror of `users` with a phone-number lookup maintained incrementally from the event stream."""
+
+    def __init__(self, firebaseConnection: FirebaseConnection, path: str = "users", **kwargs):
+        super().__init__(firebaseConnection, path, **kwargs)
+        self.keysByPhone = {}
+        self.phonesByKey = {}
+        self.registeredNumbers = None
+
+    def trackRegisteredNumbers(self, registeredNumbers):
+        """Keeps `registeredNumbers` current with every signup and deletion the stream reports, whichever worker
+        made them. The numbers already mirrored are added on the spot."""
+        with self.lock:
+            self.registeredNumbers = registeredNumbers
+            for phoneNumber in self.keysByPhone:
+                registeredNumbers.add(phoneNumber)
+
+    def onChange(self, segments: list, event):
+        if segments:
+            changedKeys = {segments[0]}
+        elif event.event_type == "patch":
+            changedKeys = {_splitPath(childPath)[0] for childPath in (event.data or {})}
+        else:
+            # A root put replaces everything, including users deleted while the stream was down
+            changedKeys = set(self.data) | set(self.phonesByKey)
+        for key in changedKeys:
+            previousPhone = self.phonesByKey.pop(key, None)
+            if previousPhone is not None and self.keysByPhone.get(previousPhone) == key:
+                del self.keysByPhone[previousPhone]
+                if self.registeredNumbers is not None:
+                    self.registeredNumbers.discard(previousPhone)
+            userData = self.data.get(key)
+            if isinstance(userData, dict) and userData.get("phoneNumber"):
+                self.keysByPhone[userData["phoneNumber"]] = key
+                self.phonesByKey[key] = userData["phoneNumber"]
+                if self.registeredNumbers is not None:
+                    self.registeredNumbers.add(userData["phoneNumber"])
+
+    def getUsersByPhoneNumber(self, phoneNumber: str) -> dict:
+        with self.lock:
+            key = self.keysByPhone.get(phoneNumber)
+            return {key: copy.deepcopy(self.data[key])} if key is not None else {}
+
+
+class FirebaseIndexMirror(FirebaseMirror):
+    """Mirror of a `<normalized phone> -> key` index node such as conversationIndex."""
+
+    def getKey(self, phoneNumber: str) -> str or None:
+        return self.get(normalizePhoneNumber(phoneNumber))
+
+
+def listenersEnabled() -> bool:
+    return os.getenv("FIREBASE_LISTENERS_ENABLED", "false").lower() == "true"
+
+
+def startMirrors(firebaseUser, firebaseConversation, waitTimeout: float = 10.0):
+    """Attaches and starts the users and conversationIndex mirrors; blocks until both have their first snapshot
+    (or the timeout passes, in which case lookups keep going to storage until they catch up)."""
+    connection = firebaseUser.firebaseConnection
+    userMirror = FirebaseUserMirror(connection)
+    if firebaseUser.registeredNumbers is not None:
+        userMirror.trackRegisteredNumbers(firebaseUser.registeredNumbers)
+    userMirror.start()
+    indexMirror = FirebaseIndexMirror(connection, firebaseConversation.phoneIndex.indexPath).start()
+    firebaseUser.mirror = userMirror
+    firebaseConversation.indexMirror = indexMirror
+    userMirror.waitUntilReady(waitTimeout)
+    indexMirror.waitUntilReady(waitTimeout)
+    return userMirror, indexMirror
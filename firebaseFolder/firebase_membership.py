@@ -0,0 +1,136 @@
+import hashlib
+import math
+import os
+import sys
+import threading
+
+
+def membershipFilterEnabled() -> bool:
+    return os.getenv("FIREBASE_MEMBERSHIP_FILTER_ENABLED", "false").lower() == "true"
+
+
+class BloomFilter:
+    """Bit array sized for `capacity` keys at `falsePositiveRate`. Positions come from double hashing one 128-bit
+    BLAKE2b digest, so each key is hashed once whatever the number of hash functions."""
+
+    def __init__(self, capacity: int, falsePositiveRate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.falsePositiveRate = falsePositiveRate
+        self.bitCount = max(8, math.ceil(-capacity * math.log(falsePositiveRate) / math.log(2) ** 2))
+        self.hashCount = max(1, round(self.bitCount / capacity * math.log(2)))
+        self.bits = bytearray((self.bitCount + 7) // 8)
+        self.count = 0
+
+    def __positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.bitCount for index in range(self.hashCount)]
+
+    def add(self, key: str):
+        self.update([key])
+
+    def update(self, keys):
+        """Bulk add; the hashing is inlined because loading every registered user at startup is the hot path."""
+        bits, bitCount, hashRange = self.bits, self.bitCount, range(self.hashCount)
+        blake2b, fromBytes = hashlib.blake2b, int.from_bytes
+        added = 0
+        for key in keys:
+            digest = blake2b(key.encode(), digest_size=16).digest()
+            first, second = fromBytes(digest[:8], "little"), fromBytes(digest[8:], "little") | 1
+            for index in hashRange:
+                position = (first + index * second) % bitCount
+                bits[position >> 3] |= 1 << (position & 7)
+            added += 1
+        self.count += added
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(key))
+
+    def expectedFalsePositiveRate(self) -> float:
+        return (1 - math.exp(-self.hashCount * self.count / self.bitCount)) ** self.hashCount
+
+    @property
+    def memoryBytes(self) -> int:
+        return sys.getsizeof(self.bits)
+
+
+class RegisteredNumbers:
+    """Phone numbers of the registered users, answering "is this number registered?" without I/O whenever it can.
+
+    The Bloom filter settles every definite "no". With `exact` the numbers are also kept in a set, which settles
+    the "maybe"s too and lets the filter be rebuilt when it outgrows its capacity; without it a "maybe" is left to
+    storage (isRegistered returns None) and memory stays at a few bytes per user. Deleted numbers leave their bits
+    set, which only costs false positives until the next rebuild.
+
+    FirebaseUser.existingUser trusts the "no" answers and confirms the "yes" ones. Signups made by other workers
+    only reach it through the users mirror (FirebaseUserMirror.trackRegisteredNumbers), so run it with the
+    listeners enabled when several workers share the database."""
+
+    def __init__(self, capacity: int, falsePositiveRate: float = 0.01, exact: bool = True):
+        self.falsePositiveRate = falsePositiveRate
+        self.exact = exact
+        self.numbers = set() if exact else None
+        self.filter = BloomFilter(capacity, falsePositiveRate)
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.definiteNegatives = 0
+        self.falsePositives = 0
+
+    @classmethod
+    def fromPhoneNumbers(cls, phoneNumbers: list, falsePositiveRate: float = 0.01, exact: bool = True,
+                         headroom: float = 2.0):
+        registeredNumbers = cls(int(len(phoneNumbers) * headroom) + 1024, falsePositiveRate, exact)
+        registeredNumbers.filter.update(phoneNumbers)
+        if exact:
+            registeredNumbers.numbers.update(phoneNumbers)
+        return registeredNumbers
+
+    def __len__(self) -> int:
+        return len(self.numbers) if self.exact else self.filter.count
+
+    def add(self, phoneNumber: str):
+        with self.lock:
+            if self.exact:
+                if phoneNumber in self.numbers:
+                    return
+                self.numbers.add(phoneNumber)
+                if len(self.numbers) > self.filter.capacity:
+                    self.__rebuild()
+                    return
+            self.filter.add(phoneNumber)
+
+    def discard(self, phoneNumber: str):
+        if self.exact:
+            with self.lock:
+                self.numbers.discard(phoneNumber)
+
+    def __rebuild(self):
+        rebuilt = BloomFilter(len(self.numbers) * 2, self.falsePositiveRate)
+        rebuilt.update(self.numbers)
+        self.filter = rebuilt
+
+    def isRegistered(self, phoneNumber: str) -> bool or None:
+        """False when certainly not registered, True when certainly registered, None when storage must decide."""
+        self.lookups += 1
+        if phoneNumber not in self.filter:
+            self.definiteNegatives += 1
+            return False
+        if not self.exact:
+            return None
+        registered = phoneNumber in self.numbers
+        if not registered:
+            self.falsePositives += 1
+        return registered
+
+    def report(self) -> dict:
+        negatives = self.definiteNegatives + self.falsePositives
+        exactSetBytes = 0
+        if self.exact:
+            exactSetBytes = sys.getsizeof(self.numbers) + sum(sys.getsizeof(number) for number in self.numbers)
+        return {"members": len(self), "exact": self.exact, "hashFunctions": self.filter.hashCount,
+                "filterBytes": self.filter.memoryBytes, "exactSetBytes": exactSetBytes,
+                "expectedFalsePositiveRate": self.filter.expectedFalsePositiveRate(),
+                "observedFalsePositiveRate": self.falsePositives / negatives if negatives and self.exact else None,
+                "lookups": self.lookups, "definiteNegatives": self.definiteNegatives}
@@ -0,0 +1,26 @@
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_conversation import FirebaseConversation
+
+
+def buildConversationIndex(firebaseConnection: FirebaseConnection) -> int:
+    """Builds conversationIndex/<normalized phone> for conversations stored before the index existed."""
+    fcm = FirebaseConversation(firebaseConnection)
+    return fcm.rebuildPhoneIndex()
+
+
+def buildConversationSummaries(firebaseConnection: FirebaseConnection) -> int:
+    """Builds conversationSummaries/<key> for conversations stored before the summary projection existed."""
+    fcm = FirebaseConversation(firebaseConnection)
+    return fcm.rebuildSummaries()
+
+
+def __main():
+    fc = FirebaseConnection()
+    indexedConversations = buildConversationIndex(fc)
+    print(f"Indexed {indexedConversations} conversations")
+    summarizedConversations = buildConversationSummaries(fc)
+    print(f"Summarized {summarizedConversations} conversations")
+
+
+if __name__ == '__main__':
+    __main()
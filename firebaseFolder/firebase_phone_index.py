@@ -0,0 +1,50 @@
+import re
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+
+PHONE_FIELDS = ("phoneNumber", "whatsappNumber")
+
+
+def normalizePhoneNumber(phoneNumber: str) -> str:
+    """'whatsapp:+55 (85) 99917-1902' -> '5585999171902'. Safe to use as a Realtime Database key."""
+    return re.sub(r"\D", "", str(phoneNumber).split(":")[-1])
+
+
+def extractPhoneNumber(data: dict) -> str or None:
+    for field in PHONE_FIELDS:
+        if data.get(field):
+            return data[field]
+    return None
+
+
+class FirebasePhoneIndex:
+    """Maintained `<indexPath>/<normalized phone> -> push key` mapping, so resolving a key is a single leaf read."""
+
+    def __init__(self, firebaseConnection: FirebaseConnection, indexPath: str):
+        self.indexPath = indexPath
+        self.reference = firebaseConnection.getReference(indexPath)
+
+    def getKey(self, phoneNumber: str) -> str or None:
+        normalizedPhone = normalizePhoneNumber(phoneNumber)
+        return self.reference.child(normalizedPhone).get() if normalizedPhone else None
+
+    def getAllKeys(self) -> dict:
+        return self.reference.get() or {}
+
+    def setKey(self, phoneNumber: str, uniqueId: str):
+        self.reference.child(normalizePhoneNumber(phoneNumber)).set(uniqueId)
+
+    def removeKey(self, phoneNumber: str):
+        self.reference.child(normalizePhoneNumber(phoneNumber)).delete()
+
+    def clear(self):
+        self.reference.delete()
+
+    def rebuild(self, collection: dict) -> int:
+        mapping = {}
+        for uniqueId, data in (collection or {}).items():
+            phoneNumber = extractPhoneNumber(data) if isinstance(data, dict) else None
+            if phoneNumber and normalizePhoneNumber(phoneNumber):
+                mapping[normalizePhoneNumber(phoneNumber)] = uniqueId
+        self.reference.set(mapping)
+        return len(mapping)
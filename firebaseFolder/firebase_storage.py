@@ -0,0 +1,483 @@
+import copy
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+from firebase_admin import db
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+StorageEvent = namedtuple('StorageEvent', 'event_type path data')
+
+
+class _PushKeyGenerator:
+    """Client-side Firebase push ids: 8 timestamp chars + 12 random chars, lexicographically ordered by creation."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lastTimestamp = 0
+        self.lastRandomIndexes = [0] * 12
+
+    def generate(self) -> str:
+        with self.lock:
+            timestamp = int(time.time() * 1000)
+            if timestamp <= self.lastTimestamp:
+                timestamp = self.lastTimestamp
+                self.__incrementRandomIndexes()
+            else:
+                self.lastRandomIndexes = [random.randrange(64) for _ in range(12)]
+            self.lastTimestamp = timestamp
+            timeChars = []
+            for _ in range(8):
+                timeChars.append(PUSH_CHARS[timestamp % 64])
+                timestamp //= 64
+            return "".join(reversed(timeChars)) + "".join(PUSH_CHARS[index] for index in self.lastRandomIndexes)
+
+    def __incrementRandomIndexes(self):
+        for position in range(11, -1, -1):
+            if self.lastRandomIndexes[position] != 63:
+                self.lastRandomIndexes[position] += 1
+                return
+            self.lastRandomIndexes[position] = 0
+
+
+_pushKeyGenerator = _PushKeyGenerator()
+
+
+def generatePushKey() -> str:
+    return _pushKeyGenerator.generate()
+
+
+def serverIncrement(delta: int = 1) -> dict:
+    """Realtime Database server value, applied atomically by the server inside set()/update()."""
+    return {".sv": {"increment": delta}}
+
+
+def serverTimestamp() -> dict:
+    return {".sv": "timestamp"}
+
+
+def _splitPath(path: str) -> list:
+    return [segment for segment in str(path).split("/") if segment]
+
+
+def _valueRank(value) -> tuple:
+    """Realtime Database ordering: null < false < true < numbers < strings < objects."""
+    if value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 1, int(value)
+    if isinstance(value, (int, float)):
+        return 2, value
+    if isinstance(value, str):
+        return 3, value
+    return 4, 0
+
+
+def _keyRank(key: str) -> tuple:
+    return (0, int(key), "") if str(key).lstrip("-").isdigit() else (1, 0, str(key))
+
+
+def _exportValue(value):
+    """Dicts keyed 0..n come back as lists, like the Realtime Database REST API returns them."""
+    if not isinstance(value, dict):
+        return copy.deepcopy(value)
+    exported = {key: _exportValue(item) for key, item in value.items()}
+    keys = list(exported.keys())
+    if keys and all(key.isdigit() for key in keys):
+        indexes = [int(key) for key in keys]
+        if max(indexes) < 2 * len(indexes):
+            return [exported.get(str(index)) for index in range(max(indexes) + 1)]
+    return exported
+
+
+class LocalDatabase:
+    """Realtime Database semantics (server values, empty-node pruning, listeners, ordered queries) over a tree
+    whose storage is provided by subclasses through readNode() and storeNode()."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.bytesRead = 0
+        self.listeners = []
+
+    def reference(self, path: str = "/"):
+        return LocalDbRef(self, _splitPath(path))
+
+    @contextmanager
+    def atomically(self):
+        """Everything written inside the block is applied as one unit."""
+        with self.lock:
+            yield
+
+    def readNode(self, segments: list):
+        raise NotImplementedError
+
+    def storeNode(self, segments: list, value):
+        """Replaces the node at `segments` with an already normalized value (None deletes it)."""
+        raise NotImplementedError
+
+    def writeNode(self, segments: list, value):
+        with self.lock:
+            value = self.__normalizeValue(value, self.readNode(segments))
+            self.storeNode(segments, value)
+            self.__notifyListeners(segments)
+
+    def __notifyListeners(self, segments: list):
+        for listener in [listener for listener in self.listeners if listener.alive]:
+            depth = len(listener.segments)
+            if segments[:depth] == listener.segments:
+                relativePath = "/" + "/".join(segments[depth:])
+                listener.callback(StorageEvent("put", relativePath, _exportValue(self.readNode(segments))))
+            elif listener.segments[:len(segments)] == segments:
+                listener.callback(StorageEvent("put", "/", _exportValue(self.readNode(listener.segments))))
+
+    def addListener(self, segments: list, callback):
+        with self.lock:
+            listener = LocalListener(self, segments, callback)
+            self.listeners.append(listener)
+            callback(StorageEvent("put", "/", _exportValue(self.readNode(segments))))
+            return listener
+
+    def disconnectListeners(self):
+        """Simulates the event stream dropping, so reconnect handling can be exercised."""
+        with self.lock:
+            for listener in self.listeners:
+                listener.alive = False
+            self.listeners = []
+
+    def __normalizeValue(self, value, currentValue):
+        if isinstance(value, dict) and ".sv" in value:
+            serverValue = value[".sv"]
+            if isinstance(serverValue, dict) and "increment" in serverValue:
+                base = currentValue if isinstance(currentValue, (int, float)) else 0
+                return base + serverValue["increment"]
+            if serverValue == "timestamp":
+                return int(time.time() * 1000)
+        if isinstance(value, (list, tuple)):
+            value = {str(index): item for index, item in enumerate(value)}
+        if isinstance(value, dict):
+            normalized = {}
+            for key, item in value.items():
+                currentItem = currentValue.get(str(key)) if isinstance(currentValue, dict) else None
+                item = self.__normalizeValue(item, currentItem)
+                if item is not None:
+                    normalized[str(key)] = item
+            return normalized or None
+        return copy.deepcopy(value)
+
+
+class InMemoryDatabase(LocalDatabase):
+    """A process-local tree; nothing survives the process."""
+
+    def __init__(self, data: dict = None):
+        super().__init__()
+        self.root = copy.deepcopy(data) if data else {}
+
+    def readNode(self, segments: list):
+        node = self.root
+        for segment in segments:
+            if not isinstance(node, dict) or segment not in node:
+                return None
+            node = node[segment]
+        return node
+
+    def storeNode(self, segments: list, value):
+        if not segments:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        parents = []
+        for segment in segments[:-1]:
+            if not isinstance(node.get(segment), dict):
+                if value is None:
+                    return
+                node[segment] = {}
+            parents.append((node, segment))
+            node = node[segment]
+        if value is None:
+            node.pop(segments[-1], None)
+            for parent, segment in reversed(parents):
+                if parent[segment]:
+                    break
+                del parent[segment]
+        else:
+            node[segments[-1]] = value
+
+
+class SqliteDatabase(LocalDatabase):
+    """The tree persisted to a SQLite file, one row per leaf keyed by its slash-joined path. A subtree is the
+    contiguous key range [path + "/", path + "0"), since "0" is the character right after "/"."""
+
+    def __init__(self, filePath: str = ":memory:"):
+        super().__init__()
+        self.filePath = filePath
+        self.sqlite = sqlite3.connect(filePath, check_same_thread=False, isolation_level=None)
+        self.sqlite.execute("PRAGMA journal_mode=WAL")
+        self.sqlite.execute("PRAGMA synchronous=NORMAL")
+        self.sqlite.execute("CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.transactionDepth = 0
+
+    @contextmanager
+    def atomically(self):
+        with self.lock:
+            if self.transactionDepth == 0:
+                self.sqlite.execute("BEGIN")
+            self.transactionDepth += 1
+            try:
+                yield
+            except BaseException:
+                self.transactionDepth -= 1
+                if self.transactionDepth == 0:
+                    self.sqlite.execute("ROLLBACK")
+                raise
+            self.transactionDepth -= 1
+            if self.transactionDepth == 0:
+                self.sqlite.execute("COMMIT")
+
+    def writeNode(self, segments: list, value):
+        with self.atomically():
+            super().writeNode(segments, value)
+
+    def readNode(self, segments: list):
+        with self.lock:
+            if not segments:
+                rows = self.sqlite.execute("SELECT path, value FROM nodes").fetchall()
+            else:
+                path = "/".join(segments)
+                rows = self.sqlite.execute("SELECT path, value FROM nodes WHERE path = ? OR (path >= ? AND path < ?)",
+                                           (path, path + "/", path + "0")).fetchall()
+        node = None
+        for rowPath, rowValue in rows:
+            relativeSegments = rowPath.split("/")[len(segments):]
+            if not relativeSegments:
+                return json.loads(rowValue)
+            node = node if isinstance(node, dict) else {}
+            parent = node
+            for segment in relativeSegments[:-1]:
+                parent = parent.setdefault(segment, {})
+            parent[relativeSegments[-1]] = json.loads(rowValue)
+        return node
+
+    def storeNode(self, segments: list, value):
+        path = "/".join(segments)
+        if not segments:
+            self.sqlite.execute("DELETE FROM nodes")
+        else:
+            self.sqlite.execute("DELETE FROM nodes WHERE path = ? OR (path >= ? AND path < ?)",
+                                (path, path + "/", path + "0"))
+            ancestorPaths = ["/".join(segments[:length]) for length in range(1, len(segments))]
+            self.sqlite.executemany("DELETE FROM nodes WHERE path = ?", [(ancestor,) for ancestor in ancestorPaths])
+        if value is not None:
+            self.sqlite.executemany("INSERT INTO nodes (path, value) VALUES (?, ?)", self.__flatten(path, value))
+
+    def __flatten(self, path: str, value):
+        if not isinstance(value, dict):
+            yield path, json.dumps(value)
+            return
+        for key, item in value.items():
+            yield from self.__flatten(f"{path}/{key}" if path else key, item)
+
+    def close(self):
+        with self.lock:
+            self.sqlite.close()
+
+
+class LocalListener:
+    """Local event stream registration: delivers `put` events synchronously on every write under its path."""
+
+    def __init__(self, database: LocalDatabase, segments: list, callback):
+        self.database = database
+        self.segments = segments
+        self.callback = callback
+        self.alive = True
+
+    def isAlive(self) -> bool:
+        return self.alive
+
+    def close(self):
+        with self.database.lock:
+            self.alive = False
+            if self in self.database.listeners:
+                self.database.listeners.remove(self)
+
+
+class LocalQuery:
+    def __init__(self, ref, orderBy: str, childPath: str = None):
+        self.ref = ref
+        self.orderBy = orderBy
+        self.childPath = childPath
+        self.startValue = None
+        self.endValue = None
+        self.hasStart = False
+        self.hasEnd = False
+        self.firstLimit = None
+        self.lastLimit = None
+
+    def __sortValue(self, key, value):
+        if self.orderBy == "key":
+            return _keyRank(key)
+        if self.orderBy == "value":
+            return _valueRank(value)
+        node = value
+        for segment in _splitPath(self.childPath):
+            node = node.get(segment) if isinstance(node, dict) else None
+        return _valueRank(node)
+
+    def __boundary(self, boundary):
+        return _keyRank(boundary) if self.orderBy == "key" else _valueRank(boundary)
+
+    def __copyWith(self, **changes):
+        query = copy.copy(self)
+        query.__dict__.update(changes)
+        return query
+
+    def start_at(self, start):
+        return self.__copyWith(startValue=start, hasStart=True)
+
+    def end_at(self, end):
+        return self.__copyWith(endValue=end, hasEnd=True)
+
+    def equal_to(self, value):
+        return self.__copyWith(startValue=value, endValue=value, hasStart=True, hasEnd=True)
+
+    def limit_to_first(self, limit: int):
+        return self.__copyWith(firstLimit=limit)
+
+    def limit_to_last(self, limit: int):
+        return self.__copyWith(lastLimit=limit)
+
+    def get(self):
+        with self.ref.database.lock:
+            node = self.ref.database.readNode(self.ref.segments)
+            items = list(node.items()) if isinstance(node, dict) else []
+            entries = sorted(((self.__sortValue(key, value), _keyRank(key), key, value) for key, value in items),
+                             key=lambda entry: (entry[0], entry[1]))
+            if self.hasStart:
+                entries = [entry for entry in entries if entry[0] >= self.__boundary(self.startValue)]
+            if self.hasEnd:
+                entries = [entry for entry in entries if entry[0] <= self.__boundary(self.endValue)]
+            if self.firstLimit is not None:
+                entries = entries[:self.firstLimit]
+            if self.lastLimit is not None:
+                entries = entries[-self.lastLimit:] if self.lastLimit else []
+            result = OrderedDict((key, _exportValue(value)) for _, _, key, value in entries)
+            self.ref.database.bytesRead += len(repr(result))
+            return result
+
+
+class LocalDbRef:
+    """Stand-in for firebase_admin.db.Reference backed by a LocalDatabase."""
+
+    def __init__(self, database: LocalDatabase, segments: list = None):
+        self.database = database
+        self.segments = segments or []
+
+    @property
+    def key(self):
+        return self.segments[-1] if self.segments else None
+
+    @property
+    def path(self):
+        return "/" + "/".join(self.segments)
+
+    def child(self, path):
+        return LocalDbRef(self.database, self.segments + _splitPath(path))
+
+    def get(self, etag=False, shallow=False):
+        with self.database.lock:
+            node = self.database.readNode(self.segments)
+            if shallow and isinstance(node, dict):
+                node = {key: True for key in node}
+            value = _exportValue(node)
+            self.database.bytesRead += len(repr(value))
+            return value
+
+    def set(self, value):
+        with self.database.atomically():
+            self.database.writeNode(self.segments, value)
+
+    def push(self, value=''):
+        with self.database.atomically():
+            pushedRef = self.child(generatePushKey())
+            pushedRef.set(value)
+            return pushedRef
+
+    def update(self, value: dict):
+        with self.database.atomically():
+            for path, item in value.items():
+                self.database.writeNode(self.segments + _splitPath(path), item)
+
+    def delete(self):
+        with self.database.atomically():
+            self.database.writeNode(self.segments, None)
+
+    def transaction(self, transaction_update):
+        with self.database.atomically():
+            newValue = transaction_update(self.get())
+            self.set(newValue)
+            return newValue
+
+    def listen(self, callback):
+        return self.database.addListener(self.segments, callback)
+
+    def order_by_child(self, path: str):
+        return LocalQuery(self, "child", path)
+
+    def order_by_key(self):
+        return LocalQuery(self, "key")
+
+    def order_by_value(self):
+        return LocalQuery(self, "value")
+
+
+class StorageBackend:
+    """What FirebaseConnection stores data through. `reference(path)` must return an object with the
+    firebase_admin.db.Reference surface the repository uses: child, get, set, push, update, delete, transaction,
+    listen and order_by_child/order_by_key/order_by_value queries."""
+    name = None
+
+    def reference(self, path: str = "/"):
+        raise NotImplementedError
+
+    def generatePushKey(self) -> str:
+        return generatePushKey()
+
+    def close(self):
+        pass
+
+
+class RealtimeDatabaseBackend(StorageBackend):
+    name = "firebase"
+
+    def __init__(self, app):
+        self.app = app
+
+    def reference(self, path: str = "/"):
+        return db.reference(path, app=self.app)
+
+
+class MemoryStorageBackend(StorageBackend):
+    name = "memory"
+
+    def __init__(self, database: InMemoryDatabase = None):
+        self.database = database if database is not None else InMemoryDatabase()
+
+    def reference(self, path: str = "/"):
+        return self.database.reference(path)
+
+
+class SqliteStorageBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, filePath: str):
+        self.database = SqliteDatabase(filePath)
+
+    def reference(self, path: str = "/"):
+        return self.database.reference(path)
+
+    def close(self):
+        self.database.close()
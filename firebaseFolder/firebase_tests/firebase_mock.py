@@ -1,4 +1,8 @@
 from collections import namedtuple
+from contextlib import contextmanager
+
+from firebaseFolder.firebase_connection import FirebaseConnection
+from firebaseFolder.firebase_storage import InMemoryDatabase, MemoryStorageBackend
 
 PushReturn = namedtuple('PushReturn', 'key')
 
@@ -20,6 +24,12 @@ class MockedDbRef:
         return True
 
 
+@contextmanager
+def inMemoryFirebaseConnection(database: InMemoryDatabase):
+    """Yields a fresh (non-singleton) FirebaseConnection whose references all point into the given database."""
+    yield FirebaseConnection.__wrapped__(MemoryStorageBackend(database))
+
+
 def __main():
     mdr = MockedDbRef()
     data = mdr.get()
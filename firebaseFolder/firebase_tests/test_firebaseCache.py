@@ -0,0 +1,74 @@
+import pytest
+
+from firebaseFolder.firebase_cache import FirebaseReadCache, CachedReference, parseCacheTtls
+from firebaseFolder.firebase_conversation import FirebaseConversation
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock: FakeClock) -> FirebaseReadCache:
+    return FirebaseReadCache(parseCacheTtls("users:30,conversations:5"), maxEntries=2, clock=clock)
+
+
+def test_parseCacheTtls():
+    assert parseCacheTtls("users:30, conversationIndex:300,broken") == {("users",): 30.0,
+                                                                        ("conversationIndex",): 300.0}
+
+
+def test_cacheExpiresAfterTtl(cache: FirebaseReadCache, clock: FakeClock):
+    cache.put("/conversations/-a", {"name": "John"})
+    assert cache.get("/conversations/-a") == (True, {"name": "John"})
+    clock.now = 5
+    assert cache.get("/conversations/-a") == (False, None)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_cacheIsOptInPerCollection(cache: FirebaseReadCache):
+    cache.put("/conversationSummaries/-a", {"name": "John"})
+    assert cache.get("/conversationSummaries/-a") == (False, None)
+
+
+def test_cacheEvictsLeastRecentlyUsed(cache: FirebaseReadCache):
+    cache.put("/users/-a", 1)
+    cache.put("/users/-b", 2)
+    cache.get("/users/-a")
+    cache.put("/users/-c", 3)
+    assert cache.get("/users/-b") == (False, None)
+    assert cache.get("/users/-a") == (True, 1)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_writesInvalidateRelatedPaths(cache: FirebaseReadCache):
+    database = InMemoryDatabase({"users": {"-a": {"name": "Pedro"}}})
+    users = CachedReference(database.reference("users"), cache)
+    assert users.get() == {"-a": {"name": "Pedro"}}
+    users.child("-a").update({"name": "Pedro Alves"})
+    assert users.get() == {"-a": {"name": "Pedro Alves"}}
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_connectionCachesConfiguredCollections(monkeypatch):
+    monkeypatch.setenv("FIREBASE_CACHE_TTLS", "conversationIndex:60,conversations:60")
+    database = InMemoryDatabase()
+    with inMemoryFirebaseConnection(database) as connection:
+        fcm = FirebaseConversation.__wrapped__(connection, keyByPhoneNumber=False)
+        fcm.createConversation({"phoneNumber": "+558599171902", "name": "John"})
+        for _ in range(3):
+            fcm.getUniqueIdByWhatsappNumber("+558599171902")
+        assert connection.cache.stats()["hits"] == 2
+        fcm.appendMessageToWhatsappNumber({"body": "Oi"}, "+558599171902")
+        assert [message["body"] for message in fcm.retrieveAllMessagesByWhatsappNumber("+558599171902")] == ["Oi"]
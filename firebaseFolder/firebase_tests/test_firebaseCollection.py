@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from firebaseFolder.firebase_conversation import FirebaseConversation
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_user import FirebaseUser
+
+
+def test_collectionsAreBoundOnce():
+    database = InMemoryDatabase({"users": {"-a": {"phoneNumber": "+1"}}, "conversations": {"-b": {"name": "x"}}})
+    with inMemoryFirebaseConnection(database) as connection:
+        users = connection.bindCollection("users")
+        conversations = connection.bindCollection("conversations")
+        connection.changeDatabaseConnection("conversations")
+        assert users.readData() == {"-a": {"phoneNumber": "+1"}}
+        assert conversations.readData("-b") == {"name": "x"}
+
+
+def test_concurrentReadsAndWritesNeverCrossCollections():
+    database = InMemoryDatabase()
+    with inMemoryFirebaseConnection(database) as connection:
+        fu = FirebaseUser.__wrapped__(connection)
+        fcm = FirebaseConversation.__wrapped__(connection, keyByPhoneNumber=False)
+
+        def createUser(index: int):
+            fu.createUser({"phoneNumber": f"+5585{index:08d}", "name": f"User {index}"})
+            return fu.getAllUsers()
+
+        def createConversation(index: int):
+            fcm.createConversation({"phoneNumber": f"+5585{index:08d}", "name": f"User {index}", "status": "active"})
+            return fcm.getAllConversations()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            userReads = [executor.submit(createUser, index) for index in range(100)]
+            conversationReads = [executor.submit(createConversation, index) for index in range(100)]
+            for future in userReads:
+                assert all("status" not in user for user in (future.result() or {}).values())
+            for future in conversationReads:
+                assert all("status" in conversation for conversation in (future.result() or {}).values())
+
+        assert len(database.reference("users").get()) == 100
+        assert len(database.reference("conversations").get()) == 100
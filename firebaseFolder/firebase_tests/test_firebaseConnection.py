@@ -55,8 +55,8 @@ def test_deleteAllData(firebase_connection: FirebaseConnection):
 
 
 def test_getUniqueIdByData(firebase_connection: FirebaseConnection):
-    result = firebase_connection.getUniqueIdByData("users", {"testData": 10})
-    assert result == 'test_key'
+    result = firebase_connection.getUniqueIdByData("users", 5)
+    assert result == 'dummyData'
 
 
 def test_getFirebaseCredentials():
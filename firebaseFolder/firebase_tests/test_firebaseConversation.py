@@ -0,0 +1,203 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from firebaseFolder.firebase_conversation import FirebaseConversation, getDummyConversationDicts
+from firebaseFolder.firebase_phone_index import normalizePhoneNumber
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+
+
+@pytest.fixture
+def database() -> InMemoryDatabase:
+    return InMemoryDatabase()
+
+
+@pytest.fixture
+def firebase_connection(database: InMemoryDatabase):
+    with inMemoryFirebaseConnection(database) as connection:
+        yield connection
+
+
+@pytest.fixture
+def firebase_conversation(firebase_connection) -> FirebaseConversation:
+    return FirebaseConversation.__wrapped__(firebase_connection, keyByPhoneNumber=False)
+
+
+def __createConversation(conversationInstance: FirebaseConversation, username: str, phoneNumber: str) -> dict:
+    conversation = getDummyConversationDicts(username=username, phoneNumber=phoneNumber)["dummyPot"][0]
+    conversationInstance.createConversation(conversation)
+    return conversation
+
+
+def test_normalizePhoneNumber():
+    assert normalizePhoneNumber("whatsapp:+55 (85) 99917-1902") == "5585999171902"
+    assert normalizePhoneNumber("+5585999171902") == "5585999171902"
+
+
+def test_createConversationMaintainsIndex(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    uniqueId = firebase_conversation.getUniqueIdByWhatsappNumber("+558599171902")
+    assert database.reference("conversationIndex/558599171902").get() == uniqueId
+    assert database.reference(f"conversations/{uniqueId}/name").get() == "John"
+    assert firebase_conversation.createConversation({"phoneNumber": "+558599171902"}) is False
+
+
+@pytest.mark.parametrize("keyByPhoneNumber", [False, True])
+def test_emptyPhoneNumberLeavesIndexIntact(firebase_connection, database: InMemoryDatabase, keyByPhoneNumber: bool):
+    fcm = FirebaseConversation.__wrapped__(firebase_connection, keyByPhoneNumber=keyByPhoneNumber)
+    __createConversation(fcm, "John", "+558599171902")
+    uniqueId = fcm.getUniqueIdByWhatsappNumber("+558599171902")
+    assert fcm.createConversation({"phoneNumber": "", "name": "Nobody"}) is False
+    assert fcm.createConversation({"phoneNumber": "whatsapp:", "name": "Nobody"}) is False
+    assert fcm.createFirstDummyConversationByWhatsappNumber({"phoneNumber": "", "body": "Oi"}).startswith("Could not")
+    assert database.reference("conversationIndex").get() == {"558599171902": uniqueId}
+    assert database.reference(f"conversations/{uniqueId}/name").get() == "John"
+    assert fcm.getUniqueIdByWhatsappNumber("+558599171902") == uniqueId
+
+
+def test_resolvingDoesNotTransferMessages(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    __createConversation(firebase_conversation, "Maria", "+558599171903")
+    database.bytesRead = 0
+    assert firebase_conversation.getUniqueIdByWhatsappNumber("whatsapp:+558599171903") is not None
+    assert database.bytesRead < 40
+
+
+def test_keyByPhoneNumber(firebase_connection, database: InMemoryDatabase):
+    fcm = FirebaseConversation.__wrapped__(firebase_connection, keyByPhoneNumber=True)
+    __createConversation(fcm, "John", "+558599171902")
+    assert fcm.getUniqueIdByWhatsappNumber("+558599171902") == "558599171902"
+    assert database.reference("conversations/558599171902/name").get() == "John"
+
+
+def test_rebuildPhoneIndex(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    database.reference("conversations").set({"-legacy1": {"phoneNumber": "+558599171902", "messagePot": []},
+                                             "-legacy2": {"whatsappNumber": "+558599171903"}})
+    assert firebase_conversation.rebuildPhoneIndex() == 2
+    assert firebase_conversation.getUniqueIdByWhatsappNumber("+558599171903") == "-legacy2"
+
+
+def test_appendMessageOnlyWritesNewMessage(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    conversation = __createConversation(firebase_conversation, "John", "+558599171902")
+    message = firebase_conversation.appendMessageToWhatsappNumber({"body": "Quero uma pizza", "sender": "John"},
+                                                                  "+558599171902")
+    uniqueId = firebase_conversation.getUniqueIdByWhatsappNumber("+558599171902")
+    storedConversation = database.reference(f"conversations/{uniqueId}").get()
+    assert storedConversation["messagePot"][message["id"]] == message
+    assert storedConversation["lastMessage"] == message
+    assert storedConversation["unreadMessages"] == conversation["unreadMessages"] + 1
+    messages = firebase_conversation.retrieveAllMessagesByWhatsappNumber("+558599171902")
+    assert [item["body"] for item in messages] == [item["body"] for item in conversation["messagePot"]] + \
+           ["Quero uma pizza"]
+
+
+def test_concurrentAppendsAreNotLost(firebase_conversation: FirebaseConversation):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda index: firebase_conversation.appendMessageToWhatsappNumber(
+            {"body": f"mensagem {index}"}, "+558599171902"), range(50)))
+    messages = firebase_conversation.retrieveAllMessagesByWhatsappNumber("+558599171902")
+    assert {f"mensagem {index}" for index in range(50)} <= {message["body"] for message in messages}
+
+
+def test_concurrentUnreadIncrementsAreExact(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    firebase_conversation.resetUnreadMessages("+558599171902")
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda _: firebase_conversation.incrementUnreadMessages("+558599171902"), range(200)))
+    uniqueId = firebase_conversation.getUniqueIdByWhatsappNumber("+558599171902")
+    assert database.reference(f"conversations/{uniqueId}/unreadMessages").get() == 200
+
+
+def test_updateConversationAddingUnreadMessages(firebase_conversation: FirebaseConversation):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    assert firebase_conversation.updateConversationAddingUnreadMessages({"phoneNumber": "+558599171902"}) == \
+           {"phoneNumber": "+558599171902", "unreadMessages": 2}
+    assert firebase_conversation.updateConversationAddingUnreadMessages(
+        {"phoneNumber": "+558599171902", "unreadMessages": 0}) == {"phoneNumber": "+558599171902", "unreadMessages": 0}
+    assert firebase_conversation.updateConversationAddingUnreadMessages({"phoneNumber": "+550000000000"}) is None
+
+
+def test_retrieveMessagesByPage(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    firebase_conversation.createConversation({"phoneNumber": "+558599171902", "name": "John"})
+    for index in range(30):
+        firebase_conversation.appendMessageToWhatsappNumber({"body": f"mensagem {index}"}, "+558599171902")
+    database.bytesRead = 0
+    lastPage = firebase_conversation.retrieveAllMessagesByWhatsappNumber("+558599171902", limit=10)
+    assert [message["body"] for message in lastPage] == [f"mensagem {index}" for index in range(20, 30)]
+    assert database.bytesRead < 1500
+    previousPage = firebase_conversation.retrieveAllMessagesByWhatsappNumber("+558599171902", limit=10,
+                                                                             before=lastPage[0]["key"])
+    assert [message["body"] for message in previousPage] == [f"mensagem {index}" for index in range(10, 20)]
+    nextPage = firebase_conversation.retrieveAllMessagesByWhatsappNumber("+558599171902", limit=5,
+                                                                         after=previousPage[-1]["key"])
+    assert [message["body"] for message in nextPage] == [f"mensagem {index}" for index in range(20, 25)]
+
+
+def test_conversationSummariesFollowAppends(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    __createConversation(firebase_conversation, "Maria", "+558599171903")
+    time.sleep(0.002)
+    firebase_conversation.appendMessageToWhatsappNumber({"body": "Oi"}, "+558599171902")
+    database.bytesRead = 0
+    summaries = firebase_conversation.getConversationSummaries(limit=1)
+    assert [summary["name"] for summary in summaries] == ["John"]
+    assert summaries[0]["lastMessage"]["body"] == "Oi"
+    assert summaries[0]["unreadMessages"] == 2
+    assert "messagePot" not in summaries[0]
+    assert database.bytesRead < 400
+    assert firebase_conversation.getConversationSummaries(since=summaries[0]["updatedAt"] + 1) == []
+
+
+def test_updateConversationRefreshesSummary(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    conversation = __createConversation(firebase_conversation, "John", "+558599171902")
+    lastMessage = {"body": "Pedido entregue", "sender": "ChatBot"}
+    assert firebase_conversation.updateConversation(dict(conversation, status="closed", unreadMessages=0,
+                                                         lastMessage=lastMessage))
+    uniqueId = firebase_conversation.getUniqueIdByWhatsappNumber("+558599171902")
+    assert database.reference(f"conversations/{uniqueId}/status").get() == "closed"
+    summary = database.reference(f"conversationSummaries/{uniqueId}").get()
+    assert (summary["status"], summary["unreadMessages"], summary["lastMessage"]) == ("closed", 0, lastMessage)
+    assert firebase_conversation.updateConversation({"phoneNumber": "+558599171999"}) is False
+
+
+def test_deleteConversationsRemovesSummaryAndIndex(firebase_conversation: FirebaseConversation,
+                                                   database: InMemoryDatabase):
+    for index, name in enumerate(["John", "Mary", "Paul"]):
+        __createConversation(firebase_conversation, name, f"+55859917190{index}")
+    assert firebase_conversation.deleteConversation({"phoneNumber": "+558599171900"})
+    results = firebase_conversation.deleteConversations(["+558599171901", "+558599171909", None])
+    assert [result["status"] for result in results] == ["deleted", "missing", "invalid"]
+    remaining = firebase_conversation.getUniqueIdByWhatsappNumber("+558599171902")
+    assert list(database.reference("conversations").get()) == [remaining]
+    assert list(database.reference("conversationSummaries").get()) == [remaining]
+    assert database.reference("conversationIndex").get() == {"558599171902": remaining}
+
+
+def test_failedDeleteIsReported(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171900")
+    __createConversation(firebase_conversation, "Mary", "+558599171901")
+    with patch.object(firebase_conversation.rootReference, "update", side_effect=ConnectionError("offline")):
+        assert not firebase_conversation.deleteConversation({"phoneNumber": "+558599171900"})
+        results = firebase_conversation.deleteConversations(["+558599171900", "+558599171901"])
+    assert [result["status"] for result in results] == ["failed", "failed"]
+    assert len(database.reference("conversationIndex").get()) == 2
+
+
+def test_createConversationsInBulk(firebase_conversation: FirebaseConversation, database: InMemoryDatabase):
+    __createConversation(firebase_conversation, "John", "+558599171902")
+    rows = [getDummyConversationDicts(username=f"User {index}", phoneNumber=f"+55859917{index:04d}")["dummyPot"][0]
+            for index in range(4)]
+    rows += [{"whatsappNumber": "whatsapp:+558599171902"}, {"name": "no phone"}]
+    database.bytesRead = 0
+    results = firebase_conversation.createConversations(rows, rowsPerBatch=3)
+    assert [result["status"] for result in results] == ["created"] * 4 + ["duplicate", "invalid"]
+    assert database.bytesRead < 100
+    assert len(database.reference("conversationIndex").get()) == 5
+    assert len(firebase_conversation.getConversationSummaries()) == 5
+    updated = firebase_conversation.updateConversations([dict(rows[0], status="closed")])
+    assert updated[0]["status"] == "updated"
+    assert database.reference(f"conversationSummaries/{updated[0]['key']}/status").get() == "closed"
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from firebaseFolder.firebase_conversation import FirebaseConversation
+from firebaseFolder.firebase_listener import FirebaseUserMirror, _FirebaseListener, startMirrors
+from firebaseFolder.firebase_storage import InMemoryDatabase, StorageEvent
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_user import FirebaseUser
+
+
+def __waitFor(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def database() -> InMemoryDatabase:
+    return InMemoryDatabase({"users": {"-a": {"phoneNumber": "+558597648593", "name": "Pedro"}}})
+
+
+@pytest.fixture
+def firebase_connection(database: InMemoryDatabase):
+    with inMemoryFirebaseConnection(database) as connection:
+        yield connection
+
+
+def test_mirrorAppliesPutAndPatchEvents(firebase_connection):
+    mirror = FirebaseUserMirror(firebase_connection)
+    mirror.onEvent(StorageEvent("put", "/", {"-a": {"phoneNumber": "+1", "name": "Ana"}}))
+    mirror.onEvent(StorageEvent("patch", "/", {"-b/phoneNumber": "+2", "-b/name": "Bia"}))
+    mirror.onEvent(StorageEvent("put", "/-a/phoneNumber", "+3"))
+    assert mirror.ready
+    assert mirror.getUsersByPhoneNumber("+2") == {"-b": {"phoneNumber": "+2", "name": "Bia"}}
+    assert mirror.getUsersByPhoneNumber("+1") == {}
+    assert list(mirror.getUsersByPhoneNumber("+3")) == ["-a"]
+
+
+def test_lookupsAreServedFromMemory(firebase_connection, database: InMemoryDatabase):
+    fu = FirebaseUser.__wrapped__(firebase_connection)
+    fcm = FirebaseConversation.__wrapped__(firebase_connection, keyByPhoneNumber=False)
+    userMirror, indexMirror = startMirrors(fu, fcm, waitTimeout=2)
+    try:
+        fu.createUser({"phoneNumber": "+558576481232", "name": "Ana Oliveira"})
+        fcm.createConversation({"phoneNumber": "+558576481232", "name": "Ana Oliveira"})
+        database.bytesRead = 0
+        assert fu.existingUser({"phoneNumber": "+558576481232"})
+        assert fcm.getUniqueIdByWhatsappNumber("+558576481232") is not None
+        assert database.bytesRead == 0
+    finally:
+        userMirror.stop()
+        indexMirror.stop()
+
+
+def test_mirrorKeepsRegisteredNumbersCurrent(firebase_connection, database: InMemoryDatabase):
+    fu = FirebaseUser.__wrapped__(firebase_connection)
+    fcm = FirebaseConversation.__wrapped__(firebase_connection, keyByPhoneNumber=False)
+    userMirror, indexMirror = startMirrors(fu, fcm, waitTimeout=2)
+    try:
+        fu.loadRegisteredNumbers()
+        database.reference("users/-b").set({"phoneNumber": "+558576481232", "name": "Ana Oliveira"})
+        database.reference("users/-a").delete()
+        assert __waitFor(lambda: fu.registeredNumbers.isRegistered("+558576481232"))
+        assert __waitFor(lambda: fu.registeredNumbers.isRegistered("+558597648593") is False)
+        database.bytesRead = 0
+        assert fu.existingUser({"phoneNumber": "+558576481232"})
+        assert not fu.existingUser({"phoneNumber": "+558597648593"})
+        assert database.bytesRead == 0
+    finally:
+        userMirror.stop()
+        indexMirror.stop()
+
+
+def test_mirrorReconnectsAfterStreamDrops(firebase_connection, database: InMemoryDatabase):
+    mirror = FirebaseUserMirror(firebase_connection, initialBackoff=0.01, pollInterval=0.01).start()
+    try:
+        assert mirror.waitUntilReady(2)
+        database.disconnectListeners()
+        database.reference("users/-b").set({"phoneNumber": "+558576481232", "name": "Ana Oliveira"})
+        assert __waitFor(lambda: mirror.reconnects >= 1 and mirror.ready)
+        assert list(mirror.getUsersByPhoneNumber("+558576481232")) == ["-b"]
+    finally:
+        mirror.stop()
+
+
+class _FakeRegistration:
+    def __init__(self, callback):
+        self.callback = callback
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeReference:
+    """Stands in for firebase_admin's Reference: listen() hands back a registration and nothing else."""
+
+    def listen(self, callback):
+        self.registration = _FakeRegistration(callback)
+        return self.registration
+
+
+def __deliverFromStreamThread(reference: _FakeReference, events: list) -> threading.Thread:
+    """Delivers `events` from a thread of their own, as firebase_admin does, and returns it once they are in."""
+    streamThread = threading.Thread(target=lambda: [reference.registration.callback(event) for event in events])
+    streamThread.start()
+    streamThread.join()
+    return streamThread
+
+
+def test_quietFirebaseListenerStaysAlive():
+    reference, events = _FakeReference(), []
+    listener = _FirebaseListener(reference, events.append)
+    assert listener.isAlive()
+    release = threading.Event()
+    streamThread = threading.Thread(target=lambda: (reference.registration.callback(StorageEvent("put", "/", {})),
+                                                    release.wait(2)))
+    streamThread.start()
+    try:
+        assert __waitFor(lambda: events == [StorageEvent("put", "/", {})])
+        assert listener.isAlive()
+    finally:
+        release.set()
+        streamThread.join()
+    listener.close()
+    assert reference.registration.closed
+
+
+def test_firebaseListenerIsDeadOnceItsStreamThreadEnds():
+    reference = _FakeReference()
+    listener = _FirebaseListener(reference, lambda event: None)
+    __deliverFromStreamThread(reference, [StorageEvent("put", "/", {})])
+    assert not listener.isAlive()
+
+
+def test_firebaseListenerIsDeadOnceTheCallbackFails():
+    reference = _FakeReference()
+
+    def failingCallback(event):
+        raise ValueError("bad event")
+
+    listener = _FirebaseListener(reference, failingCallback)
+    with pytest.raises(ValueError):
+        reference.registration.callback(StorageEvent("put", "/", {}))
+    assert not listener.isAlive()
@@ -0,0 +1,35 @@
+from firebaseFolder.firebase_membership import BloomFilter, RegisteredNumbers
+
+
+def test_bloomFilterHasNoFalseNegatives():
+    bloomFilter = BloomFilter(1000)
+    bloomFilter.update(f"+5585{index:09d}" for index in range(1000))
+    assert all(f"+5585{index:09d}" in bloomFilter for index in range(1000))
+    assert bloomFilter.count == 1000
+
+
+def test_bloomFilterFalsePositiveRateIsNearTheTarget():
+    bloomFilter = BloomFilter(10_000, falsePositiveRate=0.01)
+    bloomFilter.update(f"+5585{index:09d}" for index in range(10_000))
+    falsePositives = sum(f"+5586{index:09d}" in bloomFilter for index in range(20_000))
+    assert falsePositives / 20_000 < 0.02
+    assert 0.005 < bloomFilter.expectedFalsePositiveRate() < 0.015
+
+
+def test_exactSetSettlesFalsePositives():
+    registeredNumbers = RegisteredNumbers.fromPhoneNumbers([f"+5585{index:09d}" for index in range(100)])
+    assert all(registeredNumbers.isRegistered(f"+5585{index:09d}") for index in range(100))
+    assert not any(registeredNumbers.isRegistered(f"+5586{index:09d}") for index in range(5000))
+    report = registeredNumbers.report()
+    assert report["members"] == 100 and report["lookups"] == 5100
+    assert report["definiteNegatives"] + registeredNumbers.falsePositives == 5000
+    assert report["observedFalsePositiveRate"] == registeredNumbers.falsePositives / 5000
+
+
+def test_filterIsRebuiltWhenItOutgrowsItsCapacity():
+    registeredNumbers = RegisteredNumbers(capacity=10)
+    for index in range(100):
+        registeredNumbers.add(f"+5585{index:09d}")
+    assert registeredNumbers.filter.capacity >= 100
+    assert all(registeredNumbers.isRegistered(f"+5585{index:09d}") for index in range(100))
+    assert registeredNumbers.report()["expectedFalsePositiveRate"] < 0.02
@@ -0,0 +1,57 @@
+import pytest
+
+from firebaseFolder.firebase_connection import FirebaseConnection, createStorageBackend, serverIncrement
+from firebaseFolder.firebase_storage import MemoryStorageBackend, SqliteStorageBackend
+from firebaseFolder.firebase_user import FirebaseUser
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryStorageBackend()
+    else:
+        backend = SqliteStorageBackend(str(tmp_path / "db.sqlite3"))
+    yield backend
+    backend.close()
+
+
+def test_writeReadAndQuery(storage):
+    users = storage.reference("/users")
+    firstKey = users.push({"phoneNumber": "+1", "name": "Ana", "tags": ["a", "b"]}).key
+    users.push({"phoneNumber": "+2", "name": "Bia"})
+    assert storage.reference(f"/users/{firstKey}").get() == {"phoneNumber": "+1", "name": "Ana", "tags": ["a", "b"]}
+    assert list(users.order_by_child("phoneNumber").equal_to("+1").get()) == [firstKey]
+    assert [user["name"] for user in users.order_by_key().limit_to_last(1).get().values()] == ["Bia"]
+
+
+def test_multiPathUpdateIncrementAndDelete(storage):
+    root = storage.reference("/")
+    root.update({"conversations/-a/unreadMessages": 1, "conversations/-a/name": "Ana"})
+    root.update({"conversations/-a/unreadMessages": serverIncrement(2)})
+    assert storage.reference("/conversations/-a/unreadMessages").transaction(lambda value: value + 1) == 4
+    storage.reference("/conversations/-a/name").set({"first": "Ana"})
+    assert storage.reference("/conversations/-a").get() == {"unreadMessages": 4, "name": {"first": "Ana"}}
+    storage.reference("/conversations/-a/unreadMessages").delete()
+    storage.reference("/conversations/-a/name").delete()
+    assert not root.get()
+
+
+def test_sqliteSurvivesReopening(tmp_path):
+    filePath = str(tmp_path / "db.sqlite3")
+    first = SqliteStorageBackend(filePath)
+    first.reference("/users/-a").set({"phoneNumber": "+1"})
+    first.close()
+    second = SqliteStorageBackend(filePath)
+    assert second.reference("/users").get() == {"-a": {"phoneNumber": "+1"}}
+    second.close()
+
+
+def test_connectionRunsOnSelectedBackend(monkeypatch, tmp_path):
+    monkeypatch.setenv("FIREBASE_STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("FIREBASE_SQLITE_PATH", str(tmp_path / "api.sqlite3"))
+    storage = createStorageBackend()
+    assert isinstance(storage, SqliteStorageBackend)
+    fu = FirebaseUser.__wrapped__(FirebaseConnection.__wrapped__(storage))
+    fu.createUser({"phoneNumber": "+558597648593", "name": "Pedro"})
+    assert fu.existingUser({"phoneNumber": "+558597648593"})
+    storage.close()
@@ -0,0 +1,130 @@
+from unittest.mock import patch
+
+import pytest
+
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_user import FirebaseUser
+
+
+@pytest.fixture
+def database() -> InMemoryDatabase:
+    return InMemoryDatabase({"users": {"-a": {"phoneNumber": "+558597648593", "name": "Pedro"},
+                                       "-b": {"phoneNumber": "+558576481232", "name": "Ana Oliveira"}}})
+
+
+@pytest.fixture
+def firebase_user(database: InMemoryDatabase) -> FirebaseUser:
+    with inMemoryFirebaseConnection(database) as connection:
+        yield FirebaseUser.__wrapped__(connection)
+
+
+def test_getUniqueIdByPhoneNumber(firebase_user: FirebaseUser):
+    assert firebase_user.getUniqueIdByPhoneNumber("+558576481232") == "-b"
+    assert firebase_user.getUniqueIdByPhoneNumber("+550000000000") is None
+
+
+def test_getUserByPhoneNumber(firebase_user: FirebaseUser):
+    user = firebase_user.getUserByPhoneNumber("+558597648593")
+    assert user == {"phoneNumber": "+558597648593", "name": "Pedro"}
+
+
+def test_lookupOnlyTransfersMatchingUser(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    for index in range(1000):
+        database.reference("users").push({"phoneNumber": f"+5585{index:08d}", "name": f"User {index}"})
+    database.bytesRead = 0
+    firebase_user.getUserByPhoneNumber("+558597648593")
+    assert database.bytesRead < 200
+
+
+def test_updateUserOverwritesOnlyThatUser(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    assert firebase_user.updateUser({"phoneNumber": "+558597648593", "name": "Pedro Alves"})
+    users = database.reference("users").get()
+    assert users["-a"]["name"] == "Pedro Alves"
+    assert users["-b"]["name"] == "Ana Oliveira"
+
+
+def test_deleteUserRemovesTheStoredNodeOnly(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    assert firebase_user.deleteUser({"phoneNumber": "+558597648593", "name": "Pedro"})
+    assert database.reference("users").get() == {"-b": {"phoneNumber": "+558576481232", "name": "Ana Oliveira"}}
+    assert not firebase_user.deleteUser({"phoneNumber": "+558597648593"})
+
+
+def test_deleteUsersInOneUpdate(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    results = firebase_user.deleteUsers(["+558597648593", "+558576481232", "+550000000000", "+558597648593", ""])
+    assert [result["status"] for result in results] == ["deleted", "deleted", "missing", "duplicate", "invalid"]
+    assert not database.reference("users").get()
+
+
+def test_failedDeletesAreReportedAndStayRegistered(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    firebase_user.loadRegisteredNumbers()
+    with patch.object(firebase_user.collection.connection, "update", side_effect=ConnectionError("offline")):
+        results = firebase_user.deleteUsers(["+558597648593", "+558576481232"])
+    assert [result["status"] for result in results] == ["failed", "failed"]
+    assert len(database.reference("users").get()) == 2
+    assert firebase_user.existingUser({"phoneNumber": "+558597648593"})
+
+
+def test_bulkWritesOnlyReadTheirOwnRows(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    for index in range(1000):
+        database.reference("users").push({"phoneNumber": f"+5585{index:08d}", "name": f"User {index}"})
+    database.bytesRead = 0
+    firebase_user.createUsers([{"phoneNumber": "+558511112222", "name": "Bia"}])
+    firebase_user.updateUsers([{"phoneNumber": "+558597648593", "name": "Pedro Alves"}])
+    firebase_user.deleteUsers(["+558576481232"])
+    assert database.bytesRead < 500
+
+
+def test_createUsersDedupesAndWritesInChunks(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    rows = [{"phoneNumber": f"+5585{index:08d}", "name": f"User {index}"} for index in range(5)]
+    rows += [{"phoneNumber": "+558597648593", "name": "Pedro again"}, {"phoneNumber": "+558500000001"}, {"name": "?"}]
+    with patch.object(firebase_user.collection.connection, "update",
+                      wraps=firebase_user.collection.connection.update) as update:
+        results = firebase_user.createUsers(rows, rowsPerBatch=2)
+    assert [result["status"] for result in results] == ["created"] * 5 + ["duplicate", "duplicate", "invalid"]
+    assert update.call_count == 3
+    assert len(database.reference("users").get()) == 7
+    assert firebase_user.getUserByPhoneNumber("+558500000001") == {"phoneNumber": "+558500000001", "name": "User 1"}
+
+
+def test_updateUsersReportsMissingRows(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    results = firebase_user.updateUsers([{"phoneNumber": "+558576481232", "name": "Ana"}, {"phoneNumber": "+55"}])
+    assert [(result["status"], result["key"]) for result in results] == [("updated", "-b"), ("missing", None)]
+    assert database.reference("users/-b/name").get() == "Ana"
+
+
+def test_unregisteredNumberIsAnsweredWithoutReadingStorage(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    firebase_user.loadRegisteredNumbers()
+    database.bytesRead = 0
+    assert not firebase_user.existingUser({"phoneNumber": "+550000000000"})
+    assert database.bytesRead == 0
+    assert firebase_user.existingUser({"phoneNumber": "+558597648593"})
+    assert database.bytesRead > 0
+
+
+def test_userDeletedByAnotherWorkerIsNotTrusted(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    firebase_user.loadRegisteredNumbers()
+    database.reference("users/-a").delete()
+    assert not firebase_user.existingUser({"phoneNumber": "+558597648593"})
+    assert firebase_user.registeredNumbers.isRegistered("+558597648593") is False
+
+
+def test_registeredNumbersFollowSignupsAndDeletions(firebase_user: FirebaseUser):
+    firebase_user.loadRegisteredNumbers()
+    assert firebase_user.createUser({"phoneNumber": "+558511112222", "name": "Bia"})
+    assert firebase_user.existingUser({"phoneNumber": "+558511112222"})
+    firebase_user.createUsers([{"phoneNumber": "+558533334444", "name": "Caio"}])
+    assert firebase_user.existingUser({"phoneNumber": "+558533334444"})
+    assert firebase_user.deleteUser({"phoneNumber": "+558597648593"})
+    firebase_user.deleteUsers(["+558576481232"])
+    assert not firebase_user.existingUser({"phoneNumber": "+558597648593"})
+    assert not firebase_user.existingUser({"phoneNumber": "+558576481232"})
+
+
+def test_filterWithoutExactSetLeavesMaybesToStorage(firebase_user: FirebaseUser, database: InMemoryDatabase):
+    firebase_user.loadRegisteredNumbers(exact=False)
+    assert firebase_user.registeredNumbers.isRegistered("+558597648593") is None
+    assert firebase_user.existingUser({"phoneNumber": "+558597648593"})
+    database.bytesRead = 0
+    assert not firebase_user.existingUser({"phoneNumber": "+550000000000"})
+    assert database.bytesRead == 0
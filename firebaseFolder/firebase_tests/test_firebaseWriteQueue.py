@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+import pytest
+
+from firebaseFolder.firebase_conversation import FirebaseConversation, getDummyConversationDicts
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_write_queue import FirebaseWriteBehindQueue
+from utils.metrics import MetricsRegistry
+
+PHONE_NUMBER = "+558599171902"
+
+
+@pytest.fixture
+def firebase_conversation():
+    with inMemoryFirebaseConnection(InMemoryDatabase()) as connection:
+        conversationInstance = FirebaseConversation.__wrapped__(connection, keyByPhoneNumber=False)
+        for phoneNumber in (PHONE_NUMBER, "+558597648593"):
+            conversation = getDummyConversationDicts(phoneNumber=phoneNumber)["dummyPot"][0]
+            conversationInstance.createConversation(dict(conversation, unreadMessages=0))
+        yield conversationInstance
+
+
+def __storedConversation(conversationInstance: FirebaseConversation, phoneNumber: str = PHONE_NUMBER) -> dict:
+    return conversationInstance.collection.readData(conversationInstance.getUniqueIdByWhatsappNumber(phoneNumber))
+
+
+def test_writesToOneConversationAreCoalesced(firebase_conversation: FirebaseConversation):
+    writeQueue = FirebaseWriteBehindQueue(firebase_conversation, workers=1, flushInterval=0.2,
+                                          metrics=MetricsRegistry()).start()
+    with patch.object(firebase_conversation.rootReference, "update",
+                      wraps=firebase_conversation.rootReference.update) as update:
+        sent = [writeQueue.enqueueMessage({"body": f"msg {index}"}, PHONE_NUMBER) for index in range(10)]
+        writeQueue.enqueueMessage({"body": "other"}, "+558597648593")
+        assert writeQueue.flush(timeout=5)
+    stored = __storedConversation(firebase_conversation)
+    assert update.call_count == 1
+    assert [message["body"] for message in stored["messagePot"].values()][-10:] == [m["body"] for m in sent]
+    assert stored["lastMessage"]["body"] == "msg 9"
+    assert stored["unreadMessages"] == 10
+    assert __storedConversation(firebase_conversation, "+558597648593")["unreadMessages"] == 1
+    writeQueue.shutdown()
+
+
+def test_counterResetFollowedByMessageKeepsOrder(firebase_conversation: FirebaseConversation):
+    writeQueue = FirebaseWriteBehindQueue(firebase_conversation, workers=1, flushInterval=0.2,
+                                          metrics=MetricsRegistry()).start()
+    writeQueue.enqueueMessage({"body": "first"}, PHONE_NUMBER)
+    writeQueue.enqueueConversationUpdate(PHONE_NUMBER, {"unreadMessages": 0, "status": "closed"})
+    writeQueue.enqueueMessage({"body": "second"}, PHONE_NUMBER)
+    writeQueue.shutdown()
+    stored = __storedConversation(firebase_conversation)
+    assert stored["unreadMessages"] == 1
+    assert stored["status"] == "closed"
+    # Looked up by key: shutdown() flushes at once, so both summaries can share the same updatedAt millisecond
+    uniqueId = firebase_conversation.getUniqueIdByWhatsappNumber(PHONE_NUMBER)
+    summaries = {summary["key"]: summary for summary in firebase_conversation.getConversationSummaries()}
+    assert summaries[uniqueId]["unreadMessages"] == 1
+
+
+def test_shutdownDrainsAndExportsMetrics(firebase_conversation: FirebaseConversation):
+    registry = MetricsRegistry()
+    writeQueue = FirebaseWriteBehindQueue(firebase_conversation, workers=3, maxBatchSize=7, flushInterval=0.01,
+                                          metrics=registry).start()
+    for index in range(50):
+        writeQueue.enqueueMessage({"body": f"msg {index}"}, PHONE_NUMBER if index % 2 else "+558597648593")
+    writeQueue.enqueueMessage({"body": "lost"}, "+5500000000")
+    writeQueue.shutdown()
+    with pytest.raises(RuntimeError):
+        writeQueue.enqueueMessage({"body": "late"}, PHONE_NUMBER)
+    assert __storedConversation(firebase_conversation)["unreadMessages"] == 25
+    snapshot = registry.snapshot()
+    assert snapshot["gauges"]["firebase_write_queue.depth"] == 0
+    assert snapshot["counters"]["firebase_write_queue.written"] == 50
+    assert snapshot["counters"]["firebase_write_queue.dropped"] == 1
+    assert snapshot["histograms"]["firebase_write_queue.batch_size"]["max"] <= 7
+
+
+def test_failedUpdatesAreRetried(firebase_conversation: FirebaseConversation):
+    writeQueue = FirebaseWriteBehindQueue(firebase_conversation, workers=1, retryBackoff=0,
+                                          metrics=MetricsRegistry()).start()
+    realUpdate = firebase_conversation.rootReference.update
+    calls = []
+
+    def flakyUpdate(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        realUpdate(value)
+
+    with patch.object(firebase_conversation.rootReference, "update", side_effect=flakyUpdate):
+        writeQueue.enqueueMessage({"body": "retried"}, PHONE_NUMBER)
+        writeQueue.flush(timeout=5)
+    writeQueue.shutdown()
+    assert len(calls) == 2
+    assert __storedConversation(firebase_conversation)["lastMessage"]["body"] == "retried"
+
+
+def test_failedUpdateDoesNotStopTheRestOfTheBatch(firebase_conversation: FirebaseConversation):
+    registry = MetricsRegistry()
+    writeQueue = FirebaseWriteBehindQueue(firebase_conversation, workers=1, flushInterval=0.2, maxRetries=0,
+                                          metrics=registry).start()
+    realUpdate = firebase_conversation.rootReference.update
+    calls = []
+
+    def failFirstUpdate(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        realUpdate(value)
+
+    with patch.object(firebase_conversation.rootReference, "update", side_effect=failFirstUpdate):
+        writeQueue.enqueueMessage({"body": "lost"}, PHONE_NUMBER)
+        # Nested under lastMessage, so it can't share the message's update
+        writeQueue.enqueueConversationUpdate(PHONE_NUMBER, {"lastMessage/body": "edited"})
+        writeQueue.shutdown()
+    assert len(calls) == 2
+    assert __storedConversation(firebase_conversation)["lastMessage"]["body"] == "edited"
+    counters = registry.snapshot()["counters"]
+    assert (counters["firebase_write_queue.written"], counters["firebase_write_queue.failed"]) == (1, 1)
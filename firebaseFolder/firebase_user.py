@@ -1,56 +1,162 @@
-from dialogflow_session import singleton, update_connection_decorator
-from firebaseFolder.firebase_connection import FirebaseConnection
-from firebaseFolder.firebase_core_wrapper import FirebaseWrapper
+from typing import List
+
+from dialogflow_session import singleton
+from firebaseFolder.firebase_bulk import BULK_ROWS_PER_BATCH, applyBatchOutcomes, bulkRowResult
+from firebaseFolder.firebase_connection import FirebaseConnection, generatePushKey
+from firebaseFolder.firebase_membership import RegisteredNumbers
 
 
 @singleton
-class FirebaseUser(FirebaseWrapper):
+class FirebaseUser:
     def __init__(self, inputFirebaseConnection: FirebaseConnection):
-        super().__init__()
         self.firebaseConnection = inputFirebaseConnection
-
-    def updateConnection(self):
-        self.firebaseConnection.changeDatabaseConnection("users")
+        self.collection = inputFirebaseConnection.bindCollection("users")
+        self.mirror = None
+        self.registeredNumbers = None
 
     def getAllUsers(self):
-        return self.firebaseConnection.readData()
+        if self.mirror is not None and self.mirror.ready:
+            return self.mirror.snapshot() or None
+        return self.collection.readData()
+
+    def getUsersByPhoneNumber(self, phoneNumber: str) -> dict:
+        if self.mirror is not None and self.mirror.ready:
+            return self.mirror.getUsersByPhoneNumber(phoneNumber)
+        return self.collection.readDataByChild("phoneNumber", phoneNumber)
 
     def getUniqueIdByPhoneNumber(self, phoneNumber: str) -> str or None:
-        # sourcery skip: use-next
-        allUsers = self.getAllUsers()
-        if allUsers is None:
-            return None
-        for uniqueId, userData in allUsers.items():
-            if userData["phoneNumber"] == phoneNumber:
-                return uniqueId
-        return None
+        matchingUsers = self.getUsersByPhoneNumber(phoneNumber)
+        return next(iter(matchingUsers), None)
+
+    def getUserByPhoneNumber(self, phoneNumber: str) -> dict or None:
+        matchingUsers = self.getUsersByPhoneNumber(phoneNumber)
+        return next(iter(matchingUsers.values()), None)
+
+    def loadRegisteredNumbers(self, falsePositiveRate: float = 0.01, exact: bool = True) -> RegisteredNumbers:
+        """Reads every user once so existingUser() can answer from memory from then on. With the users mirror
+        running, its stream keeps the numbers current with signups and deletions made by other workers."""
+        users = self.getAllUsers() or {}
+        phoneNumbers = [userData["phoneNumber"] for userData in users.values()
+                        if isinstance(userData, dict) and userData.get("phoneNumber")]
+        self.registeredNumbers = RegisteredNumbers.fromPhoneNumbers(phoneNumbers, falsePositiveRate, exact)
+        if self.mirror is not None:
+            self.mirror.trackRegisteredNumbers(self.registeredNumbers)
+        return self.registeredNumbers
 
     def existingUser(self, inputUserData: dict) -> bool:
-        uniqueId = self.getUniqueIdByPhoneNumber(inputUserData["phoneNumber"])
-        return uniqueId is not None
+        """A definite "no" from registeredNumbers is answered without I/O. Its "yes" may be stale (a user deleted
+        by another worker keeps its filter bits), so it is confirmed with the mirror or storage."""
+        phoneNumber = inputUserData["phoneNumber"]
+        if self.registeredNumbers is not None and self.registeredNumbers.isRegistered(phoneNumber) is False:
+            return False
+        registered = self.getUniqueIdByPhoneNumber(phoneNumber) is not None
+        if not registered and self.registeredNumbers is not None:
+            self.registeredNumbers.discard(phoneNumber)
+        return registered
 
     def createUser(self, userData: dict) -> bool:
-        existingUser = self.existingUser(userData)
-        return (
-            False if existingUser
-            else self.firebaseConnection.writeData(data=userData)
-        )
+        # Checked against storage, not registeredNumbers: another worker may have registered the number
+        existingUser = self.getUniqueIdByPhoneNumber(userData["phoneNumber"]) is not None
+        if existingUser:
+            return False
+        created = self.collection.writeData(data=userData)
+        if created and self.registeredNumbers is not None:
+            self.registeredNumbers.add(userData["phoneNumber"])
+        return created
 
     def updateUser(self, userData: dict) -> bool:
-        existingUser = self.existingUser(userData)
+        uniqueId = self.getUniqueIdByPhoneNumber(userData["phoneNumber"])
         return (
-            self.firebaseConnection.overWriteData(data=userData)
-            if existingUser
+            self.collection.overWriteData(path=uniqueId, data=userData)
+            if uniqueId is not None
             else False
         )
 
     def deleteUser(self, userData: dict) -> bool:
-        existingUser = self.existingUser(userData)
-        return (
-            self.firebaseConnection.deleteData(data=userData)
-            if existingUser
-            else False
-        )
+        uniqueId = self.getUniqueIdByPhoneNumber(userData["phoneNumber"])
+        if uniqueId is None:
+            return False
+        deleted = self.collection.deleteDataByKey(uniqueId)
+        if deleted and self.registeredNumbers is not None:
+            self.registeredNumbers.discard(userData["phoneNumber"])
+        return deleted
+
+    def deleteUsers(self, phoneNumbers: List[str], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Deletes every matching user with chunked multi-path updates. Returns one result per input number with
+        status deleted, missing, duplicate, invalid or failed."""
+        knownKeys = self.__getKeysByPhoneNumber(phoneNumbers)
+        results, writtenResults, rowUpdates = [], [], []
+        deletedKeys = set()
+        for index, phoneNumber in enumerate(phoneNumbers):
+            uniqueId = knownKeys.get(phoneNumber) if phoneNumber else None
+            if not phoneNumber:
+                results.append(bulkRowResult(index, phoneNumber, "invalid"))
+            elif uniqueId is None:
+                results.append(bulkRowResult(index, phoneNumber, "missing"))
+            elif uniqueId in deletedKeys:
+                results.append(bulkRowResult(index, phoneNumber, "duplicate", uniqueId))
+            else:
+                deletedKeys.add(uniqueId)
+                rowUpdates.append({uniqueId: None})
+                results.append(bulkRowResult(index, phoneNumber, "deleted", uniqueId))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, self.collection.updateDataInBatches(rowUpdates, rowsPerBatch=rowsPerBatch))
+        if self.registeredNumbers is not None:
+            for result in writtenResults:
+                if result["status"] == "deleted":
+                    self.registeredNumbers.discard(result["phoneNumber"])
+        return results
+
+    def __getKeysByPhoneNumber(self, phoneNumbers: List[str]) -> dict:
+        """Resolves only the numbers of the batch: one indexed query per distinct number, or none at all while the
+        mirror is running. Numbers with no stored user are left out."""
+        knownKeys = {phoneNumber: self.getUniqueIdByPhoneNumber(phoneNumber)
+                     for phoneNumber in dict.fromkeys(phoneNumbers) if phoneNumber}
+        return {phoneNumber: uniqueId for phoneNumber, uniqueId in knownKeys.items() if uniqueId is not None}
+
+    @staticmethod
+    def __phoneNumberOf(userData: dict) -> str or None:
+        return userData.get("phoneNumber") if isinstance(userData, dict) else None
+
+    def createUsers(self, users: List[dict], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Creates the users whose phoneNumber isn't stored yet (nor repeated earlier in `users`). Returns one
+        result per input row with status created, duplicate, invalid or failed."""
+        knownKeys = self.__getKeysByPhoneNumber([self.__phoneNumberOf(userData) for userData in users])
+        results, writtenResults, rowUpdates = [], [], []
+        for index, userData in enumerate(users):
+            phoneNumber = self.__phoneNumberOf(userData)
+            if not phoneNumber:
+                results.append(bulkRowResult(index, phoneNumber, "invalid"))
+            elif phoneNumber in knownKeys:
+                results.append(bulkRowResult(index, phoneNumber, "duplicate", knownKeys[phoneNumber]))
+            else:
+                uniqueId = knownKeys[phoneNumber] = generatePushKey()
+                rowUpdates.append({uniqueId: userData})
+                results.append(bulkRowResult(index, phoneNumber, "created", uniqueId))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, self.collection.updateDataInBatches(rowUpdates, rowsPerBatch=rowsPerBatch))
+        if self.registeredNumbers is not None:
+            for result in writtenResults:
+                if result["status"] == "created":
+                    self.registeredNumbers.add(result["phoneNumber"])
+        return results
+
+    def updateUsers(self, users: List[dict], rowsPerBatch: int = BULK_ROWS_PER_BATCH) -> List[dict]:
+        """Overwrites each stored user matched by phoneNumber. Status updated, missing, invalid or failed."""
+        knownKeys = self.__getKeysByPhoneNumber([self.__phoneNumberOf(userData) for userData in users])
+        results, writtenResults, rowUpdates = [], [], []
+        for index, userData in enumerate(users):
+            phoneNumber = self.__phoneNumberOf(userData)
+            if not phoneNumber:
+                results.append(bulkRowResult(index, phoneNumber, "invalid"))
+            elif phoneNumber not in knownKeys:
+                results.append(bulkRowResult(index, phoneNumber, "missing"))
+            else:
+                rowUpdates.append({knownKeys[phoneNumber]: userData})
+                results.append(bulkRowResult(index, phoneNumber, "updated", knownKeys[phoneNumber]))
+                writtenResults.append(results[-1])
+        applyBatchOutcomes(writtenResults, self.collection.updateDataInBatches(rowUpdates, rowsPerBatch=rowsPerBatch))
+        return results
 
 
 def __createDummyUsers():
@@ -59,8 +165,7 @@ def __createDummyUsers():
     dummyPot = [{"phoneNumber": "+558597648593", "name": "Pedro"},
                 {"phoneNumber": "+558576481232", "name": "Ana Oliveira"},
                 {"phoneNumber": "+558549854871", "name": "Carolina Lima"}]
-    for user in dummyPot:
-        fu.createUser(user)
+    fu.createUsers(dummyPot)
 
 
 def __main():
@@ -0,0 +1,211 @@
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from firebaseFolder.firebase_connection import generatePushKey, serverIncrement
+from firebaseFolder.firebase_conversation import FirebaseConversation
+from firebaseFolder.firebase_phone_index import normalizePhoneNumber
+from utils.metrics import MetricsRegistry, metrics as defaultMetrics
+
+_PendingWrite = namedtuple('_PendingWrite', 'whatsappNumber buildUpdate enqueuedAt')
+_STOP = object()
+
+
+def writeBehindEnabled() -> bool:
+    return os.getenv("FIREBASE_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+
+
+def _isIncrement(value) -> bool:
+    return isinstance(value, dict) and isinstance(value.get(".sv"), dict) and "increment" in value[".sv"]
+
+
+def _splitPath(path: str) -> tuple:
+    return tuple(segment for segment in path.split("/") if segment)
+
+
+class _CoalescedUpdate:
+    """Root multi-path update built from several queued writes. Later writes to the same path win, except server
+    increments which add up. A path nested under (or above) one already present can't share an update in the
+    Realtime Database, so add() refuses it and the caller starts another update."""
+
+    def __init__(self):
+        self.values = {}
+        self.ancestors = set()
+        self.writes = 0
+
+    def add(self, rootUpdate: dict) -> bool:
+        paths = [_splitPath(path) for path in rootUpdate]
+        for segments in paths:
+            if segments not in self.values and (segments in self.ancestors or
+                                                any(segments[:length] in self.values
+                                                    for length in range(1, len(segments)))):
+                return False
+        for segments, value in zip(paths, rootUpdate.values()):
+            previous = self.values.get(segments)
+            if _isIncrement(previous) and _isIncrement(value):
+                value = serverIncrement(previous[".sv"]["increment"] + value[".sv"]["increment"])
+            elif isinstance(previous, (int, float)) and not isinstance(previous, bool) and _isIncrement(value):
+                value = previous + value[".sv"]["increment"]
+            self.values[segments] = value
+            self.ancestors.update(segments[:length] for length in range(1, len(segments)))
+        self.writes += 1
+        return True
+
+    def toRootUpdate(self) -> dict:
+        return {"/".join(segments): value for segments, value in self.values.items()}
+
+
+class FirebaseWriteBehindQueue:
+    """Persists chat messages and conversation field changes off the request thread.
+
+    Writes are sharded by phone number over `workers` threads, so each conversation is written by one worker in
+    enqueue order. A worker collects a batch until it holds `maxBatchSize` writes or `flushInterval` seconds have
+    passed since its first write, coalesces it into as few root multi-path updates as possible and retries failed
+    updates with exponential backoff. shutdown() stops accepting writes and drains everything already queued.
+
+    Exported metrics (prefix `firebase_write_queue`): `depth` gauge, `batch_size`, `flush_latency_seconds` and
+    `queue_lag_seconds` histograms, `written`, `coalesced_updates`, `dropped` and `failed` counters."""
+
+    def __init__(self, firebaseConversation: FirebaseConversation, workers: int = 2, maxBatchSize: int = 100,
+                 flushInterval: float = 0.05, maxRetries: int = 3, retryBackoff: float = 0.1,
+                 metrics: MetricsRegistry = None):
+        self.firebaseConversation = firebaseConversation
+        self.maxBatchSize = maxBatchSize
+        self.flushInterval = flushInterval
+        self.maxRetries = maxRetries
+        self.retryBackoff = retryBackoff
+        self.metrics = metrics if metrics is not None else defaultMetrics
+        self.shards = [queue.Queue() for _ in range(workers)]
+        self.threads = []
+        self.pending = 0
+        self.pendingCondition = threading.Condition()
+        self.accepting = False
+
+    @classmethod
+    def fromEnvironment(cls, firebaseConversation: FirebaseConversation):
+        return cls(firebaseConversation, workers=int(os.getenv("FIREBASE_WRITE_BEHIND_WORKERS", "2")),
+                   maxBatchSize=int(os.getenv("FIREBASE_WRITE_BEHIND_BATCH_SIZE", "100")),
+                   flushInterval=float(os.getenv("FIREBASE_WRITE_BEHIND_FLUSH_SECONDS", "0.05")))
+
+    def start(self):
+        self.accepting = True
+        for index, shard in enumerate(self.shards):
+            thread = threading.Thread(target=self.__work, args=(shard,), name=f"write-behind-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def enqueueMessage(self, messageData: dict, whatsappNumber: str, countAsUnread: bool = True) -> dict:
+        """Queued counterpart of FirebaseConversation.appendMessageToWhatsappNumber. The message id is assigned
+        now, so the returned messageData is final even though it isn't stored yet."""
+        messageData["id"] = generatePushKey()
+        self.__enqueue(whatsappNumber, lambda uniqueId: self.firebaseConversation.buildMessageUpdate(
+            uniqueId, messageData, countAsUnread))
+        return messageData
+
+    def enqueueConversationUpdate(self, whatsappNumber: str, fields: dict):
+        """Sets top-level conversation fields such as status or unreadMessages."""
+        self.__enqueue(whatsappNumber, lambda uniqueId: self.firebaseConversation.buildConversationUpdate(
+            uniqueId, fields))
+
+    def __enqueue(self, whatsappNumber: str, buildUpdate):
+        if not self.accepting:
+            raise RuntimeError("Write-behind queue is not accepting writes")
+        shardIndex = zlib.crc32(normalizePhoneNumber(whatsappNumber).encode()) % len(self.shards)
+        with self.pendingCondition:
+            self.pending += 1
+            self.metrics.setGauge("firebase_write_queue.depth", self.pending)
+        self.shards[shardIndex].put(_PendingWrite(whatsappNumber, buildUpdate, time.monotonic()))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until everything queued so far has been written (or given up on)."""
+        with self.pendingCondition:
+            return self.pendingCondition.wait_for(lambda: self.pending == 0, timeout)
+
+    def shutdown(self, timeout: float = None):
+        self.accepting = False
+        for shard in self.shards:
+            shard.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def __work(self, shard: queue.Queue):
+        while True:
+            item = shard.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flushInterval
+            stopping = False
+            while len(batch) < self.maxBatchSize:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = shard.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.__writeBatch(batch)
+            if stopping:
+                return
+
+    def __writeBatch(self, batch: list):
+        try:
+            updates = [_CoalescedUpdate()]
+            uniqueIds = {}
+            dropped = 0
+            for item in batch:
+                if item.whatsappNumber not in uniqueIds:
+                    uniqueIds[item.whatsappNumber] = self.firebaseConversation.getUniqueIdByWhatsappNumber(
+                        item.whatsappNumber)
+                uniqueId = uniqueIds[item.whatsappNumber]
+                if not uniqueId:
+                    logging.warning(f"Dropping queued write: no conversation for {item.whatsappNumber}")
+                    dropped += 1
+                    continue
+                rootUpdate = item.buildUpdate(uniqueId)
+                if not updates[-1].add(rootUpdate):
+                    updates.append(_CoalescedUpdate())
+                    updates[-1].add(rootUpdate)
+            start = time.monotonic()
+            # Every update is sent even after one gave up, so a failure only loses the writes it carried
+            outcomes = [(update.writes, self.__writeWithRetry(update.toRootUpdate()))
+                        for update in updates if update.values]
+            written = sum(writes for writes, succeeded in outcomes if succeeded)
+            finished = time.monotonic()
+            self.metrics.observe("firebase_write_queue.batch_size", len(batch))
+            self.metrics.observe("firebase_write_queue.flush_latency_seconds", finished - start)
+            for item in batch:
+                self.metrics.observe("firebase_write_queue.queue_lag_seconds", finished - item.enqueuedAt)
+            self.metrics.increment("firebase_write_queue.coalesced_updates", len(updates))
+            self.metrics.increment("firebase_write_queue.dropped", dropped)
+            self.metrics.increment("firebase_write_queue.written", written)
+            self.metrics.increment("firebase_write_queue.failed", len(batch) - dropped - written)
+        except Exception as exception:
+            logging.error(f"Write-behind batch of {len(batch)} writes failed: {exception}")
+            self.metrics.increment("firebase_write_queue.failed", len(batch))
+        finally:
+            with self.pendingCondition:
+                self.pending -= len(batch)
+                self.metrics.setGauge("firebase_write_queue.depth", self.pending)
+                self.pendingCondition.notify_all()
+
+    def __writeWithRetry(self, rootUpdate: dict) -> bool:
+        for attempt in range(self.maxRetries + 1):
+            try:
+                self.firebaseConversation.rootReference.update(rootUpdate)
+                return True
+            except Exception as exception:
+                logging.warning(f"Write-behind update failed (attempt {attempt + 1}): {exception}")
+                if attempt < self.maxRetries:
+                    time.sleep(self.retryBackoff * 2 ** attempt)
+        return False
@@ -1,3 +1,4 @@
+import logging
 import os
 
 import openai
@@ -8,6 +9,9 @@ from gpt import phrase_enum
 from gpt.phrase_enum import PhraseEnum
 from gpt.time_decorator import timingDecorator
 from intentManipulation.intent_manager_tiago import IntentManager
+from utils.circuit_breaker import CircuitOpenError, getCircuitBreaker
+
+BUSY_MESSAGE = "Estamos com muita mensagens no momento, repita a mensagem dentro de instantes"
 
 
 def readTxtAndConvertToString(filepath: str):
@@ -26,7 +30,8 @@ def getPizzaGPTPrompt(prompt: str):
 
 @timingDecorator
 def getResponseDefaultGPT(prompt: str):
-    completion = openai.Completion.create(
+    completion = getCircuitBreaker("openai").call(
+        openai.Completion.create,
         model="text-davinci-003",
         prompt=prompt,
         temperature=0.9,
@@ -50,20 +55,27 @@ class PizzaGPT:
         self.messages = [{"role": "user", "content": self.init_phrase}]
         self.intents_dictionary = {}
 
-        self.completion = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=self.messages
-        )
+        try:
+            self.completion = getCircuitBreaker("openai").call(
+                openai.ChatCompletion.create,
+                model="gpt-3.5-turbo",
+                messages=self.messages
+            )
+        except (CircuitOpenError, openai.error.OpenAIError) as error:
+            # Still usable: getResponseChatGPT answers BUSY_MESSAGE until OpenAI is back
+            logging.warning(f"OpenAI unavailable ({error}), starting without the opening completion")
+            self.completion = None
 
     def getResponseChatGPT(self, prompt: str):
         try:
             self.messages.append({"role": "user", "content": prompt})
-            self.completion = openai.ChatCompletion.create(
+            self.completion = getCircuitBreaker("openai").call(
+                openai.ChatCompletion.create,
                 model="gpt-3.5-turbo",
                 messages=self.messages
             )
-        except openai.error.RateLimitError as e:
-            return "Estamos com muita mensagens no momento, repita a mensagem dentro de instantes"
+        except (CircuitOpenError, openai.error.OpenAIError):
+            return BUSY_MESSAGE
 
         gpt_response = json.loads(self.completion.choices[-1]["message"]["content"])
         return IntentManager.process_intent(gpt_response)
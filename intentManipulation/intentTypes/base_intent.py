@@ -22,9 +22,14 @@ class BaseIntent:
         self.alreadyWelcomed = True
         return self._formatOutputMessage(self._produceFirstSentence())
 
-    def parseIncomingMessage(self, message: str):
+    def parseIncomingMessage(self, message: str, alreadyWelcomed: bool = None):
+        """`alreadyWelcomed` comes from the caller's session when the intent is shared between customers; when it
+        is None the intent's own flag is used."""
         raise NotImplementedError("Subclasses must implement parseIncomingMessage method.")
 
+    def _isWelcomed(self, alreadyWelcomed: bool = None) -> bool:
+        return self.alreadyWelcomed if alreadyWelcomed is None else alreadyWelcomed
+
     def _parse_message(self, message: str):
         raise NotImplementedError("Subclasses must implement _parse_message method.")
 
@@ -96,8 +96,8 @@ class EntryTextIntent(BaseIntent):
             }
         )
 
-    def parseIncomingMessage(self, message: str) -> dict:
-        if not self.alreadyWelcomed:
+    def parseIncomingMessage(self, message: str, alreadyWelcomed: bool = None) -> dict:
+        if not self._isWelcomed(alreadyWelcomed):
             return self.sendFirstMessage()
 
         validators = self.reply["validators"] if self.reply["validators"] is not None else []
@@ -12,9 +12,9 @@ class InstantFallbackIntent(BaseIntent):
     def _produceFirstSentence(self):
         return self.reply["main"]
 
-    def parseIncomingMessage(self, message: str):
+    def parseIncomingMessage(self, message: str, alreadyWelcomed: bool = None):
         # sourcery skip: assign-if-exp, swap-if-expression
-        if not self.alreadyWelcomed:
+        if not self._isWelcomed(alreadyWelcomed):
             return self.sendFirstMessage()
         return {"changeIntent": "MENU", 'chosenOption': message}
 
@@ -15,8 +15,8 @@ class MultipleChoiceIntent(BaseIntent):
         menu = '\n'.join([f"{key}- {value}" for key, value in enumerate(choices, start=1)])
         return f"{text}\n{menu}"
 
-    def parseIncomingMessage(self, message: str):
-        if not self.alreadyWelcomed:
+    def parseIncomingMessage(self, message: str, alreadyWelcomed: bool = None):
+        if not self._isWelcomed(alreadyWelcomed):
             return self.sendFirstMessage()
         choice = int(message)
         integerChoices = [int(key) for key in self.reply.keys() if key.isdigit()]
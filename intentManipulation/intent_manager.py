@@ -1,3 +1,4 @@
+import os
 from typing import List
 
 from colorama import Fore, Style
@@ -5,149 +6,137 @@ from colorama import Fore, Style
 from dialogflow_session import singleton
 from firebaseFolder.firebase_user import FirebaseUser
 from firebaseFolder.firebase_connection import FirebaseConnection
-from intentManipulation.intentTypes.intent_entry_text import EntryTextIntent
-from intentManipulation.intentTypes.intent_fallback import InstantFallbackIntent
-from intentManipulation.intentTypes.intent_multiple_choice import MultipleChoiceIntent
-from intentManipulation.intentTypes.replies import Replies, Types
-from utils import _sendTwilioResponse
-
-
-class IntentNotFoundException(Exception):
-    def __init__(self, intent_name):
-        self.intent_name = intent_name
-        super().__init__(f"Intent '{intent_name}' not found.")
-
-
-def getIntentPot():
-    return [EntryTextIntent(Replies.SIGNUP_NAME), EntryTextIntent(Replies.SIGNUP_EMAIL),
-            EntryTextIntent(Replies.SIGNUP_ADDRESS), EntryTextIntent(Replies.SIGNUP_CPF)]
+from intentManipulation.intentTypes.replies import Types
+from intentManipulation.intent_table import INTENT_TABLE, IntentNotFoundException, IntentTable
+from intentManipulation.session_state import createStateStore
+from intentManipulation.session_store import ConversationState, SessionStore
+from utils.general_utils import _sendTwilioResponse
 
 
 @singleton
 class IntentManager:
-    def __init__(self):
+    """Runs the signup flow. The intents are shared; everything specific to a customer lives in that customer's
+    ConversationState, so any number of customers can sign up at once."""
+
+    def __init__(self, maxSessions: int = None, intentTable: IntentTable = INTENT_TABLE):
         self.fc = FirebaseConnection()
         self.fu = FirebaseUser(self.fc)
-        self.numberPot = []
-        self.whatsappNumber = ""
-        self.existingUser = False
-        self.isUserChecked = False
-        self.intents = getIntentPot()
-        self.currentIntent = self.intents[0]
-        self.extractedParameters = {}
-        self.intentHistory = []  # Will store tuples (intent, messageContent)
-        self.userHistory = []
-        self.botHistory = []
-        self.signupDetails = {}
-        self.count = 0
-        self.finished = False
-
-    def __getIntentByName(self, inputIntentName: str):
-        for intent in self.intents:
-            currentName = intent.reply["intentName"].lower()
-            check = isinstance(inputIntentName, str)
-            if currentName == inputIntentName.lower():
-                return intent
-        raise IntentNotFoundException(inputIntentName)
-
-    def _analyzeBotResponse(self, botResponse: dict):
+        self.intentTable = intentTable
+        if maxSessions is None:
+            maxSessions = int(os.getenv("INTENT_MAX_SESSIONS", "10000"))
+        self.sessions = SessionStore(self.__createState, maxSessions=maxSessions,
+                                     idleTtl=float(os.getenv("INTENT_IDLE_SECONDS", "3600")),
+                                     stateStore=createStateStore("signup"),
+                                     snapshotOptions={"intentTable": intentTable})
+
+    def __createState(self, whatsappNumber: str) -> ConversationState:
+        state = ConversationState(whatsappNumber, intentTable=self.intentTable)
+        state.extractedParameters["phoneNumber"] = whatsappNumber
+        return state
+
+    def _analyzeBotResponse(self, session: ConversationState, botResponse: dict):
         if self.isDefaultIntent(botResponse):
             botAnswer = botResponse["body"]
-            self.botHistory.append(botAnswer)
+            session.botHistory.append(botAnswer)
         else:
-            botAnswer = self.__handleIntentTransition(botResponse)
-        self.intentHistory.append((self.currentIntent.reply["intentName"], botAnswer))
+            botAnswer = self.__handleIntentTransition(session, botResponse)
+        session.intentHistory.append((session.currentIntentName, botAnswer))
         return botAnswer
 
-    def __handleIntentTransition(self, botResponse: dict):
+    def __handleIntentTransition(self, session: ConversationState, botResponse: dict):
         # sourcery skip: use-next
         nextIntentName = botResponse["changeIntent"]
         keyParameters = botResponse.get("parameters", {})
         action = botResponse.get("action")
-        self._handleBotAction(action)
-        self.extractedParameters.update(keyParameters)
-        nextIntent = self.__getIntentByName(nextIntentName)
-        nextIntentType = nextIntent.intentType
-        if nextIntentType != "INSTANT_FALLBACK":
-            self.currentIntent = nextIntent
-        nextIntentAnswer = nextIntent.sendFirstMessage()["body"]
-
-        if not isinstance(nextIntent, InstantFallbackIntent):
-            self.botHistory.append(nextIntentAnswer)
+        self._handleBotAction(session, action)
+        session.extractedParameters.update(keyParameters)
+        nextIntent = self.intentTable.lookup(nextIntentName)
+        if nextIntent.intentType != Types.INSTANT_FALLBACK:
+            session.intentCursor = nextIntent.index
+        nextIntentAnswer = nextIntent.firstReply["body"]
+        session.welcomedMask |= nextIntent.bit
+
+        if nextIntent.intentType != Types.INSTANT_FALLBACK:
+            session.botHistory.append(nextIntentAnswer)
             return nextIntentAnswer
         previousBotAnswer = ""
-        for intentName, botAnswer in reversed(self.intentHistory):
+        for intentName, botAnswer in reversed(session.intentHistory):
             if intentName != nextIntentName:
                 previousBotAnswer = botAnswer
                 break
         finalAnswer = f"{nextIntentAnswer}\n\n{previousBotAnswer}"
-        self.botHistory.append(nextIntentAnswer)
+        session.botHistory.append(nextIntentAnswer)
         return finalAnswer
 
     @staticmethod
     def isDefaultIntent(botResponse):
         return list(botResponse.keys()) == ["body"]
 
-    def _handleBotAction(self, inputAction: str):
+    def _handleBotAction(self, session: ConversationState, inputAction: str):
         if inputAction == "ASSEMBLY_SIGNUP":
             print("Cadastrando usuário...")
-            self.signupDetails.update(self.extractedParameters)
-            self.finished = True
-            self.registerWhatsapp(self.signupDetails)
+            session.signupDetails.update(session.extractedParameters)
+            session.finished = True
+            self.registerWhatsapp(session, session.signupDetails)
+
+    def __parseWithCurrentIntent(self, session: ConversationState, userMessage: str) -> dict:
+        currentIntent = self.intentTable[session.intentCursor]
+        if not session.welcomedMask & currentIntent.bit:
+            session.welcomedMask |= currentIntent.bit
+            return dict(currentIntent.firstReply)
+        return currentIntent.handler.parseIncomingMessage(userMessage, alreadyWelcomed=True)
 
     def chatBotLoop(self):
         """This function simulates a chatbot loop."""
         self.consoleLoop()
 
-    def consoleLoop(self):
-        while True:
-            self.count += 1
-            print(f"---- [{self.count}]")
-            userMessage = input(f"{Fore.RED}User: {Style.RESET_ALL}")
-            self.userHistory.append(userMessage)
-            botResponse = self.currentIntent.parseIncomingMessage(userMessage)
-            botAnswer = self._analyzeBotResponse(botResponse)
-            if not self.finished:
-                print(f"{Fore.YELLOW}Bot:{Style.RESET_ALL} {botAnswer}")
-            print(f"                                  Parâmetros extraídos: {self.extractedParameters}\n")
-            if self.finished:
-                break
-
-    def twilioSingleStep(self, userMessage: str):
-        self.count += 1
-        self.userHistory.append(userMessage)
-        botResponse = self.currentIntent.parseIncomingMessage(userMessage)
-        self.extractedParameters.update(botResponse.get("parameters", {}))
-        action = botResponse.get("action")
-        if action != "ASSEMBLY_SIGNUP":
-            return self._analyzeBotResponse(botResponse)
-        self.finished = True
-        self.registerWhatsapp(self.extractedParameters)
+    def consoleLoop(self, whatsappNumber: str = "console"):
+        with self.sessions.session(whatsappNumber) as session:
+            while True:
+                session.count += 1
+                print(f"---- [{session.count}]")
+                userMessage = input(f"{Fore.RED}User: {Style.RESET_ALL}")
+                session.userHistory.append(userMessage)
+                botResponse = self.__parseWithCurrentIntent(session, userMessage)
+                botAnswer = self._analyzeBotResponse(session, botResponse)
+                if not session.finished:
+                    print(f"{Fore.YELLOW}Bot:{Style.RESET_ALL} {botAnswer}")
+                print(f"                                  Parâmetros extraídos: {session.extractedParameters}\n")
+                if session.finished:
+                    break
+
+    def twilioSingleStep(self, userMessage: str, whatsappNumber: str):
+        with self.sessions.session(whatsappNumber) as session:
+            session.count += 1
+            session.userHistory.append(userMessage)
+            botResponse = self.__parseWithCurrentIntent(session, userMessage)
+            session.extractedParameters.update(botResponse.get("parameters", {}))
+            action = botResponse.get("action")
+            if action != "ASSEMBLY_SIGNUP":
+                return self._analyzeBotResponse(session, botResponse)
+            session.finished = True
+            self.registerWhatsapp(session, session.extractedParameters)
+        self.sessions.discard(whatsappNumber)
         return "Usuário cadastrado com sucesso!"
 
     def existingWhatsapp(self, whatsappNumber: str) -> bool:
         return self.fu.existingUser({"phoneNumber": whatsappNumber})
 
-    def registerWhatsapp(self, userDetails: dict):
-        self.existingUser = True
+    def registerWhatsapp(self, session: ConversationState, userDetails: dict):
+        session.existingUser = True
         return self.fu.createUser(userDetails)
 
-    def __checkUserExistence(self):
-        if not self.isUserChecked:
-            self.existingUser = self.existingWhatsapp(self.whatsappNumber)
-            self.isUserChecked = True
-        return self.existingUser
-
-    def setWhatsappNumber(self, userNumber: str):
-        self.whatsappNumber = userNumber
-        self.__checkUserExistence()
-
     def needsToSignUp(self, userNumber: str):
-        self.setWhatsappNumber(userNumber)
-        return self.existingUser is False
+        with self.sessions.session(userNumber) as session:
+            if session.existingUser is None:
+                session.existingUser = self.existingWhatsapp(userNumber)
+            return session.existingUser is False
+
+    def handleIncomingMessage(self, message: str, whatsappNumber: str):
+        return self.twilioSingleStep(message, whatsappNumber)
 
-    def handleIncomingMessage(self, message: str):
-        return self.twilioSingleStep(message)
+    def getSessionMemoryReport(self) -> dict:
+        return self.sessions.memoryReport()
 
 
 def __main():
@@ -158,7 +147,7 @@ def __main():
         lastBotAnswer = ""
         while lastBotAnswer != "Usuário cadastrado com sucesso!":
             newUserMessage = messagePot.pop(0)
-            lastBotAnswer = im.twilioSingleStep(newUserMessage)
+            lastBotAnswer = im.twilioSingleStep(newUserMessage, "+19574430239")
             print(f"User: {newUserMessage}")
             print(f"Bot: {lastBotAnswer}")
         return
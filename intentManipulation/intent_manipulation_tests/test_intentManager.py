@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from firebaseFolder.firebase_storage import InMemoryDatabase
+from firebaseFolder.firebase_tests.firebase_mock import inMemoryFirebaseConnection
+from firebaseFolder.firebase_user import FirebaseUser
+from intentManipulation.intent_manager import IntentManager
+from intentManipulation.session_state import SqliteStateStore
+
+SIGNUP_SUCCESS = "Usuário cadastrado com sucesso!"
+
+
+@pytest.fixture
+def database() -> InMemoryDatabase:
+    return InMemoryDatabase()
+
+
+@pytest.fixture
+def intent_manager(database: InMemoryDatabase) -> IntentManager:
+    with inMemoryFirebaseConnection(database) as connection, \
+            patch('intentManipulation.intent_manager.FirebaseConnection', return_value=connection), \
+            patch('intentManipulation.intent_manager.FirebaseUser', FirebaseUser.__wrapped__):
+        yield IntentManager.__wrapped__(maxSessions=5000)
+
+
+def __nameFor(index: int) -> str:
+    return "Cliente " + "".join(chr(ord("a") + int(digit)) for digit in str(index))
+
+
+def __signUp(intentManager: IntentManager, index: int) -> list:
+    phoneNumber = f"+5585{index:09d}"
+    messages = ["Oi", __nameFor(index), f"Rua das Flores {index}", f"{index:011d}"]
+    return [intentManager.twilioSingleStep(message, phoneNumber) for message in messages]
+
+
+def test_interleavedSignupsKeepTheirOwnState(intent_manager: IntentManager, database: InMemoryDatabase):
+    first, second = "+558500000001", "+558500000002"
+    assert "nome" in intent_manager.twilioSingleStep("Oi", first)
+    assert "nome" in intent_manager.twilioSingleStep("Olá", second)
+    assert intent_manager.twilioSingleStep("Ana", first) == "Qual o seu endereço?"
+    assert intent_manager.twilioSingleStep("Rua A 1", first) == "Qual o seu CPF?"
+    assert intent_manager.twilioSingleStep("Bia", second) == "Qual o seu endereço?"
+    assert intent_manager.twilioSingleStep("11111111111", first) == SIGNUP_SUCCESS
+    assert intent_manager.twilioSingleStep("Rua B 2", second) == "Qual o seu CPF?"
+    assert intent_manager.twilioSingleStep("22222222222", second) == SIGNUP_SUCCESS
+    users = sorted(database.reference("users").get().values(), key=lambda user: user["phoneNumber"])
+    assert users == [{"phoneNumber": first, "name": "Ana", "address": "Rua A 1", "cpf": "11111111111"},
+                     {"phoneNumber": second, "name": "Bia", "address": "Rua B 2", "cpf": "22222222222"}]
+    assert len(intent_manager.sessions) == 0
+    assert not any(entry.handler.alreadyWelcomed for entry in intent_manager.intentTable.entries)
+
+
+def test_thousandsOfConcurrentSignups(intent_manager: IntentManager, database: InMemoryDatabase):
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        answers = list(executor.map(lambda index: __signUp(intent_manager, index), range(1000)))
+    assert all(answer[-1] == SIGNUP_SUCCESS for answer in answers)
+    users = database.reference("users").get().values()
+    assert len(users) == 1000
+    assert all(user["name"] == __nameFor(int(user["phoneNumber"][5:])) for user in users)
+
+
+def test_workersSharingAStateStoreContinueEachOthersSignup(database: InMemoryDatabase, tmp_path):
+    statePath = str(tmp_path / "state.sqlite3")
+    with inMemoryFirebaseConnection(database) as connection, \
+            patch('intentManipulation.intent_manager.FirebaseConnection', return_value=connection), \
+            patch('intentManipulation.intent_manager.FirebaseUser', FirebaseUser.__wrapped__), \
+            patch('intentManipulation.intent_manager.createStateStore',
+                  side_effect=lambda namespace: SqliteStateStore(statePath, namespace)):
+        workers = [IntentManager.__wrapped__(), IntentManager.__wrapped__()]
+        phoneNumber = "+558500000001"
+        messages = ["Oi", "Ana", "Rua A 1", "11111111111"]
+        answers = [workers[index % 2].twilioSingleStep(message, phoneNumber)
+                   for index, message in enumerate(messages)]
+    assert answers[1:] == ["Qual o seu endereço?", "Qual o seu CPF?", SIGNUP_SUCCESS]
+    assert list(database.reference("users").get().values()) == [
+        {"phoneNumber": phoneNumber, "name": "Ana", "address": "Rua A 1", "cpf": "11111111111"}]
+    assert len(workers[0].sessions) == 0
@@ -0,0 +1,35 @@
+import pytest
+
+from intentManipulation.intentTypes.replies import Replies
+from intentManipulation.intent_table import INTENT_TABLE, IntentNotFoundException, compileIntentTable
+
+
+def test_everyReplyIsCompiled():
+    assert [entry.name for entry in INTENT_TABLE.entries] == ["WELCOME", "MENU", "SIGNUP_NAME", "SIGNUP_EMAIL",
+                                                              "SIGNUP_ADDRESS", "SIGNUP_CPF", "SIGNUP_BIRTHDATE"]
+    assert INTENT_TABLE.start.name == "SIGNUP_NAME"
+    assert all(INTENT_TABLE[entry.index] is entry for entry in INTENT_TABLE.entries)
+
+
+def test_lookupIgnoresCase():
+    assert INTENT_TABLE.lookup("signup_cpf") is INTENT_TABLE.lookup("SIGNUP_CPF")
+    with pytest.raises(IntentNotFoundException):
+        INTENT_TABLE.lookup("FIRST_FLAVOR")
+
+
+def test_tableIsReadOnly():
+    with pytest.raises(TypeError):
+        INTENT_TABLE.byName["menu"] = INTENT_TABLE.start
+    with pytest.raises(TypeError):
+        INTENT_TABLE.start.firstReply["body"] = "Oi"
+
+
+def test_welcomedMaskRoundTrip():
+    mask = INTENT_TABLE.maskOf(["SIGNUP_NAME", "signup_cpf", "REMOVED_INTENT"])
+    assert INTENT_TABLE.namesInMask(mask) == ["SIGNUP_NAME", "SIGNUP_CPF"]
+
+
+def test_firstReplyMatchesTheIntentsFirstMessage():
+    table = compileIntentTable([Replies.SIGNUP_NAME, Replies.SIGNUP_CPF])
+    assert dict(table.lookup("SIGNUP_CPF").firstReply) == {"body": "Qual o seu CPF?"}
+    assert not any(entry.handler.alreadyWelcomed for entry in table.entries)
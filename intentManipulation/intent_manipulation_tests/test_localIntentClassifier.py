@@ -0,0 +1,83 @@
+import pytest
+
+from data.speisekarte_extraction import loadSpeisekarte
+from intentManipulation.local_intent_classifier import LocalIntentClassifier, normalizeText
+
+
+@pytest.fixture
+def classifier():
+    return LocalIntentClassifier(loadSpeisekarte(), intents=None)
+
+
+def test_defaultOnlyAnswersContextFreeIntents():
+    classifier = LocalIntentClassifier(loadSpeisekarte())
+    assert not classifier.answersOrders
+    assert classifier.classify("Oi").intent == "Welcome"
+    assert classifier.classify("sim", awaitingDrink=True) is None
+    assert classifier.classify("uma calabresa") is None
+    assert classifier.classify("uma coca", awaitingDrink=True) is None
+
+
+def test_normalizeText():
+    assert normalizeText("  Olá!!  Boa   NOITE ") == "ola boa noite"
+    assert normalizeText("Coca-Cola, por favor") == "coca cola por favor"
+
+
+@pytest.mark.parametrize("message", ["Oi", "olá!", "Boa noite", "cardápio", "Qual o cardápio?"])
+def test_greetingsAndMenuRequestsAreWelcome(classifier, message):
+    assert classifier.classify(message).intent == "Welcome"
+
+
+def test_yesNoOnlyWhileAwaitingDrink(classifier):
+    assert classifier.classify("Sim!", awaitingDrink=True).intent == "Order.pizza - drink yes"
+    assert classifier.classify("Não, obrigado", awaitingDrink=True).intent == "Order.pizza - drink no"
+    assert classifier.classify("sim") is None
+
+
+def test_cartIsOnlyCheckedForDrinkAnswers(classifier):
+    checks = []
+
+    def awaitingDrink() -> bool:
+        checks.append(True)
+        return True
+
+    assert classifier.classify("oi", awaitingDrink=awaitingDrink).intent == "Welcome"
+    assert classifier.classify("uma calabresa", awaitingDrink=awaitingDrink).intent == "Order.pizza"
+    assert checks == []
+    assert classifier.classify("sim", awaitingDrink=awaitingDrink).intent == "Order.pizza - drink yes"
+    assert checks == [True]
+
+
+def test_flavorsUseDialogflowEntityValues(classifier):
+    match = classifier.classify("Vou querer meia calabresa e meia Pepperoni")
+    assert match.intent == "Order.pizza"
+    assert match.parameters == {"flavor": ["calabresa", "pepperoni"]}
+    assert classifier.classify("duas Calabresas").parameters == {"flavor": ["calabresa"]}
+
+
+def test_drinksAndTheirAliases(classifier):
+    match = classifier.classify("Uma coca e dois sucos de laranja", awaitingDrink=True)
+    assert match.intent == "Order.drink"
+    assert match.parameters == {"Drinks": ["coca-cola", "suco de laranja"]}
+    assert classifier.classify("Um guaraná", awaitingDrink=True).parameters == {"Drinks": ["guaraná"]}
+
+
+def test_lowConfidenceFallsThrough(classifier):
+    assert classifier.classify("uma coca") is None
+    assert classifier.classify("uma calabresa e uma coca", awaitingDrink=True) is None
+    assert classifier.classify("vocês entregam no centro?") is None
+    assert classifier.classify("") is None
+
+
+def test_reportEstimatesLatencySaved(classifier):
+    for message in ["oi", "cardápio", "quanto tempo demora?", "tem pizza doce?"]:
+        match = classifier.classify(message)
+        if match is not None:
+            classifier.recordLocalAnswer(match.intent, 0.001)
+        else:
+            classifier.recordDialogflowLatency(0.301)
+    report = classifier.report()
+    assert (report["lookups"], report["hits"], report["fallthroughs"]) == (4, 2, 2)
+    assert report["hitRatio"] == 0.5
+    assert report["hitsByIntent"] == {"Welcome": 2}
+    assert report["estimatedSecondsSaved"] == pytest.approx(0.6)
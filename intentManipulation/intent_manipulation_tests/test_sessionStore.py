@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+from intentManipulation.intentTypes.replies import Replies
+from intentManipulation.intent_table import INTENT_TABLE, compileIntentTable
+from intentManipulation.session_state import InProcessStateStore, SqliteStateStore, decodeState, encodeState
+from intentManipulation.session_store import ConversationState, SessionStore, SessionSweeper
+from utils.metrics import MetricsRegistry
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_sessionsAreKeyedByNormalizedPhone():
+    store = SessionStore(maxSessions=10)
+    store.get("whatsapp:+55 85 99917-1902").userHistory.append("Oi")
+    assert list(store.get("+5585999171902").userHistory) == ["Oi"]
+    assert len(store) == 1
+
+
+def test_leastRecentlyUsedSessionsAreEvicted():
+    store = SessionStore(maxSessions=2)
+    store.get("+1")
+    store.get("+2")
+    store.get("+1")
+    with store.session("+3"):
+        store.get("+4")
+    assert "+1" not in store and "+2" not in store
+    assert "+3" in store and "+4" in store
+    assert store.evictions == 2
+
+
+def test_memoryReport():
+    store = SessionStore(lambda phoneNumber: ConversationState(phoneNumber, INTENT_TABLE.lookup("SIGNUP_NAME").index))
+    for index in range(100):
+        store.get(f"+{index}").userHistory.extend(["Oi", "Meu nome é Ana"])
+    report = store.memoryReport()
+    assert report["sessions"] == 100
+    assert 0 < report["bytesPerSession"] < 5000
+    assert report["totalBytes"] == report["bytesPerSession"] * 100
+
+
+def test_snapshotRoundTrip():
+    state = ConversationState("+5585999171902", INTENT_TABLE.lookup("SIGNUP_CPF").index)
+    state.welcomedMask = INTENT_TABLE.maskOf(["SIGNUP_NAME", "SIGNUP_EMAIL"])
+    state.extractedParameters.update(name="Ana", phoneNumber="+5585999171902")
+    state.intentHistory.append(("SIGNUP_NAME", "Qual o seu nome?"))
+    state.userHistory.append("Oi")
+    state.count, state.existingUser, state.lastSeen = 2, False, 1700000000.5
+    restored = decodeState(encodeState(state), ConversationState)
+    assert all(getattr(restored, slot) == getattr(state, slot) for slot in ConversationState.__slots__)
+
+
+def test_snapshotsUseTheStateIntentTable():
+    table = compileIntentTable([Replies.SIGNUP_NAME, Replies.SIGNUP_CPF])
+    store = SessionStore(lambda phoneNumber: ConversationState(phoneNumber, intentTable=table),
+                         stateStore=InProcessStateStore(), snapshotOptions={"intentTable": table})
+    with store.session("+1") as state:
+        state.intentCursor = table.lookup("SIGNUP_CPF").index
+        state.welcomedMask = table.maskOf(["SIGNUP_NAME", "SIGNUP_CPF"])
+        assert state.toSnapshot()[1:3] == ["SIGNUP_CPF", ["SIGNUP_NAME", "SIGNUP_CPF"]]
+    restored = store.get("+1")
+    assert restored.intentTable is table
+    assert restored.currentIntentName == "SIGNUP_CPF"
+    assert (restored.intentCursor, restored.welcomedMask) == (1, 0b11)
+
+
+def test_snapshotWithUnknownVersionIsRejected():
+    with pytest.raises(ValueError):
+        decodeState(b'[99,"+1"]', ConversationState)
+
+
+@pytest.mark.parametrize("createStore", [InProcessStateStore, lambda: SqliteStateStore(":memory:")])
+def test_stateIsSavedToTheStateStore(createStore):
+    stateStore = createStore()
+    store = SessionStore(stateStore=stateStore)
+    with store.session("whatsapp:+55 85 99917-1902") as state:
+        state.userHistory.append("Oi")
+    assert "+5585999171902" in store
+    assert list(store.get("+5585999171902").userHistory) == ["Oi"]
+    store.discard("+5585999171902")
+    assert len(store) == 0
+
+
+def test_workersSharingASqliteFileSeeEachOthersChanges(tmp_path):
+    filePath = str(tmp_path / "state.sqlite3")
+    first, second = (SessionStore(stateStore=SqliteStateStore(filePath)) for _ in range(2))
+    with first.session("+1") as state:
+        state.userHistory.append("Oi")
+    with second.session("+1") as state:
+        state.userHistory.append("Ana")
+    assert list(first.get("+1").userHistory) == ["Oi", "Ana"]
+    assert first.memoryReport()["sessions"] == 1
+
+
+def test_idleSnapshotsExpire():
+    clock = _FakeClock()
+    store = SessionStore(stateStore=InProcessStateStore(), idleTtl=60, clock=clock)
+    with store.session("+1") as state:
+        state.userHistory.append("Oi")
+    clock.now = 120
+    assert list(store.get("+1").userHistory) == []
+    assert store.expirations == 1
+
+
+def test_sqliteLeaseKeepsOneHolderPerKey(tmp_path):
+    filePath = str(tmp_path / "state.sqlite3")
+    stateStores = [SqliteStateStore(filePath, pollInterval=0.001) for _ in range(2)]
+    holders = []
+    overlaps = []
+
+    def hold(stateStore: SqliteStateStore):
+        for _ in range(20):
+            with stateStore.lock("+1"):
+                holders.append(stateStore)
+                overlaps.append(len(holders) > 1)
+                time.sleep(0.001)
+                holders.remove(stateStore)
+
+    threads = [threading.Thread(target=hold, args=(stateStore,)) for stateStore in stateStores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(overlaps) == 40 and not any(overlaps)
+
+
+def test_historiesKeepOnlyTheLatestEntries():
+    state = ConversationState("+1", historyLength=3)
+    state.userHistory.extend(["a", "b", "c", "d"])
+    assert list(state.userHistory) == ["b", "c", "d"]
+    restored = decodeState(encodeState(state), ConversationState)
+    assert list(restored.userHistory) == ["b", "c", "d"]
+
+
+@pytest.mark.parametrize("createStateStore", [lambda: None, InProcessStateStore, lambda: SqliteStateStore(":memory:")])
+def test_sweepExpiresIdleSessionsButNotBusyOnes(createStateStore):
+    clock = _FakeClock()
+    store = SessionStore(idleTtl=150, clock=clock, stateStore=createStateStore())
+    for phoneNumber in ("+1", "+2", "+3"):
+        with store.session(phoneNumber):
+            pass
+    clock.now = 100
+    with store.session("+3"):
+        pass
+    clock.now = 200
+    with store.session("+1"):
+        assert store.sweepExpired() == 1
+    assert "+1" in store and "+2" not in store and "+3" in store
+    assert store.expirations == 2  # "+1" expired when it was touched again, "+2" by the sweep
+
+
+def test_sweeperPublishesSessionGauges():
+    clock = _FakeClock()
+    store = SessionStore(idleTtl=60, clock=clock)
+    for phoneNumber in ("+1", "+2"):
+        store.get(phoneNumber)
+    clock.now = 100
+    store.get("+2")
+    registry = MetricsRegistry()
+    SessionSweeper({"signup": store}, metrics=registry).sweep()
+    snapshot = registry.snapshot()
+    assert snapshot["counters"]["sessions.signup.expired"] == 1
+    assert snapshot["gauges"]["sessions.signup.live"] == 1
+    assert snapshot["gauges"]["sessions.signup.bytes"] > 0
+    assert snapshot["gauges"]["process.resident_memory_bytes"] > 0
+
+
+def test_sweeperThreadRunsUntilStopped():
+    store = SessionStore(idleTtl=0, clock=time.monotonic)
+    store.get("+1")
+    sweeper = SessionSweeper({"signup": store}, interval=0.01, metrics=MetricsRegistry()).start()
+    deadline = time.monotonic() + 2
+    while len(store) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sweeper.stop(timeout=1)
+    assert len(store) == 0 and sweeper.thread is None
@@ -0,0 +1,77 @@
+from types import MappingProxyType
+from typing import NamedTuple
+
+from intentManipulation.intentTypes.base_intent import BaseIntent
+from intentManipulation.intentTypes.intent_entry_text import EntryTextIntent
+from intentManipulation.intentTypes.intent_fallback import InstantFallbackIntent
+from intentManipulation.intentTypes.intent_multiple_choice import MultipleChoiceIntent
+from intentManipulation.intentTypes.replies import Replies, Types
+
+INTENT_CLASSES = {Types.ENTRY_TEXT: EntryTextIntent, Types.MULTIPLE_CHOICE: MultipleChoiceIntent,
+                  Types.INSTANT_FALLBACK: InstantFallbackIntent}
+
+
+class IntentNotFoundException(Exception):
+    def __init__(self, intent_name):
+        self.intent_name = intent_name
+        super().__init__(f"Intent '{intent_name}' not found.")
+
+
+class CompiledIntent(NamedTuple):
+    index: int
+    name: str
+    intentType: str
+    bit: int
+    firstReply: MappingProxyType
+    handler: BaseIntent  # Shared by every customer, so it's only asked to parse replies once they were welcomed
+
+
+class IntentTable:
+    """The Replies compiled once into a read-only table. A conversation only needs a cursor (the index of its
+    current intent) and a bitmask of the intents it was welcomed to; name lookups are a single dict hit."""
+
+    def __init__(self, replies: list, startIntent: str):
+        entries = []
+        for index, reply in enumerate(replies):
+            handler = INTENT_CLASSES[reply["intentType"]](reply)
+            firstReply = MappingProxyType(handler._formatOutputMessage(handler._produceFirstSentence()))
+            entries.append(CompiledIntent(index, reply["intentName"], reply["intentType"], 1 << index, firstReply,
+                                          handler))
+        self.entries = tuple(entries)
+        self.byName = MappingProxyType({entry.name.lower(): entry for entry in self.entries})
+        self.start = self.lookup(startIntent)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index: int) -> CompiledIntent:
+        return self.entries[index]
+
+    def lookup(self, intentName: str) -> CompiledIntent:
+        entry = self.byName.get(intentName.lower()) if isinstance(intentName, str) else None
+        if entry is None:
+            raise IntentNotFoundException(intentName)
+        return entry
+
+    def namesInMask(self, mask: int) -> list:
+        return [entry.name for entry in self.entries if mask & entry.bit]
+
+    def maskOf(self, intentNames) -> int:
+        """Unknown names are ignored, so snapshots taken before an intent was removed still load."""
+        mask = 0
+        for name in intentNames:
+            entry = self.byName.get(name.lower())
+            if entry is not None:
+                mask |= entry.bit
+        return mask
+
+
+def compileIntentTable(replies: list = None, startIntent: str = "SIGNUP_NAME") -> IntentTable:
+    """By default every reply defined on Replies, in declaration order."""
+    if replies is None:
+        replies = [value for name, value in vars(Replies).items() if not name.startswith("_") and
+                   isinstance(value, dict) and "intentName" in value]
+    return IntentTable(replies, startIntent)
+
+
+INTENT_TABLE = compileIntentTable()
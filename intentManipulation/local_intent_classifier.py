@@ -0,0 +1,155 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import NamedTuple
+
+GREETINGS = frozenset({"oi", "oii", "oiii", "ola", "oie", "opa", "eai", "e ai", "bom dia", "boa tarde", "boa noite",
+                       "oi boa noite", "oi boa tarde", "ola boa noite", "ola boa tarde", "hello", "hi"})
+MENU_REQUESTS = frozenset({"menu", "cardapio", "o cardapio", "ver cardapio", "ver o cardapio", "qual o cardapio",
+                           "quais os sabores", "quais sabores", "sabores", "quero ver o cardapio",
+                           "me manda o cardapio", "manda o cardapio"})
+YES_ANSWERS = frozenset({"sim", "s", "quero", "quero sim", "sim quero", "claro", "pode ser", "isso", "ok", "aham",
+                         "uhum", "yes", "vou", "vou sim", "vou querer", "sim por favor"})
+NO_ANSWERS = frozenset({"nao", "n", "nao quero", "nao obrigado", "nao obrigada", "nao valeu", "nada", "so isso",
+                        "sem bebida", "dispenso", "no"})
+# Intents whose reply neither sets nor consumes Dialogflow contexts. Answering any other intent locally would
+# leave the session's contexts behind what Dialogflow expects, and the next message it sees would be misrouted
+CONTEXT_FREE_INTENTS = frozenset({"Welcome"})
+# Matched from the speisekarte vocabulary and the yes/no answers, which are only built when one of them is answered
+ORDER_INTENTS = frozenset({"Order.pizza", "Order.drink", "Order.pizza - drink yes", "Order.pizza - drink no"})
+
+
+def localIntentClassifierEnabled() -> bool:
+    return os.getenv("LOCAL_INTENT_CLASSIFIER_ENABLED", "false").lower() == "true"
+
+
+def normalizeText(text: str) -> str:
+    """Lowercase, without accents, punctuation or repeated spaces: "Olá!!" and "ola" normalize the same."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    unaccented = "".join(character for character in decomposed if not unicodedata.combining(character))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", unaccented).split())
+
+
+class LocalMatch(NamedTuple):
+    intent: str
+    parameters: dict
+    confidence: float
+
+
+class LocalIntentClassifier:
+    """Resolves the high-frequency intents without a Dialogflow round trip: greetings and menu requests (both
+    answered by "Welcome"), the yes/no reply to "Você vai querer alguma bebida?", and orders naming flavors or
+    drinks from the speisekarte. Anything it is not at least `minConfidence` sure about, or whose intent is not in
+    `intents`, returns None and is left to Dialogflow. The default only lets context-free intents through, so the
+    fast path in front of Dialogflow answers greetings and menu requests alone; the order intents are for the
+    fallback (`intents=None`), which answers every intent while Dialogflow is unreachable.
+
+    The matched intent names and parameters are the ones Dialogflow would send to /webhookForIntent, so the
+    answer comes from the same handlers. report() gives the local hit ratio and the latency saved, estimated from
+    the Dialogflow round trips recorded with recordDialogflowLatency."""
+
+    def __init__(self, speisekarte: dict, minConfidence: float = 0.8, intents=CONTEXT_FREE_INTENTS):
+        self.minConfidence = minConfidence
+        self.intents = frozenset(intents) if intents is not None else None
+        self.exactIntents = {text: "Welcome" for text in GREETINGS | MENU_REQUESTS}
+        self.answersOrders = self.intents is None or not self.intents.isdisjoint(ORDER_INTENTS)
+        if self.answersOrders:
+            # No first-word aliases for flavors: "quatro" is also a quantity
+            self.flavors = self.__vocabulary([item["nome"] for item in speisekarte["Pizzas"]], firstWordAliases=False)
+            self.drinks = self.__vocabulary([item["nome"] for item in speisekarte["Bebidas"]], firstWordAliases=True)
+            self.flavorPattern = self.__compile(self.flavors)
+            self.drinkPattern = self.__compile(self.drinks)
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hitsByIntent = defaultdict(int)
+        self.localSeconds = 0.0
+        self.dialogflowCalls = 0
+        self.dialogflowSeconds = 0.0
+
+    @staticmethod
+    def __vocabulary(names: list, firstWordAliases: bool) -> dict:
+        """Every way a customer may write an item, mapped to the entity value Dialogflow sends for it: the full
+        name, its plural ("calabresas", "sucos de laranja") and, with `firstWordAliases`, its first word when no
+        other item shares it ("coca", "suco")."""
+        names = [name.lower() for name in names]
+        firstWords = defaultdict(list)
+        for name in names:
+            firstWords[normalizeText(name).split()[0]].append(name)
+        vocabulary = {}
+        for name in names:
+            words = normalizeText(name).split()
+            vocabulary[" ".join(words)] = name
+            vocabulary[" ".join([words[0] + "s"] + words[1:])] = name
+            if firstWordAliases and len(words) > 1 and len(firstWords[words[0]]) == 1:
+                vocabulary[words[0]] = name
+                vocabulary[words[0] + "s"] = name
+        return vocabulary
+
+    @staticmethod
+    def __compile(vocabulary: dict) -> re.Pattern:
+        # Longest first, so "suco de laranja" wins over "suco"
+        alternatives = sorted(vocabulary, key=len, reverse=True)
+        return re.compile(r"\b(" + "|".join(re.escape(form) for form in alternatives) + r")\b")
+
+    def __findItems(self, pattern: re.Pattern, vocabulary: dict, text: str) -> list:
+        return list(dict.fromkeys(vocabulary[match] for match in pattern.findall(text)))
+
+    def classify(self, message: str, awaitingDrink=False) -> LocalMatch or None:
+        """`awaitingDrink` tells whether the bot's last question was "Você vai querer alguma bebida?", which is
+        the only time a yes/no or a bare drink order is answered locally. It may be a function, called only for
+        those messages, so callers don't load the customer's cart for anything else."""
+        match = self.__classify(normalizeText(message), awaitingDrink)
+        with self.lock:
+            self.lookups += 1
+        if match is None or match.confidence < self.minConfidence:
+            return None
+        return match if self.intents is None or match.intent in self.intents else None
+
+    def __classify(self, text: str, awaitingDrink) -> LocalMatch or None:
+        if not text:
+            return None
+        if text in self.exactIntents:
+            return LocalMatch(self.exactIntents[text], {}, 1.0)
+        if not self.answersOrders:
+            return None
+        if text in YES_ANSWERS or text in NO_ANSWERS:
+            intent = "Order.pizza - drink yes" if text in YES_ANSWERS else "Order.pizza - drink no"
+            return LocalMatch(intent, {}, 1.0 if self.__isTrue(awaitingDrink) else 0.0)
+        flavors = self.__findItems(self.flavorPattern, self.flavors, text)
+        drinks = self.__findItems(self.drinkPattern, self.drinks, text)
+        if flavors and drinks:
+            # Pizza and drink in one message is a path the webhook only takes through Dialogflow's contexts
+            return LocalMatch("Order.pizza", {"flavor": flavors}, 0.3)
+        if flavors:
+            return LocalMatch("Order.pizza", {"flavor": flavors}, 0.9)
+        if drinks:
+            return LocalMatch("Order.drink", {"Drinks": drinks}, 0.9 if self.__isTrue(awaitingDrink) else 0.5)
+        return None
+
+    @staticmethod
+    def __isTrue(flag) -> bool:
+        return bool(flag() if callable(flag) else flag)
+
+    def recordLocalAnswer(self, intent: str, seconds: float):
+        """Time spent classifying and running the handler for a message answered locally."""
+        with self.lock:
+            self.hitsByIntent[intent] += 1
+            self.localSeconds += seconds
+
+    def recordDialogflowLatency(self, seconds: float):
+        with self.lock:
+            self.dialogflowCalls += 1
+            self.dialogflowSeconds += seconds
+
+    def report(self) -> dict:
+        with self.lock:
+            hits = sum(self.hitsByIntent.values())
+            meanLocal = self.localSeconds / hits if hits else None
+            meanDialogflow = self.dialogflowSeconds / self.dialogflowCalls if self.dialogflowCalls else None
+            secondsSaved = hits * (meanDialogflow - meanLocal) if hits and meanDialogflow is not None else None
+            return {"lookups": self.lookups, "hits": hits, "fallthroughs": self.lookups - hits,
+                    "hitRatio": hits / self.lookups if self.lookups else None, "hitsByIntent": dict(self.hitsByIntent),
+                    "meanLocalSeconds": meanLocal, "meanDialogflowSeconds": meanDialogflow,
+                    "estimatedSecondsSaved": secondsSaved}
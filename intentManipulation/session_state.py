@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+SNAPSHOT_VERSION = 1
+
+
+def encodeState(state) -> bytes:
+    """Compact snapshot of a state exposing toSnapshot(): a JSON array led by the format version, with the state's
+    fields in slot order instead of named keys."""
+    return json.dumps([SNAPSHOT_VERSION, *state.toSnapshot()], separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def decodeState(blob: bytes, stateClass, **options):
+    """`options` go to stateClass.fromSnapshot, e.g. the intentTable a ConversationState is restored against."""
+    version, *fields = json.loads(blob)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported session snapshot version: {version}")
+    return stateClass.fromSnapshot(fields, **options)
+
+
+class StateStore:
+    """Where SessionStore keeps serialized states when they must outlive (or be shared by) one process. lock(key)
+    gives one holder at a time exclusive use of a key, so a customer's messages are handled one after the other
+    whichever worker receives them."""
+
+    def load(self, key: str) -> bytes or None:
+        raise NotImplementedError
+
+    def save(self, key: str, blob: bytes, lastSeen: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def deleteIdle(self, cutoff: float) -> int:
+        """Deletes the snapshots last seen before `cutoff` whose key isn't locked; returns how many."""
+        raise NotImplementedError
+
+    def lock(self, key: str):
+        raise NotImplementedError
+
+    def blobSizes(self) -> list:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InProcessStateStore(StateStore):
+    """Snapshots in a dict. Only shared between the threads of one process; useful for tests and to measure the
+    serialization cost on its own."""
+
+    def __init__(self, lockStripes: int = 64):
+        self.blobs = {}
+        self.lastSeen = {}
+        self.mutex = threading.Lock()
+        self.stripes = [threading.Lock() for _ in range(lockStripes)]
+
+    def load(self, key: str) -> bytes or None:
+        with self.mutex:
+            return self.blobs.get(key)
+
+    def save(self, key: str, blob: bytes, lastSeen: float):
+        with self.mutex:
+            self.blobs[key] = blob
+            self.lastSeen[key] = lastSeen
+
+    def delete(self, key: str):
+        with self.mutex:
+            self.blobs.pop(key, None)
+            self.lastSeen.pop(key, None)
+
+    def deleteIdle(self, cutoff: float) -> int:
+        with self.mutex:
+            idleKeys = [key for key, lastSeen in self.lastSeen.items() if lastSeen < cutoff]
+        deleted = 0
+        for key in idleKeys:
+            stripe = self.__stripe(key)
+            if not stripe.acquire(blocking=False):
+                continue
+            try:
+                with self.mutex:
+                    if self.lastSeen.get(key, cutoff) < cutoff:
+                        del self.blobs[key]
+                        del self.lastSeen[key]
+                        deleted += 1
+            finally:
+                stripe.release()
+        return deleted
+
+    def __stripe(self, key: str) -> threading.Lock:
+        return self.stripes[zlib.crc32(key.encode()) % len(self.stripes)]
+
+    @contextmanager
+    def lock(self, key: str):
+        with self.__stripe(key):
+            yield
+
+    def blobSizes(self) -> list:
+        with self.mutex:
+            return [len(blob) for blob in self.blobs.values()]
+
+
+class SqliteStateStore(StateStore):
+    """Snapshots in a SQLite file that every worker process opens. Keys are locked with a lease row; a lease
+    older than `leaseSeconds` is considered abandoned by a crashed worker and can be taken over."""
+
+    def __init__(self, filePath: str = ":memory:", namespace: str = "sessions", leaseSeconds: float = 30.0,
+                 pollInterval: float = 0.005):
+        self.filePath = filePath
+        self.namespace = namespace
+        self.leaseSeconds = leaseSeconds
+        self.pollInterval = pollInterval
+        self.mutex = threading.Lock()
+        self.sqlite = sqlite3.connect(filePath, check_same_thread=False, isolation_level=None, timeout=30)
+        self.sqlite.execute("PRAGMA journal_mode=WAL")
+        self.sqlite.execute("PRAGMA synchronous=NORMAL")
+        self.sqlite.execute("CREATE TABLE IF NOT EXISTS session_state (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                            "data BLOB NOT NULL, lastSeen REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        self.sqlite.execute("CREATE INDEX IF NOT EXISTS session_state_idle ON session_state (namespace, lastSeen)")
+        self.sqlite.execute("CREATE TABLE IF NOT EXISTS session_leases (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                            "owner TEXT NOT NULL, expiresAt REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+
+    def load(self, key: str) -> bytes or None:
+        with self.mutex:
+            row = self.sqlite.execute("SELECT data FROM session_state WHERE namespace = ? AND key = ?",
+                                      (self.namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def save(self, key: str, blob: bytes, lastSeen: float):
+        with self.mutex:
+            self.sqlite.execute("INSERT OR REPLACE INTO session_state (namespace, key, data, lastSeen) "
+                                "VALUES (?, ?, ?, ?)", (self.namespace, key, blob, lastSeen))
+
+    def delete(self, key: str):
+        with self.mutex:
+            self.sqlite.execute("DELETE FROM session_state WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def deleteIdle(self, cutoff: float) -> int:
+        with self.mutex:
+            cursor = self.sqlite.execute(
+                "DELETE FROM session_state WHERE namespace = ? AND lastSeen < ? AND key NOT IN "
+                "(SELECT key FROM session_leases WHERE namespace = ? AND expiresAt >= ?)",
+                (self.namespace, cutoff, self.namespace, time.time()))
+            return cursor.rowcount
+
+    def __tryAcquire(self, key: str, owner: str) -> bool:
+        now = time.time()
+        with self.mutex:
+            cursor = self.sqlite.execute(
+                "INSERT INTO session_leases (namespace, key, owner, expiresAt) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET owner = excluded.owner, expiresAt = excluded.expiresAt "
+                "WHERE session_leases.expiresAt < ?", (self.namespace, key, owner, now + self.leaseSeconds, now))
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def lock(self, key: str):
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        while not self.__tryAcquire(key, owner):
+            time.sleep(self.pollInterval)
+        try:
+            yield
+        finally:
+            with self.mutex:
+                self.sqlite.execute("DELETE FROM session_leases WHERE namespace = ? AND key = ? AND owner = ?",
+                                    (self.namespace, key, owner))
+
+    def blobSizes(self) -> list:
+        with self.mutex:
+            rows = self.sqlite.execute("SELECT length(data) FROM session_state WHERE namespace = ?",
+                                       (self.namespace,)).fetchall()
+        return [size for size, in rows]
+
+    def close(self):
+        with self.mutex:
+            self.sqlite.close()
+
+
+def createStateStore(namespace: str) -> StateStore or None:
+    """SESSION_STATE_STORE picks where conversation states live: unset or "local" keeps them as objects in this
+    process (one worker only), "memory" serializes them into an in-process store and "sqlite" into the file at
+    SESSION_STATE_PATH, which any number of worker processes on the host can share."""
+    load_dotenv()
+    storeName = os.getenv("SESSION_STATE_STORE", "local").lower()
+    if storeName == "local":
+        return None
+    if storeName == "memory":
+        return InProcessStateStore()
+    if storeName == "sqlite":
+        return SqliteStateStore(os.getenv("SESSION_STATE_PATH", "session_state.sqlite3"), namespace=namespace)
+    raise ValueError(f"Unknown SESSION_STATE_STORE: {storeName}")
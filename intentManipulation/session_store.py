@@ -0,0 +1,271 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from firebaseFolder.firebase_phone_index import normalizePhoneNumber
+from intentManipulation.intent_table import INTENT_TABLE, IntentTable
+from intentManipulation.session_state import StateStore, encodeState, decodeState
+from utils.metrics import MetricsRegistry, metrics as defaultMetrics, residentMemoryBytes
+
+
+class ConversationState:
+    """Everything the signup flow remembers about one customer between two messages. The current intent is an
+    index into `intentTable` (the one the IntentManager runs, INTENT_TABLE by default) and the intents already
+    welcomed are a bitmask of it. The histories are ring buffers keeping the last `historyLength` entries
+    (INTENT_HISTORY_LENGTH, 20 by default)."""
+    __slots__ = ("intentTable", "phoneNumber", "intentCursor", "welcomedMask", "extractedParameters",
+                 "intentHistory", "userHistory", "botHistory", "signupDetails", "count", "finished", "existingUser",
+                 "lastSeen")
+
+    def __init__(self, phoneNumber: str, intentCursor: int = None, historyLength: int = None,
+                 intentTable: IntentTable = INTENT_TABLE):
+        if historyLength is None:
+            historyLength = int(os.getenv("INTENT_HISTORY_LENGTH", "20"))
+        self.intentTable = intentTable
+        self.phoneNumber = phoneNumber
+        self.intentCursor = intentCursor if intentCursor is not None else intentTable.start.index
+        self.welcomedMask = 0
+        self.extractedParameters = {}
+        self.intentHistory = deque(maxlen=historyLength)  # Will store tuples (intent, messageContent)
+        self.userHistory = deque(maxlen=historyLength)
+        self.botHistory = deque(maxlen=historyLength)
+        self.signupDetails = {}
+        self.count = 0
+        self.finished = False
+        self.existingUser = None
+        self.lastSeen = 0.0
+
+    @property
+    def currentIntentName(self) -> str:
+        return self.intentTable[self.intentCursor].name
+
+    def toSnapshot(self) -> list:
+        """Intents are saved by name, so snapshots survive intents being added to the table."""
+        return [self.phoneNumber, self.currentIntentName, self.intentTable.namesInMask(self.welcomedMask),
+                self.extractedParameters, list(self.intentHistory), list(self.userHistory), list(self.botHistory),
+                self.signupDetails, self.count, self.finished, self.existingUser, self.lastSeen]
+
+    @classmethod
+    def fromSnapshot(cls, fields: list, intentTable: IntentTable = INTENT_TABLE):
+        state = cls(fields[0], intentTable.lookup(fields[1]).index, intentTable=intentTable)
+        (_, _, welcomedIntents, state.extractedParameters, intentHistory, userHistory, botHistory,
+         state.signupDetails, state.count, state.finished, state.existingUser, state.lastSeen) = fields
+        state.welcomedMask = intentTable.maskOf(welcomedIntents)
+        state.intentHistory.extend(tuple(item) for item in intentHistory)
+        state.userHistory.extend(userHistory)
+        state.botHistory.extend(botHistory)
+        return state
+
+
+def _deepSizeOf(obj, seen: set = None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deepSizeOf(key, seen) + _deepSizeOf(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deepSizeOf(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_deepSizeOf(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+
+class _SessionEntry:
+    __slots__ = ("state", "lock")
+
+    def __init__(self, state):
+        self.state = state
+        self.lock = threading.Lock()
+
+
+class SessionStore:
+    """Conversation states keyed by normalized phone number (or `keyFunction`), least recently used first. When
+    more than `maxSessions` are held the idlest unlocked ones are evicted, and with `idleTtl` a state untouched for
+    that many seconds is replaced by a fresh one, so a customer who comes back starts over.
+
+    Use `with store.session(phoneNumber) as state:` to work on a state: messages from the same customer are
+    serialized, different customers proceed in parallel.
+
+    With a `stateStore` nothing is kept in this process: session() loads the customer's snapshot (a `stateClass`
+    instance, built with `stateClass.fromSnapshot(fields, **snapshotOptions)`) under the store's lock and saves it
+    back on exit, so several worker processes can share customers. maxSessions doesn't apply then, and get()
+    returns a copy whose changes aren't saved."""
+
+    def __init__(self, stateFactory=ConversationState, maxSessions: int = 10000, idleTtl: float = None,
+                 keyFunction=normalizePhoneNumber, clock=time.time, stateStore: StateStore = None,
+                 stateClass: type = None, snapshotOptions: dict = None):
+        self.stateFactory = stateFactory
+        self.stateStore = stateStore
+        self.stateClass = stateClass or (stateFactory if isinstance(stateFactory, type) else ConversationState)
+        self.snapshotOptions = snapshotOptions or {}
+        self.maxSessions = maxSessions
+        self.idleTtl = idleTtl
+        self.keyFunction = keyFunction
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        if self.stateStore is not None:
+            return len(self.stateStore.blobSizes())
+        return len(self.entries)
+
+    def __contains__(self, phoneNumber: str) -> bool:
+        if self.stateStore is not None:
+            return self.stateStore.load(self.keyFunction(phoneNumber)) is not None
+        return self.keyFunction(phoneNumber) in self.entries
+
+    def __isExpired(self, entry: _SessionEntry, now: float) -> bool:
+        return self.idleTtl is not None and now - entry.state.lastSeen > self.idleTtl and not entry.lock.locked()
+
+    def __getEntry(self, phoneNumber: str) -> _SessionEntry:
+        key = self.keyFunction(phoneNumber)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.__isExpired(entry, self.clock()):
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                entry = self.entries[key] = _SessionEntry(self.stateFactory(phoneNumber))
+                self.__evictOverflow()
+            else:
+                self.entries.move_to_end(key)
+            entry.state.lastSeen = self.clock()
+            return entry
+
+    def __evictOverflow(self):
+        overflow = len(self.entries) - self.maxSessions
+        for key in list(self.entries):
+            if overflow <= 0:
+                break
+            if not self.entries[key].lock.locked():
+                del self.entries[key]
+                self.evictions += 1
+                overflow -= 1
+
+    def __loadState(self, phoneNumber: str, key: str):
+        blob = self.stateStore.load(key)
+        state = decodeState(blob, self.stateClass, **self.snapshotOptions) if blob is not None else None
+        now = self.clock()
+        if state is not None and self.idleTtl is not None and now - state.lastSeen > self.idleTtl:
+            self.expirations += 1
+            state = None
+        if state is None:
+            state = self.stateFactory(phoneNumber)
+        state.lastSeen = now
+        return state
+
+    def get(self, phoneNumber: str):
+        if self.stateStore is not None:
+            return self.__loadState(phoneNumber, self.keyFunction(phoneNumber))
+        return self.__getEntry(phoneNumber).state
+
+    @contextmanager
+    def session(self, phoneNumber: str):
+        if self.stateStore is not None:
+            key = self.keyFunction(phoneNumber)
+            with self.stateStore.lock(key):
+                state = self.__loadState(phoneNumber, key)
+                try:
+                    yield state
+                finally:
+                    self.stateStore.save(key, encodeState(state), state.lastSeen)
+            return
+        entry = self.__getEntry(phoneNumber)
+        with entry.lock:
+            yield entry.state
+
+    def discard(self, phoneNumber: str):
+        if self.stateStore is not None:
+            key = self.keyFunction(phoneNumber)
+            with self.stateStore.lock(key):
+                self.stateStore.delete(key)
+            return
+        with self.lock:
+            self.entries.pop(self.keyFunction(phoneNumber), None)
+
+    def sweepExpired(self) -> int:
+        """Drops every session idle for longer than idleTtl, except those in use. Returns how many were dropped."""
+        if self.idleTtl is None:
+            return 0
+        cutoff = self.clock() - self.idleTtl
+        if self.stateStore is not None:
+            expired = self.stateStore.deleteIdle(cutoff)
+        else:
+            with self.lock:
+                expiredKeys = []
+                for key, entry in self.entries.items():
+                    if entry.state.lastSeen >= cutoff:
+                        break  # Entries are in access order, the rest were seen more recently
+                    if not entry.lock.locked():
+                        expiredKeys.append(key)
+                for key in expiredKeys:
+                    del self.entries[key]
+            expired = len(expiredKeys)
+        self.expirations += expired
+        return expired
+
+    def memoryReport(self) -> dict:
+        if self.stateStore is not None:
+            sizes = self.stateStore.blobSizes()
+        else:
+            with self.lock:
+                states = [entry.state for entry in self.entries.values()]
+            sizes = [_deepSizeOf(state) for state in states]
+        return {"sessions": len(sizes), "totalBytes": sum(sizes), "maxBytes": max(sizes, default=0),
+                "bytesPerSession": sum(sizes) / len(sizes) if sizes else 0, "evictions": self.evictions,
+                "expirations": self.expirations}
+
+
+class SessionSweeper:
+    """Background thread that, every `interval` seconds, expires the idle sessions of each named SessionStore and
+    publishes the `sessions.<name>.live` and `sessions.<name>.bytes` gauges along with
+    `process.resident_memory_bytes`."""
+
+    def __init__(self, stores: dict, interval: float = 60.0, metrics: MetricsRegistry = None):
+        self.stores = stores
+        self.interval = interval
+        self.metrics = metrics if metrics is not None else defaultMetrics
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def fromEnvironment(cls, stores: dict):
+        return cls(stores, interval=float(os.getenv("SESSION_SWEEP_SECONDS", "60")))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name="session-sweeper", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def sweep(self):
+        for name, store in self.stores.items():
+            self.metrics.increment(f"sessions.{name}.expired", store.sweepExpired())
+            report = store.memoryReport()
+            self.metrics.setGauge(f"sessions.{name}.live", report["sessions"])
+            self.metrics.setGauge(f"sessions.{name}.bytes", report["totalBytes"])
+        resident = residentMemoryBytes()
+        if resident is not None:
+            self.metrics.setGauge("process.resident_memory_bytes", resident)
+
+    def __run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as exception:
+                logging.error(f"Session sweep failed: {exception}")
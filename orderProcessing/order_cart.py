@@ -0,0 +1,56 @@
+import os
+
+
+class OrderCart:
+    """Pizzas and drinks one customer asked for in the current order. Holds at most `maxItems` entries.
+
+    `dialogflowContexts` are the contexts the customer's last detect_intent left alive (None until one was seen).
+    They live here, rather than in the response cache, so every worker sharing the carts knows them."""
+    __slots__ = ("sessionId", "pizzas", "drinks", "maxItems", "lastSeen", "dialogflowContexts")
+
+    def __init__(self, sessionId: str, maxItems: int = None):
+        self.sessionId = sessionId
+        self.pizzas = []
+        self.drinks = []
+        self.maxItems = maxItems if maxItems is not None else int(os.getenv("ORDER_CART_MAX_ITEMS", "20"))
+        self.lastSeen = 0.0
+        self.dialogflowContexts = None
+
+    def __len__(self) -> int:
+        return len(self.pizzas) + len(self.drinks)
+
+    def isFull(self) -> bool:
+        return len(self) >= self.maxItems
+
+    def addPizza(self, pizza) -> bool:
+        if self.isFull():
+            return False
+        self.pizzas.append(pizza)
+        return True
+
+    def addDrink(self, drink: dict) -> bool:
+        if self.isFull():
+            return False
+        self.drinks.append(drink)
+        return True
+
+    def clear(self):
+        self.pizzas = []
+        self.drinks = []
+
+    def toSnapshot(self) -> list:
+        contexts = sorted(self.dialogflowContexts) if self.dialogflowContexts is not None else None
+        return [self.sessionId, self.pizzas, self.drinks, self.maxItems, self.lastSeen, contexts]
+
+    @classmethod
+    def fromSnapshot(cls, fields: list):
+        # Snapshots saved before the contexts were kept have five fields
+        sessionId, pizzas, drinks, maxItems, lastSeen, contexts = (fields + [None])[:6]
+        cart = cls(sessionId, maxItems)
+        cart.pizzas, cart.drinks, cart.lastSeen = pizzas, drinks, lastSeen
+        cart.dialogflowContexts = frozenset(contexts) if contexts is not None else None
+        return cart
+
+    def asParameters(self) -> dict:
+        """The {"pizzas": [...], "drinks": [...]} shape buildFullOrder expects."""
+        return {"pizzas": list(self.pizzas), "drinks": list(self.drinks)}
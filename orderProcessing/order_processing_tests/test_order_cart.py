@@ -0,0 +1,74 @@
+import pytest
+
+from dialogflow_session import extractSessionId, getSessionId, ANONYMOUS_SESSION_ID
+from intentManipulation.session_state import decodeState, encodeState
+from intentManipulation.session_store import SessionStore
+from orderProcessing.order_cart import OrderCart
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cartRefusesItemsPastItsLimit():
+    cart = OrderCart("5585999171902", maxItems=2)
+    assert cart.addPizza([{"calabresa": 1.0}])
+    assert cart.addDrink({"coca-cola": 1})
+    assert cart.isFull()
+    assert not cart.addPizza([{"pepperoni": 1.0}])
+    assert cart.asParameters() == {"pizzas": [[{"calabresa": 1.0}]], "drinks": [{"coca-cola": 1}]}
+
+
+def test_clearEmptiesTheCart():
+    cart = OrderCart("5585999171902", maxItems=2)
+    cart.addPizza([{"calabresa": 1.0}])
+    cart.clear()
+    assert len(cart) == 0
+
+
+def test_snapshotKeepsDialogflowContexts():
+    cart = OrderCart("5585999171902", maxItems=2)
+    cart.addPizza([{"calabresa": 1.0}])
+    cart.dialogflowContexts = frozenset({"order-pizza-followup"})
+    restored = decodeState(encodeState(cart), OrderCart)
+    assert restored.dialogflowContexts == {"order-pizza-followup"}
+    assert restored.asParameters() == cart.asParameters()
+    assert OrderCart.fromSnapshot(["5585999171902", [], [], 2, 0.0]).dialogflowContexts is None
+
+
+def test_cartsAreKeptPerSession():
+    carts = SessionStore(OrderCart, keyFunction=str)
+    carts.get("5585999171902").addPizza([{"calabresa": 1.0}])
+    assert len(carts.get("5585999171902")) == 1
+    assert len(carts.get("5585988887777")) == 0
+
+
+def test_idleCartExpires():
+    clock = _FakeClock()
+    carts = SessionStore(OrderCart, idleTtl=60, keyFunction=str, clock=clock)
+    carts.get("5585999171902").addPizza([{"calabresa": 1.0}])
+    clock.now = 30
+    assert len(carts.get("5585999171902")) == 1
+    clock.now = 120
+    assert len(carts.get("5585999171902")) == 0
+    assert carts.expirations == 1
+
+
+@pytest.mark.parametrize("sessionPath, expected", [
+    ("projects/pizza/agent/sessions/5585999171902", "5585999171902"),
+    ("projects/pizza/agent/environments/draft/users/-/sessions/5585999171902", "5585999171902"),
+    ("projects/pizza/agent/sessions/5585999171902/contexts/order", "5585999171902"),
+    (None, ANONYMOUS_SESSION_ID),
+])
+def test_extractSessionId(sessionPath, expected):
+    assert extractSessionId(sessionPath) == expected
+
+
+def test_sessionIdMatchesTheWebhookSessionOfTheSameCustomer():
+    sessionId = getSessionId("whatsapp:+5585999171902")
+    assert sessionId == "5585999171902"
+    assert extractSessionId(f"projects/pizza/agent/sessions/{sessionId}") == sessionId
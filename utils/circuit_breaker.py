@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import deque
+
+from utils.metrics import MetricsRegistry, metrics as defaultMetrics
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str):
+        self.name = name
+        super().__init__(f"Circuit '{name}' is open")
+
+
+def circuitBreakersEnabled() -> bool:
+    return os.getenv("CIRCUIT_BREAKER_ENABLED", "false").lower() == "true"
+
+
+class CircuitBreaker:
+    """Stops calling a vendor that is failing or slow, so callers can answer locally instead of waiting on it.
+
+    The last `window` calls are kept. Once at least `minimumCalls` of them are in, the circuit opens when the share
+    that raised reaches `failureRate`, or the share that took longer than `slowCallSeconds` reaches `slowCallRate`.
+    While open, call() raises CircuitOpenError without calling anything. After `openSeconds` a single trial call is
+    let through (half open): the circuit closes if it succeeds in time and opens again otherwise.
+
+    A disabled breaker just makes the call. Exported metrics (prefix `circuit.<name>`): `state` gauge (0 closed,
+    1 half open, 2 open), `failures`, `slow_calls`, `rejected` and `opened` counters."""
+
+    def __init__(self, name: str, failureRate: float = 0.5, slowCallSeconds: float = 3.0, slowCallRate: float = 0.5,
+                 window: int = 20, minimumCalls: int = 5, openSeconds: float = 30.0, enabled: bool = True,
+                 clock=time.monotonic, metrics: MetricsRegistry = None):
+        self.name = name
+        self.failureRate = failureRate
+        self.slowCallSeconds = slowCallSeconds
+        self.slowCallRate = slowCallRate
+        self.minimumCalls = minimumCalls
+        self.openSeconds = openSeconds
+        self.enabled = enabled
+        self.clock = clock
+        self.metrics = metrics if metrics is not None else defaultMetrics
+        self.outcomes = deque(maxlen=window)  # (failed, slow) of the latest calls
+        self.state = CLOSED
+        self.openedAt = 0.0
+        self.trialInFlight = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fromEnvironment(cls, name: str):
+        return cls(name, failureRate=float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5")),
+                   slowCallSeconds=float(os.getenv("CIRCUIT_BREAKER_SLOW_SECONDS", "3")),
+                   slowCallRate=float(os.getenv("CIRCUIT_BREAKER_SLOW_RATE", "0.5")),
+                   window=int(os.getenv("CIRCUIT_BREAKER_WINDOW", "20")),
+                   minimumCalls=int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "5")),
+                   openSeconds=float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30")),
+                   enabled=circuitBreakersEnabled())
+
+    def isOpen(self) -> bool:
+        """True while calls are being rejected. A half open circuit waiting for its trial call counts as closed."""
+        with self.lock:
+            return self.__currentState() == OPEN
+
+    def __currentState(self) -> str:
+        if self.state == OPEN and self.clock() - self.openedAt >= self.openSeconds:
+            self.__setState(HALF_OPEN)
+        return self.state
+
+    def __setState(self, state: str):
+        self.state = state
+        self.metrics.setGauge(f"circuit.{self.name}.state", STATE_GAUGE[state])
+
+    def __open(self):
+        self.__setState(OPEN)
+        self.openedAt = self.clock()
+        self.outcomes.clear()
+        self.metrics.increment(f"circuit.{self.name}.opened")
+
+    def call(self, function, *args, **kwargs):
+        if not self.enabled:
+            return function(*args, **kwargs)
+        with self.lock:
+            state = self.__currentState()
+            if state == OPEN or (state == HALF_OPEN and self.trialInFlight):
+                self.metrics.increment(f"circuit.{self.name}.rejected")
+                raise CircuitOpenError(self.name)
+            isTrial = state == HALF_OPEN
+            self.trialInFlight = self.trialInFlight or isTrial
+        start = self.clock()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.__record(isTrial, failed=True, seconds=self.clock() - start)
+            raise
+        self.__record(isTrial, failed=False, seconds=self.clock() - start)
+        return result
+
+    def __record(self, isTrial: bool, failed: bool, seconds: float):
+        slow = seconds > self.slowCallSeconds
+        if failed:
+            self.metrics.increment(f"circuit.{self.name}.failures")
+        if slow:
+            self.metrics.increment(f"circuit.{self.name}.slow_calls")
+        with self.lock:
+            if isTrial:
+                self.trialInFlight = False
+                if failed or slow:
+                    self.__open()
+                else:
+                    self.__setState(CLOSED)
+                return
+            self.outcomes.append((failed, slow))
+            if self.state == CLOSED and len(self.outcomes) >= self.minimumCalls:
+                failures, slowCalls = self.__counts()
+                if (failures / len(self.outcomes) >= self.failureRate
+                        or slowCalls / len(self.outcomes) >= self.slowCallRate):
+                    self.__open()
+
+    def __counts(self) -> tuple:
+        return sum(failed for failed, _ in self.outcomes), sum(slow for _, slow in self.outcomes)
+
+    def report(self) -> dict:
+        with self.lock:
+            calls = len(self.outcomes)
+            failures, slowCalls = self.__counts()
+            return {"enabled": self.enabled, "state": self.__currentState(), "calls": calls,
+                    "failureRate": failures / calls if calls else None,
+                    "slowCallRate": slowCalls / calls if calls else None}
+
+
+_breakers = {}
+_breakersLock = threading.Lock()
+
+
+def getCircuitBreaker(name: str) -> CircuitBreaker:
+    """The process-wide breaker for one vendor, configured from the environment on first use."""
+    with _breakersLock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker.fromEnvironment(name)
+        return _breakers[name]
+
+
+def circuitBreakerReports() -> dict:
+    with _breakersLock:
+        return {name: breaker.report() for name, breaker in _breakers.items()}
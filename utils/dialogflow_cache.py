@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from utils.metrics import MetricsRegistry, metrics as defaultMetrics
+
+STATEFUL_INTENTS = ("Order.pizza", "Order.drink", "Order.pizza - drink yes", "Order.pizza - drink no")
+
+
+def detectIntentCacheEnabled() -> bool:
+    return os.getenv("DIALOGFLOW_CACHE_ENABLED", "false").lower() == "true"
+
+
+def menuVersion(speisekarte: dict) -> str:
+    return hashlib.blake2b(json.dumps(speisekarte, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def activeContextNames(response) -> frozenset:
+    """'projects/p/agent/sessions/5585/contexts/order-pizza-followup' -> 'order-pizza-followup', for the contexts
+    a detect_intent response left alive."""
+    return frozenset(context.name.rsplit("/", 1)[-1] for context in response.query_result.output_contexts
+                     if context.lifespan_count > 0)
+
+
+class DetectIntentCache:
+    """LRU of detect_intent responses keyed by (message key, language code, active context names).
+
+    Dialogflow keeps the contexts, so the caller passes the ones the session was left with to lookup() and keeps
+    the ones store() returns somewhere every worker sees them; a session whose contexts are unknown (None) is
+    never served from the cache. `messageKey` maps a message to the text it is cached under (the message itself by
+    default; pass a normalizer so "Oi!" and "oi" share an entry). Only responses that leave the session as they
+    found it are stored: the intent is not one of `statefulIntents` (their webhook changes the cart) and the
+    active contexts are the same before and after. Every entry is dropped when setVersion() gets a new agent or
+    menu version.
+
+    Exported metrics (prefix `dialogflow.cache`): `hits`, `misses` and `uncacheable` counters, `hit_rate` and
+    `entries` gauges."""
+
+    def __init__(self, maxEntries: int = 1024, statefulIntents=STATEFUL_INTENTS, messageKey=None,
+                 metrics: MetricsRegistry = None):
+        self.maxEntries = maxEntries
+        self.statefulIntents = frozenset(statefulIntents)
+        self.messageKey = messageKey or (lambda message: message)
+        self.metrics = metrics if metrics is not None else defaultMetrics
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def fromEnvironment(cls, messageKey=None):
+        excluded = os.getenv("DIALOGFLOW_CACHE_EXCLUDED_INTENTS")
+        statefulIntents = [name.strip() for name in excluded.split(",")] if excluded else STATEFUL_INTENTS
+        return cls(maxEntries=int(os.getenv("DIALOGFLOW_CACHE_SIZE", "1024")), statefulIntents=statefulIntents,
+                   messageKey=messageKey)
+
+    def setVersion(self, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+        self.metrics.setGauge("dialogflow.cache.entries", len(self.entries))
+
+    def lookup(self, message: str, languageCode: str, contexts: frozenset or None) -> tuple:
+        """(key, cached response or None). The key is None when the session's `contexts` are unknown."""
+        with self.lock:
+            if contexts is None:
+                key = response = None
+            else:
+                key = (self.messageKey(message), languageCode, frozenset(contexts))
+                response = self.entries.get(key)
+                if response is not None:
+                    self.entries.move_to_end(key)
+            if response is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            hitRate = self.hits / (self.hits + self.misses)
+        self.metrics.increment("dialogflow.cache.hits" if response is not None else "dialogflow.cache.misses")
+        self.metrics.setGauge("dialogflow.cache.hit_rate", hitRate)
+        return key, response
+
+    def store(self, key: tuple or None, response) -> frozenset:
+        """Caches `response` when it changed nothing; returns the contexts it left the session with."""
+        contexts = activeContextNames(response)
+        intent = response.query_result.intent
+        intentName = intent.display_name if intent is not None else ""
+        with self.lock:
+            cacheable = key is not None and key[2] == contexts and intentName not in self.statefulIntents
+            if cacheable:
+                self.entries[key] = response
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxEntries:
+                    self.entries.popitem(last=False)
+            entries = len(self.entries)
+        if not cacheable:
+            self.metrics.increment("dialogflow.cache.uncacheable")
+        self.metrics.setGauge("dialogflow.cache.entries", entries)
+        return contexts
+
+    def report(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hitRate": self.hits / lookups if lookups else None,
+                    "version": list(self.version) if isinstance(self.version, tuple) else self.version}
@@ -0,0 +1,98 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+from google.api_core.exceptions import DeadlineExceeded
+
+from utils.metrics import MetricsRegistry, metrics as defaultMetrics
+
+
+class DialogflowTimeoutError(TimeoutError):
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        super().__init__(f"Dialogflow did not answer within {timeout} s")
+
+
+def asyncDialogflowEnabled() -> bool:
+    return os.getenv("DIALOGFLOW_ASYNC_ENABLED", "false").lower() == "true"
+
+
+def _createSessionsAsyncClient():
+    import google.cloud.dialogflow_v2 as dialogflow
+    return dialogflow.SessionsAsyncClient()
+
+
+class DialogflowGateway:
+    """detect_intent calls made on a SessionsAsyncClient owned by a background event loop, so request threads
+    wait on a future instead of holding a gRPC call of their own.
+
+    Every call has a deadline of `timeout` seconds, counting the time spent waiting for one of the
+    `maxInFlight` slots. detectIntent() is the blocking facade; async code can await
+    `asyncio.wrap_future(gateway.submit(request))` from its own loop.
+
+    Exported metrics (prefix `dialogflow`): `in_flight` gauge, `detect_intent_seconds.<intent>` histograms,
+    `timeouts` and `errors` counters."""
+
+    def __init__(self, timeout: float = 5.0, maxInFlight: int = 32, clientFactory=_createSessionsAsyncClient,
+                 metrics: MetricsRegistry = None):
+        self.timeout = timeout
+        self.maxInFlight = maxInFlight
+        self.clientFactory = clientFactory
+        self.metrics = metrics if metrics is not None else defaultMetrics
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="dialogflow-gateway", daemon=True)
+        self.thread.start()
+        # The client and the semaphore must be created on the loop that will use them
+        self.client, self.semaphore = asyncio.run_coroutine_threadsafe(self.__setUp(), self.loop).result()
+        self.inFlight = 0
+
+    @classmethod
+    def fromEnvironment(cls):
+        return cls(timeout=float(os.getenv("DIALOGFLOW_TIMEOUT_SECONDS", "5")),
+                   maxInFlight=int(os.getenv("DIALOGFLOW_MAX_IN_FLIGHT", "32")))
+
+    async def __setUp(self):
+        return self.clientFactory(), asyncio.Semaphore(self.maxInFlight)
+
+    def submit(self, request, timeout: float = None) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(self.detectIntentAsync(request, timeout), self.loop)
+
+    def detectIntent(self, request, timeout: float = None):
+        return self.submit(request, timeout).result()
+
+    async def detectIntentAsync(self, request, timeout: float = None):
+        """Must run on the gateway's loop; use submit() from anywhere else."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.metrics.increment("dialogflow.timeouts")
+            raise DialogflowTimeoutError(timeout) from None
+        self.inFlight += 1
+        self.metrics.setGauge("dialogflow.in_flight", self.inFlight)
+        start = time.monotonic()
+        try:
+            remaining = max(deadline - start, 0.001)
+            response = await asyncio.wait_for(self.client.detect_intent(request=request, timeout=remaining),
+                                              remaining)
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            self.metrics.increment("dialogflow.timeouts")
+            raise DialogflowTimeoutError(timeout) from None
+        except Exception:
+            self.metrics.increment("dialogflow.errors")
+            raise
+        finally:
+            self.inFlight -= 1
+            self.metrics.setGauge("dialogflow.in_flight", self.inFlight)
+            self.semaphore.release()
+        intent = response.query_result.intent
+        intentName = intent.display_name if intent is not None and intent.display_name else "unmatched"
+        self.metrics.observe(f"dialogflow.detect_intent_seconds.{intentName}", time.monotonic() - start)
+        return response
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
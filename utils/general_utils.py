@@ -3,18 +3,17 @@ import json
 import os
 
 from dotenv import load_dotenv
-from flask import request, make_response, jsonify, Response
+from flask import request, Response
 from urllib.parse import parse_qs
 
 from twilio.twiml.messaging_response import MessagingResponse
 
 
 def __prepareOutputResponse(myResult) -> Response:
-    res = json.dumps(myResult, indent=4)
-    print(res)
-    r = make_response(res)
-    r.headers['Content-Type'] = 'application/json'
-    return r
+    """Compact UTF-8 JSON: Dialogflow only waits a few seconds for fulfillment, so nothing is pretty-printed or
+    echoed to stdout on the way out."""
+    res = json.dumps(myResult, ensure_ascii=False, separators=(",", ":"))
+    return Response(res, mimetype="application/json")
 
 
 def sendWebhookCallback(botMessage: str) -> Response:
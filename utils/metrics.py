@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+from collections import deque
+
+
+class _Histogram:
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = None
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.recent.append(value)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+
+        def percentile(fraction: float):
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+        return {"count": self.count, "sum": self.total, "max": self.maximum,
+                "mean": self.total / self.count if self.count else None,
+                "p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)}
+
+
+class MetricsRegistry:
+    """Process-local counters, gauges and histograms. Percentiles are computed over the last `window`
+    observations of each histogram."""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name: str, amount: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def setGauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = _Histogram(self.window)
+            self.histograms[name].observe(value)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def residentMemoryBytes() -> int or None:
+    """Current resident set size of this process where /proc is available, otherwise its peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,94 @@
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.metrics import MetricsRegistry
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> _FakeClock:
+    return _FakeClock()
+
+
+@pytest.fixture
+def registry() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+def __breaker(clock: _FakeClock, registry: MetricsRegistry, **kwargs) -> CircuitBreaker:
+    settings = dict(failureRate=0.5, slowCallSeconds=2.0, slowCallRate=0.5, window=4, minimumCalls=4,
+                    openSeconds=30.0, clock=clock, metrics=registry)
+    settings.update(kwargs)
+    return CircuitBreaker("vendor", **settings)
+
+
+def __fail():
+    raise ConnectionError("vendor down")
+
+
+def __callsThatTake(clock: _FakeClock, seconds: float):
+    def call():
+        clock.now += seconds
+        return "ok"
+    return call
+
+
+def test_opensOnFailureRateAndRejectsWithoutCalling(clock: _FakeClock, registry: MetricsRegistry):
+    breaker = __breaker(clock, registry)
+    for outcome in [lambda: "ok", __fail, lambda: "ok", __fail]:
+        try:
+            breaker.call(outcome)
+        except ConnectionError:
+            pass
+    assert breaker.isOpen()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(pytest.fail)
+    counters = registry.snapshot()["counters"]
+    assert (counters["circuit.vendor.failures"], counters["circuit.vendor.opened"]) == (2, 1)
+    assert counters["circuit.vendor.rejected"] == 1
+    assert registry.snapshot()["gauges"]["circuit.vendor.state"] == 2
+
+
+def test_opensOnSlowCalls(clock: _FakeClock, registry: MetricsRegistry):
+    breaker = __breaker(clock, registry)
+    for seconds in [0.1, 2.5, 0.1, 2.5]:
+        assert breaker.call(__callsThatTake(clock, seconds)) == "ok"
+    assert breaker.isOpen()
+
+
+def test_staysClosedBelowTheMinimumCalls(clock: _FakeClock, registry: MetricsRegistry):
+    breaker = __breaker(clock, registry)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(__fail)
+    assert not breaker.isOpen()
+
+
+def test_halfOpenTrialClosesOrReopens(clock: _FakeClock, registry: MetricsRegistry):
+    breaker = __breaker(clock, registry, minimumCalls=1)
+    with pytest.raises(ConnectionError):
+        breaker.call(__fail)
+    clock.now += 30
+    assert breaker.report()["state"] == "half_open"
+    with pytest.raises(ConnectionError):
+        breaker.call(__fail)
+    assert breaker.isOpen()
+    clock.now += 30
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.report()["state"] == "closed"
+
+
+def test_disabledBreakerOnlyCalls(clock: _FakeClock, registry: MetricsRegistry):
+    breaker = __breaker(clock, registry, enabled=False, minimumCalls=1)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(__fail)
+    assert breaker.call(lambda: "ok") == "ok"
+    assert registry.snapshot()["counters"] == {}
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.dialogflow_cache import DetectIntentCache, menuVersion
+from utils.metrics import MetricsRegistry
+
+SESSION = "projects/p/agent/sessions/5585999171902"
+
+
+def __response(intent: str, *contexts: str):
+    outputContexts = [SimpleNamespace(name=f"{SESSION}/contexts/{name}", lifespan_count=2) for name in contexts]
+    return SimpleNamespace(query_result=SimpleNamespace(intent=SimpleNamespace(display_name=intent),
+                                                        output_contexts=outputContexts))
+
+
+@pytest.fixture
+def registry() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+def __ask(cache: DetectIntentCache, sessions: dict, message: str, response, session: str = SESSION):
+    """What getDialogFlowResponse does, with `sessions` for the shared carts keeping each session's contexts and
+    `response` standing for Dialogflow's answer."""
+    key, cached = cache.lookup(message, "pt-BR", sessions.get(session))
+    if cached is not None:
+        return cached
+    sessions[session] = cache.store(key, response)
+    return response
+
+
+def test_unknownSessionsAreNeverServedFromCache(registry: MetricsRegistry):
+    cache = DetectIntentCache(metrics=registry)
+    assert cache.lookup("Oi", "pt-BR", None) == (None, None)
+    assert cache.store(None, __response("Default Fallback Intent", "smalltalk")) == {"smalltalk"}
+    assert cache.report()["entries"] == 0
+
+
+def test_keyUsesTheCallersMessageKeyAndTheContexts(registry: MetricsRegistry):
+    cache = DetectIntentCache(messageKey=str.casefold, metrics=registry)
+    sessions = {}
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    fallback = __response("Default Fallback Intent")
+    assert __ask(cache, sessions, "Você entrega?", fallback) is fallback
+    assert __ask(cache, sessions, "VOCÊ ENTREGA?", __response("other")) is fallback
+    assert __ask(cache, sessions, "você entrega?", __response("other"), session=SESSION + "0") is not fallback
+    counters = registry.snapshot()["counters"]
+    assert (counters["dialogflow.cache.hits"], counters["dialogflow.cache.misses"]) == (1, 3)
+
+
+def test_contextsAreTheCallers(registry: MetricsRegistry):
+    """A worker that learns of new contexts through the shared carts doesn't get answers cached under old ones."""
+    cache = DetectIntentCache(metrics=registry)
+    sessions = {}
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    fallback = __response("Default Fallback Intent")
+    __ask(cache, sessions, "quanto custa?", fallback)
+    sessions[SESSION] = frozenset({"order-pizza-followup"})
+    assert __ask(cache, sessions, "quanto custa?", __response("Price", "order-pizza-followup")) is not fallback
+
+
+def test_stateChangingResponsesAreNotCached(registry: MetricsRegistry):
+    cache = DetectIntentCache(metrics=registry)
+    sessions = {}
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    __ask(cache, sessions, "uma calabresa", __response("Order.pizza"))
+    __ask(cache, sessions, "oi", __response("Welcome", "order-pizza-followup"))
+    assert cache.report()["entries"] == 0
+    assert registry.snapshot()["counters"]["dialogflow.cache.uncacheable"] == 3
+
+
+def test_newVersionEvictsEverything(registry: MetricsRegistry):
+    cache = DetectIntentCache(metrics=registry)
+    cache.setVersion(("1", menuVersion({"Pizzas": []})))
+    sessions = {}
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    cache.setVersion(("1", menuVersion({"Pizzas": []})))
+    assert cache.report()["entries"] == 1
+    cache.setVersion(("2", menuVersion({"Pizzas": []})))
+    assert cache.report()["entries"] == 0
+
+
+def test_entriesAreBounded(registry: MetricsRegistry):
+    cache = DetectIntentCache(maxEntries=2, metrics=registry)
+    sessions = {}
+    __ask(cache, sessions, "oi", __response("Default Fallback Intent"))
+    for message in ["a", "b", "a", "c"]:
+        __ask(cache, sessions, message, __response("Default Fallback Intent"))
+    assert [key[0] for key in cache.entries] == ["a", "c"]
+    assert registry.snapshot()["gauges"]["dialogflow.cache.entries"] == 2
@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from utils.dialogflow_gateway import DialogflowGateway, DialogflowTimeoutError
+from utils.metrics import MetricsRegistry
+
+
+class _FakeAsyncClient:
+    """Answers with the request's text as the matched intent after `delay` seconds."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.inFlight = 0
+        self.maxInFlight = 0
+
+    async def detect_intent(self, request=None, timeout=None):
+        self.inFlight += 1
+        self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.inFlight -= 1
+        return SimpleNamespace(query_result=SimpleNamespace(intent=SimpleNamespace(display_name=request)))
+
+
+@pytest.fixture
+def registry() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+def __gateway(client: _FakeAsyncClient, registry: MetricsRegistry, **kwargs) -> DialogflowGateway:
+    return DialogflowGateway(clientFactory=lambda: client, metrics=registry, **kwargs)
+
+
+def test_syncFacadeReturnsTheResponseAndRecordsLatencyPerIntent(registry: MetricsRegistry):
+    gateway = __gateway(_FakeAsyncClient(), registry)
+    try:
+        response = gateway.detectIntent("Order.pizza")
+    finally:
+        gateway.close()
+    assert response.query_result.intent.display_name == "Order.pizza"
+    assert registry.snapshot()["histograms"]["dialogflow.detect_intent_seconds.Order.pizza"]["count"] == 1
+
+
+def test_slowCallsHitTheirDeadline(registry: MetricsRegistry):
+    gateway = __gateway(_FakeAsyncClient(delay=1.0), registry, timeout=0.05)
+    try:
+        with pytest.raises(DialogflowTimeoutError):
+            gateway.detectIntent("Welcome")
+    finally:
+        gateway.close()
+    assert registry.snapshot()["counters"]["dialogflow.timeouts"] == 1
+
+
+def test_inFlightCallsAreCapped(registry: MetricsRegistry):
+    client = _FakeAsyncClient(delay=0.02)
+    gateway = __gateway(client, registry, maxInFlight=3)
+    try:
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            responses = list(executor.map(gateway.detectIntent, ["Welcome"] * 24))
+    finally:
+        gateway.close()
+    assert len(responses) == 24
+    assert client.maxInFlight == 3
+    assert registry.snapshot()["gauges"]["dialogflow.in_flight"] == 0
+
+
+def test_asyncCallersAwaitFromTheirOwnLoop(registry: MetricsRegistry):
+    gateway = __gateway(_FakeAsyncClient(delay=0.01), registry)
+
+    async def askTwice():
+        return await asyncio.gather(asyncio.wrap_future(gateway.submit("Welcome")),
+                                    asyncio.wrap_future(gateway.submit("Order.drink")))
+
+    try:
+        responses = asyncio.run(askTwice())
+    finally:
+        gateway.close()
+    assert [response.query_result.intent.display_name for response in responses] == ["Welcome", "Order.drink"]
@@ -0,0 +1,12 @@
+import json
+
+from utils.general_utils import sendWebhookCallback
+
+
+def test_webhookCallbackIsCompactJson(capsys):
+    response = sendWebhookCallback("Qual pizza você vai querer?")
+    body = response.get_data(as_text=True)
+    assert response.mimetype == "application/json"
+    assert body == '{"source":"dialogFlow","fulfillmentText":"Qual pizza você vai querer?"}'
+    assert json.loads(body)["fulfillmentText"] == "Qual pizza você vai querer?"
+    assert capsys.readouterr().out == ""